@@ -1,6 +1,197 @@
+import asyncio
+import collections
+import threading
 import unittest
+from time import monotonic, perf_counter, sleep
 
-from datetime import date, time, datetime, timedelta
+from datetime import date, time, datetime, timedelta, timezone
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from support import benchmark
+
+
+_DIGITS_TO_D = str.maketrans('0123456789', 'dddddddddd')
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# 快速路径无法处理的字符串，按 (形状（数字替换为 d 之后的字符串）, formats) 缓存各自的解析函数，
+# 最多缓存 _MAX_PARSERS 个，超出时淘汰最久未使用的
+_parsers = collections.OrderedDict()
+_parsers_lock = threading.Lock()
+_MAX_PARSERS = 1024
+# 除 fromisoformat 以外，依次尝试的 strptime 格式
+FALLBACK_FORMATS = ('%Y/%m/%d %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%d/%b/%Y:%H:%M:%S %z', '%Y%m%dT%H%M%S', '%Y%m%d')
+
+
+def parse_iso_datetimes(strings, formats=()):
+    """把一批 ISO 8601 格式的时间字符串转换为 NumPy 的 datetime64[us] 数组；需要安装 numpy
+
+    快速路径：不带时区的 ISO 8601 字符串（如 2021-11-24T17:41:24.700623 或 2021-11-24 17:41:24）
+    直接交给 NumPy 在 C 层面批量解析，不经过 Python 层的循环。
+    其他情况（带时区、其他格式）退回到逐个解析：每种形状的字符串第一次出现时，确定用 fromisoformat
+    还是 formats/FALLBACK_FORMATS 中的哪个格式并缓存起来；之后的字符串先尝试上一个字符串的解析函数，
+    失败时才重新按形状查找。带时区的时间会被转换为 UTC。
+    """
+    if numpy is None:
+        raise ImportError('parse_iso_datetimes() requires numpy')
+    strings = strings if isinstance(strings, (list, tuple)) else list(strings)
+    # NumPy 会把带时区的字符串转换为 UTC 并给出警告，这类字符串要退回到逐个解析。
+    # 这里事先检查，而不是用 warnings.catch_warnings 把警告变为错误：警告过滤器是全局的，修改它会影响其他线程。
+    # 时区只能是 Z 或者 +/- 开头的偏移量，不带时区的字符串中正好有两个 -
+    joined = '\n'.join(strings)
+    if 'Z' not in joined and '+' not in joined and joined.count('-') == 2 * len(strings):
+        try:
+            values = numpy.array(strings, dtype='datetime64[us]')
+        except ValueError:
+            # 日期不存在（如 2021-02-29）或者是其他格式，交给逐个解析
+            pass
+        else:
+            # NumPy 把 '' 和 'NaT' 解析为 NaT，它们不是合法的时间，同样交给逐个解析引发 ValueError
+            if not numpy.isnat(values).any():
+                return values
+
+    micros = []
+    parser = _parser_for(strings[0], formats) if strings else None
+    for s in strings:
+        # 同一批数据通常是同一种格式，每个解析函数要么返回正确的结果，要么引发 ValueError，因此可以直接尝试
+        try:
+            dt = parser(s)
+        except ValueError:
+            parser = _parser_for(s, formats)
+            dt = parser(s)
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        # 直接用 datetime 对象构建数组很慢，先换算为自 1970 年以来的微秒数
+        micros.append((dt - _EPOCH) // _MICROSECOND)
+    return numpy.array(micros, dtype=numpy.int64).view('datetime64[us]')
+
+
+def _parser_for(s, formats):
+    # 同一种形状在不同的 formats 下可能对应不同的解析函数，所以 formats 也是 key 的一部分
+    key = (s.translate(_DIGITS_TO_D), tuple(formats))
+    with _parsers_lock:
+        parser = _parsers.get(key)
+        if parser is not None:
+            _parsers.move_to_end(key)
+            return parser
+    parser = _find_parser(s, formats)
+    with _parsers_lock:
+        _parsers[key] = parser
+        if len(_parsers) > _MAX_PARSERS:
+            _parsers.popitem(last=False)
+    return parser
+
+
+def _parse_utc(s):
+    # 以 Z 结尾的时间本身就是 UTC，去掉 Z 后得到的不带时区的时间就是结果，省去时区转换
+    if not s.endswith('Z'):
+        raise ValueError(f'Invalid isoformat string: {s!r}')
+    return datetime.fromisoformat(s[:-1])
+
+
+def _find_parser(sample, formats):
+    try:
+        datetime.fromisoformat(sample)
+    except ValueError:
+        pass
+    else:
+        return _parse_utc if sample.endswith('Z') else datetime.fromisoformat
+    for fmt in (*formats, *FALLBACK_FORMATS):
+        try:
+            datetime.strptime(sample, fmt)
+        except ValueError:
+            continue
+        return lambda s, fmt=fmt: datetime.strptime(s, fmt)
+    raise ValueError(f'unsupported datetime format: {sample!r}')
+
+
+def floor_datetimes(values, unit):
+    """把 datetime64 数组向下取整到分钟（'m'）、小时（'h'）或天（'D'），用于按时间分桶"""
+    return values.astype(f'datetime64[{unit}]').astype(values.dtype)
+
+
+def milliseconds(values):
+    """返回 datetime64 数组中每个时间的毫秒部分（0~999），相当于对每个元素计算 microsecond // 1000"""
+    return ((values - values.astype('datetime64[s]')) // numpy.timedelta64(1, 'ms')).astype(numpy.int64)
+
+
+class CachedClock:
+    """按固定的精度（resolution 秒）刷新的缓存时钟，用于在热点路径上代替 datetime.now()
+
+    刷新由后台线程（start）或 asyncio 事件循环的定时回调（start_on_loop）完成，每次刷新时预先计算好
+    当前时间、格式化后的时间字符串和 monotonic 时间，调用方读取时只是取出一个已有的元组，没有任何对象的创建。
+    代价是读到的时间最多会落后 resolution 秒。
+    """
+
+    def __init__(self, resolution=0.001, timespec='milliseconds'):
+        self.resolution = resolution
+        self.timespec = timespec
+        self._snapshot = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self._handle = None
+        self.refresh()
+
+    def refresh(self):
+        now = datetime.now()
+        # 三个值放在同一个元组中整体替换，读取时不会读到来自两次刷新的值
+        self._snapshot = (now, now.isoformat(sep=' ', timespec=self.timespec), monotonic())
+
+    def now(self):
+        """缓存的当前时间，相当于 datetime.now()"""
+        return self._snapshot[0]
+
+    def isoformat(self):
+        """缓存的、已经格式化好的当前时间字符串，如 2021-11-24 17:41:24.700"""
+        return self._snapshot[1]
+
+    def monotonic(self):
+        """缓存的 time.monotonic() 值，用于计算耗时"""
+        return self._snapshot[2]
+
+    def since(self, start):
+        """从 start（之前某次 monotonic() 的返回值）到现在经过的秒数"""
+        return self._snapshot[2] - start
+
+    def start(self):
+        """启动后台线程刷新"""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='cached-clock', daemon=True)
+        self._thread.start()
+        return self
+
+    def start_on_loop(self, loop=None):
+        """在 asyncio 事件循环中定时刷新，不需要额外的线程"""
+        loop = loop or asyncio.get_running_loop()
+
+        def tick():
+            self.refresh()
+            self._handle = loop.call_later(self.resolution, tick)
+
+        tick()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _run(self):
+        while not self._stopped.wait(self.resolution):
+            self.refresh()
 
 
 # TODO datetime.now() 和  datetime.today() 的区别
@@ -32,6 +223,121 @@ class DateTimeTest(unittest.TestCase):
         datetime.today()
         datetime.now()
 
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_parse_iso_datetimes(self):
+        """测试批量解析 ISO 8601 时间字符串为 datetime64[us] 数组"""
+        strings = ['2021-11-24T17:41:24.700623', '1969-12-31T23:59:59.000001', '2020-02-29T00:00:00.000000']
+        values = parse_iso_datetimes(strings)
+        self.assertEqual(numpy.dtype('datetime64[us]'), values.dtype)
+        self.assertEqual([datetime.fromisoformat(s) for s in strings], values.tolist())
+
+        # 不同精度的 ISO 8601 字符串可以混在一起
+        strings = ['2021-11-24 17:41:24', '2021-11-24T17:41:24.5', '2021-11-24T17:41', '2021-11-24']
+        self.assertEqual([datetime.fromisoformat(s) for s in strings], parse_iso_datetimes(strings).tolist())
+
+        # 带时区或其他格式的字符串退回到逐个解析，带时区的时间被转换为 UTC
+        strings = ['2021-11-24T17:41:24Z', '2021-11-24T17:41:24+08:00', '24/11/2021 17:41:24', '20211124T174124']
+        self.assertEqual([datetime(2021, 11, 24, 17, 41, 24), datetime(2021, 11, 24, 9, 41, 24),
+                          datetime(2021, 11, 24, 17, 41, 24), datetime(2021, 11, 24, 17, 41, 24)],
+                         parse_iso_datetimes(strings).tolist())
+        # 也可以指定额外的格式
+        self.assertEqual([datetime(2021, 11, 24)], parse_iso_datetimes(['Nov 24 2021'], formats=['%b %d %Y']).tolist())
+        # 同一种形状的字符串，指定的格式优先于已经缓存的默认格式
+        self.assertEqual([datetime(2021, 12, 11)], parse_iso_datetimes(['11/12/2021 00:00:00']).tolist())
+        self.assertEqual([datetime(2021, 11, 12)],
+                         parse_iso_datetimes(['11/12/2021 00:00:00'], formats=['%m/%d/%Y %H:%M:%S']).tolist())
+        # 缓存的解析函数数量有上限
+        for i in range(_MAX_PARSERS + 10):
+            parse_iso_datetimes(['2021-11-24T17:41:24Z'], formats=[f'%Y {i}'])
+        self.assertEqual(_MAX_PARSERS, len(_parsers))
+
+        # 非法的日期会引发 ValueError
+        with self.assertRaises(ValueError):
+            parse_iso_datetimes(['2021-02-29T00:00:00'])
+        with self.assertRaises(ValueError):
+            parse_iso_datetimes(['hello world'])
+        # 负的时区偏移量同样退回到逐个解析，不会触发 NumPy 的警告
+        self.assertEqual([datetime(2021, 11, 24, 22, 41, 24), datetime(2021, 11, 24)],
+                         parse_iso_datetimes(['2021-11-24T17:41:24-05:00', '2021-11-24']).tolist())
+        # NumPy 会把空字符串和 NaT 解析为 NaT，这里同样是非法的
+        for s in ('', 'NaT', 'nat'):
+            with self.assertRaises(ValueError):
+                parse_iso_datetimes(['2021-11-24T17:41:24', s])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_floor_datetimes_and_milliseconds(self):
+        """测试向量化的按分钟、小时、天分桶，以及获取毫秒部分"""
+        values = parse_iso_datetimes(['2021-11-24T17:41:24.700623', '1969-12-31T23:59:59.999999'])
+        self.assertEqual([datetime(2021, 11, 24, 17, 41), datetime(1969, 12, 31, 23, 59)],
+                         floor_datetimes(values, 'm').tolist())
+        self.assertEqual([datetime(2021, 11, 24, 17), datetime(1969, 12, 31, 23)], floor_datetimes(values, 'h').tolist())
+        self.assertEqual([datetime(2021, 11, 24), datetime(1969, 12, 31)], floor_datetimes(values, 'D').tolist())
+        # 等同于 test_dateime 中的 now.microsecond // 1000
+        self.assertEqual([700, 999], milliseconds(values).tolist())
+
+    def test_cached_clock(self):
+        """测试由后台线程刷新的缓存时钟"""
+        with CachedClock(resolution=0.001) as clock:
+            first, start = clock.now(), clock.monotonic()
+            # 两次刷新之间读到的是同一个对象，不会创建新的 datetime
+            self.assertIs(clock.now(), clock.now())
+            # 格式化后的字符串精确到毫秒，如 2021-11-24 17:41:24.700
+            self.assertEqual(23, len(clock.isoformat()))
+            self.assertLess(datetime.now() - datetime.fromisoformat(clock.isoformat()), timedelta(seconds=0.05))
+            sleep(0.05)
+            self.assertGreater(clock.now(), first)
+            self.assertGreaterEqual(clock.since(start), 0.04)
+            # 缓存的时间最多落后 resolution 秒，这里留出一些调度的余量
+            self.assertLess(datetime.now() - clock.now(), timedelta(seconds=0.05))
+
+        # 停止后不再刷新
+        stopped = clock.now()
+        sleep(0.01)
+        self.assertIs(stopped, clock.now())
+
+    def test_cached_clock_on_loop(self):
+        """测试在 asyncio 事件循环中刷新的缓存时钟"""
+        async def main():
+            clock = CachedClock(resolution=0.001).start_on_loop()
+            first = clock.now()
+            await asyncio.sleep(0.05)
+            clock.stop()
+            return first, clock.now()
+
+        first, last = asyncio.run(main())
+        self.assertGreater(last, first)
+
+
+@benchmark
+class DateTimeBenchmarks(unittest.TestCase):
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_bench_parse_iso_datetimes(self):
+        """比较 100 万个时间字符串时 parse_iso_datetimes 和 fromisoformat、strptime 循环的耗时"""
+        start = datetime(2021, 11, 24, 17, 41, 24, 700623)
+        strings = [(start + timedelta(microseconds=k * 1_234_567)).isoformat(timespec='microseconds') for k in range(1_000_000)]
+        for name, parse in (
+                ('fromisoformat loop', lambda: [datetime.fromisoformat(s) for s in strings]),
+                ('strptime loop', lambda: [datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%f') for s in strings]),
+                ('parse_iso_datetimes', lambda: parse_iso_datetimes(strings)),
+                ('parse (fallback)', lambda: parse_iso_datetimes([s + 'Z' for s in strings]))):
+            begin = perf_counter()
+            parse()
+            print(f'{name:<20} {perf_counter() - begin:8.3f}s')
+
+    def test_bench_cached_clock(self):
+        """比较每次调用 datetime.now().isoformat() 和读取 CachedClock 的开销"""
+        n = 1_000_000
+        with CachedClock() as clock:
+            for name, func in (('datetime.now()', datetime.now),
+                               ('datetime.now().isoformat()', lambda: datetime.now().isoformat(sep=' ', timespec='milliseconds')),
+                               ('CachedClock.now()', clock.now),
+                               ('CachedClock.isoformat()', clock.isoformat)):
+                begin = perf_counter()
+                for _ in range(n):
+                    func()
+                print(f'{name:<28} {(perf_counter() - begin) / n * 1e9:8.1f} ns/call')
+
 
 # 入口函数
 if __name__ == '__main__':
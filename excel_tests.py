@@ -1,9 +1,229 @@
+import csv
+import datetime
+import itertools
+import os
+import tempfile
 import unittest
+from concurrent.futures.process import BrokenProcessPool
 
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
 
-class MyTestCase(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)  # add assertion here
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from support import benchmark, run_isolated
+
+
+def iter_sheet_rows(path, sheet=None, min_row=1, max_col=None):
+    """以只读模式流式读取工作表（默认为活动工作表），逐行返回单元格的值组成的元组
+
+    read_only=True 时 openpyxl 边解析 XML 边返回行，不会为每个单元格创建 Cell 对象，内存占用与行数无关；
+    data_only=True 时公式单元格返回上次计算的结果而不是公式本身。
+    write_only 模式保存的工作表没有记录尺寸，行末尾的空单元格不会返回，需要等长的行时用 max_col 指定列数。
+    """
+    if openpyxl is None:
+        raise ImportError('iter_sheet_rows() requires openpyxl')
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.active if sheet is None else wb[sheet]
+        yield from ws.iter_rows(min_row=min_row, max_col=max_col, values_only=True)
+    finally:
+        # 只读模式会一直打开着文件，需要显式关闭
+        wb.close()
+
+
+def write_sheet(path, rows, header=None, title='Sheet'):
+    """以只写模式把 rows（可以是生成器）写入一个新的工作簿，返回写入的行数（不含表头）
+
+    write_only=True 时每一行在 append 之后立即被序列化到临时文件，内存占用与行数无关，但只能按顺序追加，不能回头修改。
+    """
+    if openpyxl is None:
+        raise ImportError('write_sheet() requires openpyxl')
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    if header is not None:
+        ws.append(header)
+    count = 0
+    for row in rows:
+        ws.append(row)
+        count += 1
+    wb.save(path)
+    return count
+
+
+def _write_csv_chunk(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _write_parquet_chunk(path, header, rows, schema=None):
+    """写入一个 parquet 文件，返回使用的 schema；schema 为 None 时由 pyarrow 根据这一块的数据推断"""
+    columns = list(zip(*rows))
+    table = pyarrow.table({name: list(column) for name, column in zip(header, columns)}, schema=schema)
+    pyarrow.parquet.write_table(table, path)
+    return table.schema
+
+
+def export_chunks(path, out_dir, chunk_size=100_000, format='csv', sheet=None):
+    """流式读取工作表，第一行作为表头，每 chunk_size 行导出为 out_dir 下的一个文件（part-00000.csv 等），返回文件路径列表
+
+    format 为 'csv' 或 'parquet'（需要 pyarrow），每个文件都带有表头（parquet 中为列名），可以独立地被下游并行处理。
+    parquet 的列类型由第一块数据推断，之后的每一块都使用同一个 schema，避免某一块中的列全为空等情况下推断出不同的类型。
+    """
+    if format == 'parquet' and pyarrow is None:
+        raise ImportError("export_chunks(format='parquet') requires pyarrow")
+    if format not in ('csv', 'parquet'):
+        raise ValueError(f'unknown format: {format!r}')
+    reader = iter_sheet_rows(path, sheet)
+    try:
+        header = next(reader, None)
+        if header is None:
+            return []
+        # 表头之前读不到，不能用 max_col，这里把末尾缺少的空单元格补齐
+        width = len(header)
+        rows = (row + (None,) * (width - len(row)) if len(row) < width else row for row in reader)
+        paths = []
+        schema = None
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            paths.append(os.path.join(out_dir, f'part-{len(paths):05d}.{format}'))
+            if format == 'csv':
+                _write_csv_chunk(paths[-1], header, chunk)
+            else:
+                schema = _write_parquet_chunk(paths[-1], header, chunk, schema)
+        return paths
+    finally:
+        reader.close()
+
+
+HEADER = ('id', 'name', 'amount', 'created', 'note')
+
+
+def _generate_rows(n):
+    created = datetime.datetime(2022, 1, 1)
+    for i in range(n):
+        yield i, f'user-{i % 1000}', i * 0.25, created + datetime.timedelta(minutes=i), None if i % 3 else 'ok'
+
+
+def _bench_excel(path, strategy, n):
+    """用 run_isolated 在子进程中执行，返回处理的行数，分块导出时返回文件数"""
+    if strategy == 'write normal':
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(HEADER)
+        for row in _generate_rows(n):
+            ws.append(row)
+        wb.save(path)
+        count = n
+    elif strategy == 'write write_only':
+        count = write_sheet(path, _generate_rows(n), HEADER)
+    elif strategy == 'read normal':
+        wb = openpyxl.load_workbook(path)
+        count = sum(1 for _ in wb.active.iter_rows(min_row=2, values_only=True))
+    elif strategy == 'read read_only':
+        count = sum(1 for _ in iter_sheet_rows(path, min_row=2))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            count = len(export_chunks(path, tmp, format=strategy.split()[-1]))
+    return count
+
+
+@unittest.skipIf(openpyxl is None, 'openpyxl is not installed')
+class ExcelTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'report.xlsx')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_write_and_read(self):
+        self.assertEqual(1000, write_sheet(self.path, _generate_rows(1000), HEADER, title='report'))
+        rows = list(iter_sheet_rows(self.path, max_col=len(HEADER)))
+        self.assertEqual(HEADER, rows[0])
+        self.assertEqual(list(_generate_rows(1000)), rows[1:])
+        wb = openpyxl.load_workbook(self.path, read_only=True)
+        try:
+            self.assertEqual(['report'], wb.sheetnames)
+        finally:
+            wb.close()
+
+        rows = iter_sheet_rows(self.path, 'report', min_row=1000)
+        self.assertEqual((998, 'user-998', 249.5), next(rows)[:3])
+        rows.close()
+        # 不指定 max_col 时末尾的空单元格被省略
+        self.assertEqual([5, 4, 4], [len(row) for row in itertools.islice(iter_sheet_rows(self.path, min_row=2), 3)])
+        with self.assertRaises(KeyError):
+            next(iter_sheet_rows(self.path, 'missing'))
+
+    def test_export_csv_chunks(self):
+        write_sheet(self.path, _generate_rows(1000), HEADER)
+        paths = export_chunks(self.path, self.tmp.name, chunk_size=400)
+        self.assertEqual(['part-00000.csv', 'part-00001.csv', 'part-00002.csv'], [os.path.basename(p) for p in paths])
+
+        rows = []
+        for path in paths:
+            with open(path, newline='', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                self.assertEqual(list(HEADER), next(reader))
+                rows += list(reader)
+        self.assertEqual(1000, len(rows))
+        self.assertEqual(['999', 'user-999', '249.75', '2022-01-01 16:39:00', 'ok'], rows[-1])
+        self.assertEqual(['998', 'user-998', '249.5', '2022-01-01 16:38:00', ''], rows[-2])
+
+        with self.assertRaises(ValueError):
+            export_chunks(self.path, self.tmp.name, format='json')
+        # 只有表头的工作表
+        write_sheet(self.path, [], HEADER)
+        self.assertEqual([], export_chunks(self.path, self.tmp.name))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_export_parquet_chunks(self):
+        write_sheet(self.path, _generate_rows(1000), HEADER)
+        paths = export_chunks(self.path, self.tmp.name, chunk_size=600, format='parquet')
+        tables = [pyarrow.parquet.read_table(path) for path in paths]
+        self.assertEqual([600, 400], [table.num_rows for table in tables])
+        self.assertEqual(list(HEADER), tables[0].column_names)
+        self.assertEqual(list(range(600, 1000)), tables[1].column('id').to_pylist())
+
+        # 第二块中 note 列全为空，仍然使用第一块推断出的 string 类型
+        write_sheet(self.path, ((i, 'ok' if i < 600 else None) for i in range(1000)), ('id', 'note'))
+        paths = export_chunks(self.path, self.tmp.name, chunk_size=600, format='parquet')
+        schemas = [pyarrow.parquet.read_schema(path) for path in paths]
+        self.assertEqual(pyarrow.string(), schemas[1].field('note').type)
+        self.assertEqual(schemas[0], schemas[1])
+
+
+@benchmark
+@unittest.skipIf(openpyxl is None, 'openpyxl is not installed')
+class ExcelBenchmarks(unittest.TestCase):
+
+    def test_bench_normal_vs_streaming(self):
+        """比较普通模式和流式模式（write_only/read_only）写入、读取 100 万行的每秒行数和峰值内存，以及分块导出 CSV/Parquet"""
+        strategies = ['write write_only', 'write normal', 'read read_only', 'read normal', 'export csv']
+        if pyarrow is not None:
+            strategies.append('export parquet')
+        n = 1_000_000
+        with tempfile.TemporaryDirectory() as tmp:
+            for strategy in strategies:
+                # 两种写入方式写到不同的文件，读取使用 write_only 生成的文件
+                path = os.path.join(tmp, 'normal.xlsx' if strategy == 'write normal' else 'rows.xlsx')
+                try:
+                    count, elapsed, rss = run_isolated(_bench_excel, path, strategy, n)
+                except BrokenProcessPool:
+                    # 普通模式需要把所有单元格放在内存中，内存不足时子进程会被杀死
+                    print(f'{strategy:<17} failed (out of memory?)')
+                    continue
+                print(f'{strategy:<17} {n / elapsed:10.0f} rows/s  peak RSS {rss / (1 << 20):8.1f} MB'
+                      + (f'  {count} chunks' if strategy.startswith('export') else ''))
 
 
 if __name__ == '__main__':
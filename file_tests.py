@@ -1,10 +1,423 @@
 import io
+import json
+import mmap
 import pathlib
 import collections
+import re
+import stat
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 import unittest
 import os
 
+from support import benchmark, generate_lines_file, run_isolated
+
+
+def iter_lines(f, chunk_size=1 << 20):
+    """逐行迭代一个以二进制模式打开的文件，每一行以 memoryview 的形式返回（包含行尾的 \\n）
+
+    对于普通文件，使用 mmap 将文件映射到内存，返回的每一行都是映射区上的切片，不会产生任何拷贝；
+    对于管道、socket 等不支持随机访问的流，退化为按 chunk_size 分块读取。
+
+    NOTE: 在 mmap 模式下，返回的 memoryview 只在迭代期间有效，如果需要保留某一行，请使用 bytes(line) 拷贝出来。
+    """
+    try:
+        fd = f.fileno()
+        is_regular = stat.S_ISREG(os.fstat(fd).st_mode) and f.seekable()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        is_regular = False
+
+    # 长度为 0 的文件无法被 mmap（ValueError: cannot mmap an empty file），走分块读取即可
+    if is_regular and os.fstat(fd).st_size > f.tell():
+        return _iter_mmap_lines(f)
+    return _iter_chunk_lines(f, chunk_size)
+
+
+def _iter_mmap_lines(f, window=16 << 20):
+    """基于 mmap 逐行迭代，从文件对象的当前位置开始"""
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # 告诉内核这是顺序读取，内核会加大预读并尽早回收已读过的页
+    if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    view = memoryview(mm)
+    size = len(mm)
+    start = f.tell()
+    released = start - start % mmap.PAGESIZE
+    try:
+        while start < size:
+            end = mm.find(b'\n', start)
+            end = size if end < 0 else end + 1
+            yield view[start:end]
+            start = end
+
+            # 每读过一个窗口，就把已读过的页从映射中丢弃，使得 RSS 不会随着文件大小增长。
+            # 映射是只读的文件映射，即使调用方还持有之前的行，再次访问时内核会重新从 page cache 中载入，内容不受影响。
+            if start - released >= window and hasattr(mmap, 'MADV_DONTNEED'):
+                length = (start - released) // mmap.PAGESIZE * mmap.PAGESIZE
+                mm.madvise(mmap.MADV_DONTNEED, released, length)
+                released += length
+        f.seek(size)
+    finally:
+        view.release()
+        try:
+            mm.close()
+        except BufferError:
+            # 调用方仍然持有某一行的 memoryview，交给垃圾回收去关闭
+            pass
+
+
+def _iter_chunk_lines(f, chunk_size):
+    """分块读取并逐行迭代，适用于管道等不能 mmap 的流"""
+    # 不完整的行先按块保存起来，遇到换行符时再一次性拼接。
+    # 如果每读一块都和之前的剩余部分拼接，一个跨越很多块的长行会被反复拷贝，开销与行长的平方成正比。
+    pending = []
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        start = 0
+        if pending:
+            end = chunk.find(b'\n')
+            if end < 0:
+                pending.append(chunk)
+                continue
+            pending.append(chunk[:end + 1])
+            yield memoryview(b''.join(pending))
+            pending = []
+            start = end + 1
+        view = memoryview(chunk)
+        while True:
+            end = chunk.find(b'\n', start)
+            if end < 0:
+                break
+            yield view[start:end + 1]
+            start = end + 1
+        if start < len(chunk):
+            pending.append(chunk[start:])
+    if pending:
+        yield memoryview(b''.join(pending))
+
+
+def split_file(path, parts):
+    """将文件按字节切分为 parts 个区间 [start, end)，每个区间的边界都对齐到行首
+
+    做法和 test_seeking 中演示的一样：先 seek 到大致的切分点，再 readline 跳过半行，最后用 tell 得到真正的边界。
+    """
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(max(size * i // parts, boundaries[-1]))
+            if f.tell() > 0:
+                # 如果切分点前一个字节恰好是换行符，则当前位置已经是行首，不需要再跳过
+                f.seek(-1, 1)
+                f.readline()
+            boundaries.append(f.tell())
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def _scan_range(path, start, end, mode, pattern=None, field=None, sep=None, chunk_size=4 << 20):
+    """在工作进程中扫描文件的 [start, end) 区间，返回该区间的部分结果"""
+    regex = re.compile(pattern) if pattern is not None else None
+    result = 0
+    pending = b''
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if mode == 'count':
+                # 计数不需要拆分成行，直接在整个块上数换行符最快
+                result += chunk.count(b'\n')
+                continue
+            chunk = pending + chunk
+            cut = chunk.rfind(b'\n')
+            if cut < 0:
+                pending = chunk
+                continue
+            pending = chunk[cut + 1:]
+            # 和 count 一样只把 \n 当作行分隔符，不能用 splitlines，它还会在 \r、\x0b 等字符处断行
+            result += _scan_lines(chunk[:cut].split(b'\n'), mode, regex, field, sep)
+        if mode == 'count':
+            # 区间以不带换行符的最后一行结尾
+            f.seek(end - 1)
+            if end > start and f.read(1) != b'\n':
+                result += 1
+        elif pending:
+            result += _scan_lines([pending], mode, regex, field, sep)
+    return result
+
+
+def _scan_lines(lines, mode, regex, field, sep):
+    if mode == 'grep':
+        search = regex.search
+        return sum(1 for line in lines if search(line))
+    if mode == 'sum':
+        return sum(float(line.split(sep)[field]) for line in lines if line)
+    raise ValueError(f'unknown scan mode: {mode!r}')
+
+
+def scan_file(path, mode='count', *, pattern=None, field=None, sep=None, workers=None):
+    """使用进程池并行扫描一个大文件，将各个区间的部分结果合并后返回
+
+    mode 可以是：
+    count: 统计行数
+    grep: 统计匹配正则表达式 pattern（bytes）的行数
+    sum: 将每行按 sep 分隔后，对第 field 列求和
+    """
+    if mode not in ('count', 'grep', 'sum'):
+        raise ValueError(f'unknown scan mode: {mode!r}')
+    # 在启动工作进程之前检查参数，而不是等到每个工作进程都失败
+    if mode == 'grep' and pattern is None:
+        raise ValueError("scan_file(mode='grep') requires pattern")
+    if mode == 'sum' and field is None:
+        raise ValueError("scan_file(mode='sum') requires field")
+    workers = workers or os.cpu_count()
+    ranges = split_file(path, workers)
+    if not ranges:
+        return 0
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+        futures = [executor.submit(_scan_range, path, start, end, mode, pattern, field, sep)
+                   for start, end in ranges]
+        return sum(future.result() for future in futures)
+
+
+DirChanges = collections.namedtuple('DirChanges', ['added', 'removed', 'modified'])
+
+
+class DirWalker:
+    """增量式目录遍历器
+
+    使用 os.scandir 遍历目录，并把每个文件的 (size, mtime, inode) 以及每个目录的 mtime 和子项名称保存到磁盘上的索引文件中。
+    再次扫描时，mtime 没有变化的目录说明其中没有新增、删除或重命名的子项，不再调用 scandir 列出其内容，直接沿用索引中的子项。
+
+    check_files 为 True 时（默认），仍会对未变化目录中的文件逐个 stat，以发现内容被修改的文件（修改文件内容不会改变目录的 mtime）；
+    设置为 False 时，只检测新增和删除，以及发生变化的目录中被修改的文件，这样未变化的目录完全不需要 stat 其中的文件。
+    """
+
+    def __init__(self, root, index_path, check_files=True):
+        self.root = os.fspath(root)
+        self.index_path = index_path
+        self.check_files = check_files
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}, {}
+        return index['dirs'], index['files']
+
+    def _save_index(self, dirs, files):
+        # 先写入临时文件再替换，避免中途中断导致索引文件损坏
+        tmp = f'{self.index_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'dirs': dirs, 'files': files}, f, separators=(',', ':'))
+        os.replace(tmp, self.index_path)
+
+    def scan(self):
+        """扫描目录树，返回与上一次扫描相比新增、删除和修改的文件路径，并更新索引"""
+        old_dirs, old_files = self._load_index()
+        new_dirs, new_files = {}, {}
+
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path, follow_symlinks=False).st_mtime_ns
+            except FileNotFoundError:
+                continue
+
+            old = old_dirs.get(path)
+            if old is not None and old['mtime'] == mtime:
+                # 目录的 mtime 没有变化，说明子项名称没有变化，不需要 scandir
+                new_dirs[path] = old
+                stack.extend(os.path.join(path, name) for name in old['dirs'])
+                for name in old['files']:
+                    file = os.path.join(path, name)
+                    if self.check_files:
+                        try:
+                            st = os.stat(file, follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue
+                        new_files[file] = [st.st_size, st.st_mtime_ns, st.st_ino]
+                    elif file in old_files:
+                        new_files[file] = old_files[file]
+                continue
+
+            dirs, files = [], []
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        # is_dir 在大多数平台上直接使用 readdir 返回的类型信息，不需要额外的系统调用
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.name)
+                            stack.append(entry.path)
+                        else:
+                            st = entry.stat(follow_symlinks=False)
+                            files.append(entry.name)
+                            new_files[entry.path] = [st.st_size, st.st_mtime_ns, entry.inode()]
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            new_dirs[path] = {'mtime': mtime, 'dirs': dirs, 'files': files}
+
+        self._save_index(new_dirs, new_files)
+        added = sorted(new_files.keys() - old_files.keys())
+        removed = sorted(old_files.keys() - new_files.keys())
+        modified = sorted(path for path in new_files.keys() & old_files.keys() if new_files[path] != old_files[path])
+        return DirChanges(added, removed, modified)
+
+
+class AppendLog:
+    """持久化的追加日志写入器，支持多线程并发提交，并使用组提交（group commit）合并 fsync
+
+    调用 append 的线程只是把记录放入队列并得到一个 Future；后台线程把一段时间窗口内（max_delay 秒）
+    或达到 max_batch 条的记录合并为一次 writev 调用，然后只做一次 fsync，再统一完成这一批 Future。
+    这样多个写入者共同分摊一次 fsync 的开销，而每条记录在 Future 完成时都已经落盘。
+    """
+
+    def __init__(self, path, max_batch=1024, max_delay=0.002):
+        # 和 open(path, 'a') 一样，以追加模式打开，不存在则创建
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='append-log', daemon=True)
+        self._thread.start()
+
+    def append(self, record):
+        """提交一条记录（bytes），返回的 Future 会在记录被 fsync 到磁盘后完成"""
+        if not isinstance(record, (bytes, bytearray, memoryview)):
+            raise TypeError(f"a bytes-like object is required, not '{type(record).__name__}'")
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise ValueError('I/O operation on closed append log.')
+            self._pending.append((record, future))
+            self._cond.notify()
+        return future
+
+    def write(self, record):
+        """提交一条记录并等待其落盘"""
+        self.append(record).result()
+
+    def close(self):
+        """等待所有已提交的记录落盘后关闭文件"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        os.close(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # 第一条记录到达后，最多再等待 max_delay 秒，让更多的写入者加入这一批
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.max_batch and not self._closed:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+
+            try:
+                self._write_all([record for record, _ in batch])
+                os.fsync(self._fd)
+            except Exception as e:
+                # 不只是 OSError：任何异常都要交给这一批的 Future，否则后台线程退出后，这些写入者和之后的写入者都会永远等待
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+
+    def _write_all(self, records):
+        if not hasattr(os, 'writev'):
+            os.write(self._fd, b''.join(records))
+            return
+        # 单次 writev 最多只能提交 IOV_MAX 个缓冲区
+        step = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+        for i in range(0, len(records), step):
+            group = records[i:i + step]
+            written = os.writev(self._fd, group)
+            total = sum(len(record) for record in group)
+            if written < total:
+                # 发生了部分写入，把剩余部分写完
+                rest = memoryview(b''.join(group))[written:]
+                while rest:
+                    rest = rest[os.write(self._fd, rest):]
+
+
+def _bench_append(threads, records, append):
+    """多线程写入 records 条记录，返回 (每秒记录数, 提交延迟 p99 毫秒)"""
+    latencies = []
+    record = b'2021-11-24 17:41:24.700623 INFO hello world\n'
+
+    def worker():
+        for _ in range(records // threads):
+            begin = time.perf_counter()
+            append(record)
+            latencies.append(time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        for future in [executor.submit(worker) for _ in range(threads)]:
+            future.result()
+    elapsed = time.perf_counter() - begin
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+def _generate_tree(root, files, per_dir=1000):
+    """生成一个包含 files 个空文件的目录树，每个目录下最多 per_dir 个文件"""
+    for i in range(files):
+        if i % per_dir == 0:
+            directory = os.path.join(root, f'{i // (per_dir * per_dir)}', f'{i // per_dir}')
+            os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, f'{i}.txt'), 'wb').close()
+
+
+def _bench_read_lines(path, strategy):
+    """用 run_isolated 在子进程中执行，返回 (行数, 字节数)"""
+    lines = nbytes = 0
+    with open(path, 'rb') as f:
+        if strategy == 'iter_lines':
+            for line in iter_lines(f):
+                lines += 1
+                nbytes += len(line)
+        elif strategy == 'for line in f':
+            for line in f:
+                lines += 1
+                nbytes += len(line)
+        elif strategy == 'readlines':
+            for line in f.readlines():
+                lines += 1
+                nbytes += len(line)
+    return lines, nbytes
+
 # 与文件相关的各种操作在 os.path 里提供了各种方法；
 # 在 3.4.0 之后，建议使用 pathlib.Path 操作目录和文件，使用更方便
 # 可以通过内置的 open 函数来访问文件，该函数返回一个 file object 对象（<class '_io.TextIOWrapper'>）
@@ -156,6 +569,138 @@ class FileTests(unittest.TestCase):
         for line in list(f):
             print(line)
 
+    def test_iter_lines_with_mmap(self):
+        """测试基于 mmap 的逐行迭代，返回的每一行都是 memoryview，不会拷贝文件内容"""
+        with open('1.md', 'rb') as f:
+            lines = list(iter_lines(f))
+            # 和 for line in f 的结果一致，行尾的 \\n 会被保留
+            self.assertEqual([b'hello\n', b'world'], [bytes(line) for line in lines])
+            self.assertIs(memoryview, type(lines[0]))
+            # 迭代完成后，文件对象位于文件末尾
+            self.assertEqual(11, f.tell())
+
+        # 从文件对象的当前位置开始迭代
+        with open('1.md', 'rb') as f:
+            f.seek(6)
+            self.assertEqual([b'world'], [bytes(line) for line in iter_lines(f)])
+
+    def test_iter_lines_with_pipe(self):
+        """测试管道等不支持随机访问的流，此时会退化为分块读取"""
+        r, w = os.pipe()
+        with open(r, 'rb') as reader:
+            with open(w, 'wb') as writer:
+                writer.write(b'hello\nworld\n' * 3)
+            self.assertFalse(reader.seekable())
+            # 故意使用很小的块，验证跨块的行能被正确拼接
+            lines = [bytes(line) for line in iter_lines(reader, chunk_size=4)]
+        self.assertEqual([b'hello\n', b'world\n'] * 3, lines)
+
+        # 跨越多个块的长行，以及末尾没有换行符的行
+        r, w = os.pipe()
+        with open(r, 'rb') as reader:
+            with open(w, 'wb') as writer:
+                writer.write(b'a' * 30 + b'\nb\n\nc')
+            lines = [bytes(line) for line in iter_lines(reader, chunk_size=4)]
+        self.assertEqual([b'a' * 30 + b'\n', b'b\n', b'\n', b'c'], lines)
+
+    def test_split_file(self):
+        """测试将文件按字节切分为对齐到行首的多个区间"""
+        # 1.md 的内容为 hello\nworld，无论怎么切，边界都只能落在 0、6、11 上
+        self.assertEqual([(0, 11)], split_file('1.md', 1))
+        self.assertEqual([(0, 6), (6, 11)], split_file('1.md', 2))
+        self.assertEqual([(0, 6), (6, 11)], split_file('1.md', 8))
+
+    def test_scan_file(self):
+        """测试使用进程池并行扫描文件"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'numbers.txt')
+            with open(path, 'w') as f:
+                f.writelines(f'{i} {"even" if i % 2 == 0 else "odd"}\n' for i in range(1000))
+
+            self.assertEqual(1000, scan_file(path, workers=4))
+            self.assertEqual(500, scan_file(path, 'grep', pattern=rb'even$', workers=4))
+            self.assertEqual(sum(range(1000)), scan_file(path, 'sum', field=0, workers=4))
+            # 并行扫描的结果和单进程扫描的结果一致
+            self.assertEqual(scan_file(path, workers=1), scan_file(path, workers=3))
+            with self.assertRaises(ValueError):
+                scan_file(path, 'max')
+            with self.assertRaises(ValueError):
+                scan_file(path, 'grep')
+
+            # 只有 \n 是行分隔符，各种模式看到的行数一致
+            with open(path, 'wb') as f:
+                f.write(b'a\rb\n\nc\x0bd')
+            self.assertEqual(3, scan_file(path, workers=2))
+            self.assertEqual(3, scan_file(path, 'grep', pattern=rb'', workers=2))
+
+    def test_dir_walker(self):
+        """测试增量式目录遍历器"""
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp, 'root')
+            (root / 'a' / 'b').mkdir(parents=True)
+            (root / '1.md').write_text('hello')
+            (root / 'a' / 'b' / '2.md').write_text('world')
+            walker = DirWalker(root, os.path.join(tmp, 'index.json'))
+
+            # 第一次扫描，所有文件都是新增的
+            changes = walker.scan()
+            self.assertEqual([str(root / '1.md'), str(root / 'a' / 'b' / '2.md')], changes.added)
+            self.assertEqual(([], []), (changes.removed, changes.modified))
+
+            # 没有任何变化
+            self.assertEqual(DirChanges([], [], []), walker.scan())
+
+            # 新增、删除、修改各一个文件
+            (root / 'a' / '3.md').touch()
+            (root / '1.md').unlink()
+            (root / 'a' / 'b' / '2.md').write_text('hello world')
+            changes = walker.scan()
+            self.assertEqual([str(root / 'a' / '3.md')], changes.added)
+            self.assertEqual([str(root / '1.md')], changes.removed)
+            self.assertEqual([str(root / 'a' / 'b' / '2.md')], changes.modified)
+
+    def test_append_log(self):
+        """测试多线程通过 AppendLog 追加写入，并使用组提交合并 fsync"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'append.log')
+            Path(path).write_text('hello\n')
+            with AppendLog(path, max_batch=16, max_delay=0.01) as log:
+                # 在 with 语句结束时会等待所有记录落盘并关闭文件，不会泄漏文件句柄
+                with ThreadPoolExecutor(4) as executor:
+                    futures = [executor.submit(log.write, f'{i}\n'.encode()) for i in range(100)]
+                for future in futures:
+                    self.assertIsNone(future.result())
+                # append 返回一个 Future，完成时记录已经落盘
+                log.append(b'done\n').result()
+
+            # 追加模式，原有内容会被保留；多个线程的记录之间没有顺序保证
+            lines = Path(path).read_text().splitlines()
+            self.assertEqual('hello', lines[0])
+            self.assertEqual({str(i) for i in range(100)}, set(lines[1:-1]))
+            self.assertEqual(101, len(lines[1:]))
+            self.assertEqual('done', lines[-1])
+
+            # 关闭后不能再写入
+            with self.assertRaises(ValueError):
+                log.append(b'closed\n')
+
+    def test_append_log_errors(self):
+        """测试写入出错时异常交给对应的 Future，后台线程继续处理之后的记录"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'append.log')
+            with AppendLog(path, max_delay=0) as log:
+                with self.assertRaises(TypeError):
+                    log.write('text\n')
+
+                # 模拟写入时发生的非 OSError 异常
+                write_all = log._write_all
+                log._write_all = lambda records: 1 / 0
+                with self.assertRaises(ZeroDivisionError):
+                    log.write(b'lost\n')
+                log._write_all = write_all
+                log.write(b'ok\n')
+            self.assertEqual('ok\n', Path(path).read_text())
+
     def test_get_current_work_dir(self):
         """测试获取当前工作目录的几种方式以及相互之间的比较
         """
@@ -363,5 +908,87 @@ class FileTests(unittest.TestCase):
         #                st_atime=1638094154, st_mtime=1638094151, st_ctime=1638094151)
 
 
+@benchmark
+class FileBenchmarks(unittest.TestCase):
+
+    def test_bench_read_lines(self):
+        """比较 iter_lines、for line in f 和 readlines 的吞吐量和峰值内存"""
+        with tempfile.TemporaryDirectory() as tmp:
+            for size in (100 << 20, 1 << 30):
+                path = os.path.join(tmp, f'{size >> 20}MB.log')
+                generate_lines_file(path, size)
+                for strategy in ('iter_lines', 'for line in f', 'readlines'):
+                    (lines, nbytes), elapsed, rss = run_isolated(_bench_read_lines, path, strategy)
+                    print(f'{size >> 20:>5} MB  {strategy:<14} {lines:>10} lines  '
+                          f'{nbytes / elapsed / (1 << 20):8.1f} MB/s  peak RSS {rss / (1 << 20):8.1f} MB')
+
+    def test_bench_scan_file(self):
+        """比较单线程 for line in f 和不同进程数下 scan_file 的耗时"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, '1GB.log')
+            generate_lines_file(path, 1 << 30)
+            size = os.path.getsize(path)
+
+            begin = time.perf_counter()
+            with open(path, 'rb') as f:
+                expected = sum(1 for line in f if b'INFO' in line)
+            baseline = time.perf_counter() - begin
+            print(f'for line in f  {size / baseline / (1 << 20):8.1f} MB/s')
+
+            workers = 1
+            while True:
+                begin = time.perf_counter()
+                self.assertEqual(expected, scan_file(path, 'grep', pattern=rb'INFO', workers=workers))
+                elapsed = time.perf_counter() - begin
+                print(f'{workers:>3} workers    {size / elapsed / (1 << 20):8.1f} MB/s  speedup x{baseline / elapsed:.2f}')
+                if workers >= os.cpu_count():
+                    break
+                workers = min(workers * 2, os.cpu_count())
+
+    def test_bench_dir_walker(self):
+        """比较 Path.rglob 全量扫描和 DirWalker 增量扫描 100 万个文件的耗时"""
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, 'root')
+            _generate_tree(root, 1_000_000)
+
+            begin = time.perf_counter()
+            # 为了能发现被修改的文件，rglob 也需要 stat 每一个文件
+            stats = {str(path): path.stat() for path in Path(root).rglob('*') if path.is_file()}
+            print(f'Path.rglob + stat        {time.perf_counter() - begin:8.2f}s  {len(stats)} files')
+
+            for check_files in (True, False):
+                walker = DirWalker(root, os.path.join(tmp, f'index-{check_files}.json'), check_files)
+                begin = time.perf_counter()
+                walker.scan()
+                print(f'DirWalker first scan     {time.perf_counter() - begin:8.2f}s  check_files={check_files}')
+
+                Path(root, '0', '0', 'new.txt').touch()
+                begin = time.perf_counter()
+                changes = walker.scan()
+                print(f'DirWalker rescan         {time.perf_counter() - begin:8.2f}s  check_files={check_files}')
+                self.assertEqual(1, len(changes.added))
+                os.remove(os.path.join(root, '0', '0', 'new.txt'))
+
+    def test_bench_append_log(self):
+        """比较组提交和每次写入都 fsync 的吞吐量和 p99 提交延迟"""
+        with tempfile.TemporaryDirectory() as tmp:
+            for threads in (1, 8, 64):
+                fd = os.open(os.path.join(tmp, f'fsync-{threads}.log'), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+                lock = threading.Lock()
+
+                def append(record):
+                    with lock:
+                        os.write(fd, record)
+                        os.fsync(fd)
+
+                rate, p99 = _bench_append(threads, 2000, append)
+                os.close(fd)
+                print(f'{threads:>3} threads  fsync per write  {rate:10.0f} records/s  p99 {p99:8.2f} ms')
+
+                with AppendLog(os.path.join(tmp, f'group-{threads}.log')) as log:
+                    rate, p99 = _bench_append(threads, 2000, log.write)
+                print(f'{threads:>3} threads  group commit     {rate:10.0f} records/s  p99 {p99:8.2f} ms')
+
+
 if __name__ == '__main__':
     unittest.main()
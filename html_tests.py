@@ -1,9 +1,392 @@
+import collections
+import multiprocessing
+import os
+import re
+import tempfile
+import time
 import unittest
+from html import escape
+from html.parser import HTMLParser
 
+from support import benchmark
 
-class MyTestCase(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)  # add assertion here
+
+# 没有结束标签的元素
+VOID_ELEMENTS = frozenset('area base br col embed hr img input link meta param source track wbr'.split())
+
+Field = collections.namedtuple('Field', ['selector', 'attr', 'many'], defaults=(None, False))
+Field.__doc__ = """要提取的字段：selector 为 CSS 选择器；attr 为 None 时取元素的文本，否则取该属性；many 为 True 时返回所有匹配的元素"""
+
+# 支持的 CSS 选择器子集：标签名或 *、#id、.class、[attr]、[attr=value]，以及后代（空格）和子元素（>）组合符
+_TOKEN = re.compile(r'\s*(>)\s*|\s+|([^\s>]+)')
+_COMPOUND = re.compile(r'(\*|[\w-]+)?((?:[#.][\w-]+|\[[^\]]+\])*)$')
+_PART = re.compile(r'([#.])([\w-]+)|\[\s*([\w-]+)\s*(?:=\s*(["\']?)(.*?)\4\s*)?\]')
+
+_Compound = collections.namedtuple('_Compound', ['combinator', 'tag', 'id', 'classes', 'attrs'])
+
+
+def compile_selector(selector):
+    """把 CSS 选择器解析为从左到右的 _Compound 列表，不支持的语法引发 ValueError"""
+    compounds = []
+    combinator = ' '
+    for match in _TOKEN.finditer(selector.strip()):
+        if match.group(1):
+            combinator = '>'
+        elif match.group(2):
+            compound = _COMPOUND.match(match.group(2))
+            if compound is None:
+                raise ValueError(f'unsupported selector: {selector!r}')
+            tag, id_, classes, attrs = compound.group(1), None, [], []
+            for part in _PART.finditer(compound.group(2)):
+                if part.group(1) == '#':
+                    id_ = part.group(2)
+                elif part.group(1) == '.':
+                    classes.append(part.group(2))
+                else:
+                    attrs.append((part.group(3), part.group(5) if part.group(4) is not None or part.group(5) else None))
+            compounds.append(_Compound(combinator if compounds else None, None if tag in (None, '*') else tag.lower(),
+                                       id_, tuple(classes), tuple(attrs)))
+            combinator = ' '
+    if not compounds or combinator == '>':
+        raise ValueError(f'unsupported selector: {selector!r}')
+    return compounds
+
+
+def selector_to_xpath(selector):
+    """把 CSS 选择器翻译为等价的 XPath 表达式"""
+    parts = []
+    for compound in compile_selector(selector):
+        step = ('//' if compound.combinator != '>' else '/') + (compound.tag or '*')
+        if compound.id is not None:
+            step += f'[@id="{compound.id}"]'
+        for cls in compound.classes:
+            step += f'[contains(concat(" ", normalize-space(@class), " "), " {cls} ")]'
+        for name, value in compound.attrs:
+            step += f'[@{name}]' if value is None else f'[@{name}="{value}"]'
+        parts.append(step)
+    return ''.join(parts)
+
+
+class Node:
+    """html.parser 后端构建的轻量文档树节点，children 中是 Node 或文本"""
+    __slots__ = ('tag', 'attrs', 'children', 'parent')
+
+    def __init__(self, tag, attrs, parent):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = []
+        self.parent = parent
+
+    def iter(self):
+        """按文档顺序遍历所有后代节点"""
+        stack = [iter(self.children)]
+        while stack:
+            for child in stack[-1]:
+                if child.__class__ is Node:
+                    yield child
+                    stack.append(iter(child.children))
+                    break
+            else:
+                stack.pop()
+
+    @property
+    def text(self):
+        chunks = []
+        stack = [iter(self.children)]
+        while stack:
+            for child in stack[-1]:
+                if child.__class__ is Node:
+                    stack.append(iter(child.children))
+                    break
+                chunks.append(child)
+            else:
+                stack.pop()
+        return ''.join(chunks)
+
+
+class _TreeBuilder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node('#document', {}, None)
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        parent = self.stack[-1]
+        node = Node(tag, dict(attrs), parent)
+        parent.children.append(node)
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        parent = self.stack[-1]
+        parent.children.append(Node(tag, dict(attrs), parent))
+
+    def handle_endtag(self, tag):
+        # 关闭最近的同名元素，中间没有关闭的元素一起关闭，找不到时忽略这个结束标签
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                return
+
+    def handle_data(self, data):
+        self.stack[-1].children.append(data)
+
+
+def parse_html(html):
+    """用标准库 html.parser 把 HTML 解析为 Node 树，返回根节点"""
+    builder = _TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+def _match_compound(node, compound):
+    if compound.tag is not None and node.tag != compound.tag:
+        return False
+    attrs = node.attrs
+    if compound.id is not None and attrs.get('id') != compound.id:
+        return False
+    if compound.classes:
+        classes = (attrs.get('class') or '').split()
+        if not all(cls in classes for cls in compound.classes):
+            return False
+    for name, value in compound.attrs:
+        if name not in attrs if value is None else attrs.get(name) != value:
+            return False
+    return True
+
+
+def _match(node, compounds, i):
+    """从右向左匹配：node 匹配 compounds[i]，并且它的祖先满足前面的部分"""
+    compound = compounds[i]
+    if not _match_compound(node, compound):
+        return False
+    if i == 0:
+        return True
+    parent = node.parent
+    if compound.combinator == '>':
+        return parent.parent is not None and _match(parent, compounds, i - 1)
+    while parent.parent is not None:
+        if _match(parent, compounds, i - 1):
+            return True
+        parent = parent.parent
+    return False
+
+
+def select(root, compounds):
+    """返回 root 的后代中匹配已编译的选择器的所有节点"""
+    last = len(compounds) - 1
+    return [node for node in root.iter() if _match(node, compounds, last)]
+
+
+def _normalize(text):
+    return ' '.join(text.split())
+
+
+def _load_html_backend(name):
+    """返回 (编译选择器, 解析文档, 查询, 取文本, 取属性) 五个函数"""
+    if name == 'html.parser':
+        return compile_selector, parse_html, select, lambda node: node.text, lambda node, attr: node.attrs.get(attr)
+    if name == 'lxml':
+        from lxml import etree, html as lxml_html
+        return (lambda selector: etree.XPath(selector_to_xpath(selector)), lxml_html.fromstring,
+                lambda root, xpath: xpath(root), lambda elem: elem.text_content(), lambda elem, attr: elem.get(attr))
+    if name == 'selectolax':
+        # selectolax 1.0 起只保留了 lexbor 引擎
+        from selectolax.lexbor import LexborHTMLParser
+        # selectolax 的查询直接使用 CSS 选择器字符串，这里只检查它在各个后端共同支持的子集内
+        return (lambda selector: compile_selector(selector) and selector, LexborHTMLParser,
+                lambda tree, selector: tree.css(selector), lambda node: node.text(deep=True),
+                lambda node, attr: node.attributes.get(attr))
+    raise ValueError(f'unknown HTML backend: {name!r}')
+
+
+def available_html_backends():
+    """返回当前环境中已安装的 HTML 解析库名称，按速度从快到慢排列"""
+    backends = []
+    for name in ('selectolax', 'lxml', 'html.parser'):
+        try:
+            _load_html_backend(name)
+        except ImportError:
+            continue
+        backends.append(name)
+    return backends
+
+
+class Extractor:
+    """按预先编译的选择器从 HTML 中提取字段
+
+    fields 把字段名映射到 Field 或 CSS 选择器字符串（相当于 Field(selector)）。选择器在创建时只编译一次，
+    之后每个页面只需要解析和查询。文本会合并连续的空白字符；没有匹配的元素时，字段的值为 None（many 时为空列表）。
+    backend 为 None 时使用已安装的最快的解析库。Extractor 可以被 pickle，在子进程中会重新编译选择器。
+    """
+
+    def __init__(self, fields, backend=None):
+        self.fields = {name: Field(field) if isinstance(field, str) else field for name, field in fields.items()}
+        self.backend = backend or available_html_backends()[0]
+        self._compile()
+
+    def _compile(self):
+        compile_, self._parse, self._select, self._text, self._attr = _load_html_backend(self.backend)
+        self._compiled = [(name, compile_(field.selector), field) for name, field in self.fields.items()]
+
+    def __getstate__(self):
+        return {'fields': self.fields, 'backend': self.backend}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile()
+
+    def _value(self, node, field):
+        return _normalize(self._text(node)) if field.attr is None else self._attr(node, field.attr)
+
+    def extract(self, html):
+        """从一个页面中提取所有字段，返回 dict"""
+        root = self._parse(html)
+        record = {}
+        for name, compiled, field in self._compiled:
+            nodes = self._select(root, compiled)
+            if field.many:
+                record[name] = [self._value(node, field) for node in nodes]
+            else:
+                record[name] = self._value(nodes[0], field) if nodes else None
+        return record
+
+    def extract_file(self, path):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return path, self.extract(f.read())
+
+
+# 子进程中使用的 extractor，由 _init_worker 在子进程启动时设置
+_worker_extractor = None
+
+
+def _init_worker(extractor):
+    global _worker_extractor
+    _worker_extractor = extractor
+
+
+def _extract_file(path):
+    return _worker_extractor.extract_file(path)
+
+
+def extract_files(paths, extractor, processes=None, chunksize=64):
+    """用 processes 个进程批量提取保存的页面，按 paths 的顺序逐个返回 (path, record)
+
+    processes 为 1 时在当前进程中执行；为 None 时使用 CPU 核数。每个子进程只接收一次 extractor，
+    任务以 chunksize 个文件为一组分发，减少进程间通信的次数。
+    """
+    if processes == 1:
+        yield from map(extractor.extract_file, paths)
+        return
+    # extractor 通过 initializer 在每个子进程启动时传入一次，而不是随每组任务一起序列化
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(extractor,)) as pool:
+        yield from pool.imap(_extract_file, paths, chunksize)
+
+
+def _generate_page(i):
+    """生成一个类似搜索结果页的 HTML 页面，大约 20 KB"""
+    results = ''.join(
+        f'<li class="result{" featured" if j == 0 else ""}"><h3><a href="/doc/{i}/{j}">Result {j} of page {i}</a></h3>'
+        f'<p class="summary">Summary for {escape("<result>")} {j}&nbsp;with <b>bold</b> text.</p>'
+        f'<span class="meta" data-score="{j * 10}">score</span></li>\n'
+        for j in range(50))
+    return (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Search page {i}</title>'
+            f'<link rel="stylesheet" href="/style.css"></head>\n<body><div id="header"><form><input name="q" '
+            f'value="query {i}"></form></div>\n<div id="content"><ul class="results">\n{results}</ul>'
+            f'<p>Page {i}<br>end</div><div id="footer"><a href="/about">About</a></div></body></html>\n')
+
+
+FIELDS = {
+    'title': 'title',
+    'query': Field('input[name=q]', 'value'),
+    'featured': '#content li.featured > h3 a',
+    'links': Field('ul.results > li h3 > a', 'href', many=True),
+    'scores': Field('span.meta[data-score]', 'data-score', many=True),
+    'missing': 'div.nothing',
+}
+
+
+class HtmlTests(unittest.TestCase):
+
+    def test_selectors(self):
+        root = parse_html('<div id="a" class="x y"><p>1<b>2</b></p><span><p class="y">3</p></span></div><p>4</p>')
+        texts = lambda selector: [node.text for node in select(root, compile_selector(selector))]
+        self.assertEqual(['12', '3', '4'], texts('p'))
+        self.assertEqual(['12', '3'], texts('div p'))
+        self.assertEqual(['12'], texts('div > p'))
+        self.assertEqual(['3'], texts('#a span > .y'))
+        self.assertEqual(['123'], texts('div.y.x[id=a]'))
+        self.assertEqual(['3'], texts('[class="y"]'))
+        self.assertEqual(['2'], texts('* > p > b'))
+        for selector in ('', 'div >', 'a:hover', 'a::before'):
+            with self.assertRaises(ValueError):
+                compile_selector(selector)
+
+        self.assertEqual('//div[@id="a"]/p[contains(concat(" ", normalize-space(@class), " "), " y ")][@href]',
+                         selector_to_xpath('div#a > p.y[href]'))
+
+    def test_parse_html(self):
+        """测试不规范的 HTML：没有结束标签的元素、多余的结束标签和字符引用"""
+        root = parse_html('<ul><li>a<li>b &amp; c</ul></span><img src="x.png"><br/><p>d')
+        self.assertEqual(['li', 'li'], [node.tag for node in select(root, compile_selector('ul li'))])
+        self.assertEqual('ab & c', select(root, compile_selector('ul'))[0].text)
+        self.assertEqual(['img', 'br', 'p'], [node.tag for node in root.children[1:]])
+
+    def test_extractor(self):
+        """测试每个已安装的解析库提取的结果都相同"""
+        html = _generate_page(7)
+        expected = {
+            'title': 'Search page 7',
+            'query': 'query 7',
+            'featured': 'Result 0 of page 7',
+            'links': [f'/doc/7/{j}' for j in range(50)],
+            'scores': [str(j * 10) for j in range(50)],
+            'missing': None,
+        }
+        for backend in available_html_backends():
+            with self.subTest(backend=backend):
+                self.assertEqual(expected, Extractor(FIELDS, backend).extract(html))
+        self.assertEqual({'p': 'Summary for <result> 0 with bold text.'},
+                         Extractor({'p': 'p.summary'}, 'html.parser').extract(html))
+        with self.assertRaises(ValueError):
+            Extractor(FIELDS, 'regex')
+
+    def test_extract_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i in range(20):
+                paths.append(os.path.join(tmp, f'{i}.html'))
+                with open(paths[-1], 'w', encoding='utf-8') as f:
+                    f.write(_generate_page(i))
+            extractor = Extractor({'title': 'title'}, 'html.parser')
+            for processes in (1, 2):
+                results = list(extract_files(paths, extractor, processes, chunksize=3))
+                self.assertEqual([(path, {'title': f'Search page {i}'}) for i, path in enumerate(paths)], results)
+
+
+@benchmark
+class HtmlBenchmarks(unittest.TestCase):
+
+    def test_bench_extract(self):
+        """比较各个解析库的每秒页面数，以及 1 到 N 个进程的批量提取速度"""
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i in range(2000):
+                paths.append(os.path.join(tmp, f'{i}.html'))
+                with open(paths[-1], 'w', encoding='utf-8') as f:
+                    f.write(_generate_page(i))
+
+            for backend in available_html_backends():
+                extractor = Extractor(FIELDS, backend)
+                processes = 1
+                while True:
+                    begin = time.perf_counter()
+                    count = sum(1 for _ in extract_files(paths, extractor, processes))
+                    print(f'{backend:<12} processes {processes:>2}  {count / (time.perf_counter() - begin):8.0f} pages/s')
+                    if processes >= os.cpu_count():
+                        break
+                    processes = min(processes * 2, os.cpu_count())
 
 
 if __name__ == '__main__':
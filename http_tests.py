@@ -1,9 +1,433 @@
+import collections
+import hashlib
+import http.client
+import queue
+import random
+import socket
+import threading
+import time
 import unittest
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
 
+from support import benchmark
 
-class MyTestCase(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)  # add assertion here
+
+Response = collections.namedtuple('Response', ['status', 'headers', 'body', 'from_cache'])
+
+# 可以安全重试的方法（幂等），以及值得重试的状态码
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+# 连接层面的错误：连接被对方关闭、重置、超时等
+CONNECTION_ERRORS = (ConnectionError, TimeoutError, http.client.RemoteDisconnected, http.client.IncompleteRead)
+
+
+class HostPool:
+    """同一个 host 的 keep-alive 连接池，最多同时有 max_connections 个请求在进行，空闲的连接放回池中复用"""
+
+    def __init__(self, scheme, host, port, max_connections=8, timeout=10.0):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.created = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        self.created += 1
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """在一个池中的连接上发送请求，返回 (status, headers, body)
+
+        复用的空闲连接可能已经被服务端关闭，这时幂等的请求在新连接上立即重发一次，不算作重试；
+        非幂等的请求（如 POST）无法确定服务端是否已经处理过，不会被重发，异常直接抛给调用方。
+        """
+        with self._slots:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._connect(), False
+            try:
+                try:
+                    response = self._send(conn, method, path, body, headers)
+                except CONNECTION_ERRORS + (BrokenPipeError,):
+                    conn.close()
+                    if not reused or method not in IDEMPOTENT_METHODS:
+                        raise
+                    conn = self._connect()
+                    response = self._send(conn, method, path, body, headers)
+                # 必须读完响应体，连接才能被复用
+                data = response.read()
+            except BaseException:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._idle.put(conn)
+            return response.status, response.headers, data
+
+    @staticmethod
+    def _send(conn, method, path, body, headers):
+        conn.request(method, path, body, headers or {})
+        return conn.getresponse()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class HttpClient:
+    """线程安全的 HTTP 客户端：按 host 划分的 keep-alive 连接池、带抖动的指数退避重试，以及基于 ETag/Last-Modified 的缓存
+
+    重试只用于幂等方法，在连接错误或 429/502/503/504 时进行，第 n 次重试前等待 [0, min(max_backoff, backoff * 2 ** n)]
+    之间的随机时间（full jitter），避免大量客户端在同一时刻重试；响应带有 Retry-After 秒数时等待该时间。
+
+    缓存只用于 GET：响应带有 ETag 或 Last-Modified 时保存下来，下次请求同一个 URL 时发送条件请求，
+    服务端返回 304 时直接使用缓存的响应（from_cache 为 True）。最多缓存 cache_size 个 URL，为 0 时不缓存。
+    """
+
+    def __init__(self, max_per_host=8, retries=3, backoff=0.1, max_backoff=5.0, cache_size=1024, timeout=10.0):
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._pools = {}
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = self._pools[key] = HostPool(scheme, host, port, self.max_per_host, self.timeout)
+        return pool
+
+    def request(self, method, url, body=None, headers=None):
+        method = method.upper()
+        parts = urlsplit(url)
+        pool = self._pool(parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {})
+
+        cached = self._cache.get(url) if method == 'GET' and self.cache_size else None
+        if cached is not None:
+            if cached.headers.get('ETag'):
+                headers.setdefault('If-None-Match', cached.headers['ETag'])
+            if cached.headers.get('Last-Modified'):
+                headers.setdefault('If-Modified-Since', cached.headers['Last-Modified'])
+
+        retries = self.retries if method in IDEMPOTENT_METHODS else 0
+        for attempt in range(retries + 1):
+            try:
+                status, response_headers, data = pool.request(method, path, body, headers)
+            except CONNECTION_ERRORS:
+                if attempt == retries:
+                    raise
+                self._sleep(attempt)
+                continue
+            if status in RETRY_STATUSES and attempt < retries:
+                self._sleep(attempt, response_headers.get('Retry-After'))
+                continue
+            break
+
+        if status == 304 and cached is not None:
+            # 请求期间 url 可能已经被其他线程淘汰，所以重新放入缓存，而不只是 move_to_end
+            self._cache_put(url, cached)
+            return cached._replace(from_cache=True)
+        response = Response(status, response_headers, data, False)
+        if method == 'GET' and self.cache_size and status == 200 and (
+                'ETag' in response_headers or 'Last-Modified' in response_headers):
+            self._cache_put(url, response)
+        return response
+
+    def _cache_put(self, url, response):
+        with self._lock:
+            self._cache[url] = response
+            self._cache.move_to_end(url)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def get(self, url, headers=None):
+        return self.request('GET', url, headers=headers)
+
+    def _sleep(self, attempt, retry_after=None):
+        if retry_after is not None and retry_after.isdigit():
+            delay = min(self.max_backoff, int(retry_after))
+        else:
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        time.sleep(delay)
+
+    @property
+    def connections_created(self):
+        return sum(pool.created for pool in self._pools.values())
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _LocalHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 才支持 keep-alive
+    protocol_version = 'HTTP/1.1'
+    # 头部和响应体分两次写出，keep-alive 连接上 Nagle 算法和延迟确认叠加会让每个请求等待约 40 毫秒
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.open_sockets.add(self.connection)
+
+    def finish(self):
+        super().finish()
+        with self.server.lock:
+            self.server.open_sockets.discard(self.connection)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try:
+            getattr(self, f'_get_{parts.path.strip("/") or "data"}', self._not_found)(query)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def _reply(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_found(self, query):
+        self._reply(404)
+
+    def _get_data(self, query):
+        """返回 size 字节的数据，带 ETag 和 Last-Modified，支持条件请求"""
+        body = b'x' * int(query.get('size', 64))
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        headers = [('ETag', etag), ('Last-Modified', self.server.last_modified)]
+        if self.headers.get('If-None-Match') == etag:
+            self._reply(304, headers=headers)
+        else:
+            self._reply(200, body, headers)
+
+    def _get_dated(self, query):
+        """只有 Last-Modified 的资源"""
+        if self.headers.get('If-Modified-Since') == self.server.last_modified:
+            self._reply(304)
+        else:
+            self._reply(200, b'dated', [('Last-Modified', self.server.last_modified)])
+
+    def _get_flaky(self, query):
+        """前 fail 次请求返回 503，之后返回 200"""
+        key = query.get('key', '')
+        with self.server.lock:
+            self.server.attempts[key] += 1
+            attempt = self.server.attempts[key]
+        if attempt <= int(query.get('fail', 1)):
+            self._reply(503, b'unavailable', [('Retry-After', query['retry_after'])] if 'retry_after' in query else [])
+        else:
+            self._reply(200, b'ok')
+
+    def _get_slow(self, query):
+        time.sleep(float(query.get('delay', 0.05)))
+        self._reply(200, b'slow')
+
+    def _get_close(self, query):
+        """响应后关闭连接"""
+        self.close_connection = True
+        self._reply(200, b'closed', [('Connection', 'close')])
+
+
+class LocalHttpServer(ThreadingHTTPServer):
+    """用于测试和基准测试的本地 HTTP/1.1 服务器，记录建立的连接数、请求数和同时处理的最大请求数"""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _LocalHandler)
+        self.lock = threading.Lock()
+        self.connections = self.requests = self.active = self.max_active = 0
+        self.attempts = collections.Counter()
+        self.open_sockets = set()
+        self.last_modified = formatdate(usegmt=True)
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='local-http', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        # 处理 keep-alive 连接的线程在 shutdown() 之后仍然在运行，主动关闭这些连接
+        with self.lock:
+            for sock in self.open_sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def _fetch_new_connection(url):
+    """每个请求都建立新连接（urllib 总是发送 Connection: close），作为基准测试的对照"""
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+class HttpTests(unittest.TestCase):
+
+    def test_keep_alive(self):
+        """测试同一个 host 的多个请求复用同一个连接"""
+        with LocalHttpServer() as server, HttpClient(cache_size=0) as client:
+            for size in (0, 10, 100_000):
+                response = client.get(f'{server.url}/data?size={size}')
+                self.assertEqual((200, b'x' * size, False), (response.status, response.body, response.from_cache))
+            self.assertEqual(404, client.get(f'{server.url}/missing').status)
+            self.assertEqual(1, server.connections)
+            self.assertEqual(1, client.connections_created)
+
+            # 服务端关闭的连接不会放回池中
+            self.assertEqual(b'closed', client.get(f'{server.url}/close').body)
+            self.assertEqual(b'x' * 10, client.get(f'{server.url}/data?size=10').body)
+            self.assertEqual(2, client.connections_created)
+
+    def test_stale_connection(self):
+        """测试池中的空闲连接被服务端关闭后，请求在新连接上透明地重发"""
+        with HttpClient(retries=0) as client:
+            with LocalHttpServer() as server:
+                url = server.url
+                self.assertEqual(200, client.get(f'{url}/data').status)
+            # 在同一个端口上重新启动服务器，旧的连接已经失效
+            with LocalHttpServer(port=int(url.rsplit(':', 1)[1])) as server:
+                self.assertEqual(200, client.get(f'{url}/data').status)
+            self.assertEqual(2, client.connections_created)
+
+            # 非幂等的请求不会在新连接上重发
+            with LocalHttpServer(port=int(url.rsplit(':', 1)[1])) as server:
+                with self.assertRaises(CONNECTION_ERRORS):
+                    client.request('POST', f'{url}/data')
+                self.assertEqual(0, server.requests)
+                self.assertEqual(200, client.get(f'{url}/data').status)
+
+    def test_per_host_limit(self):
+        """测试同一个 host 同时进行的请求数不超过 max_per_host"""
+        with LocalHttpServer() as server, HttpClient(max_per_host=3) as client:
+            with ThreadPoolExecutor(12) as executor:
+                responses = list(executor.map(client.get, [f'{server.url}/slow?delay=0.05'] * 12))
+            self.assertEqual([200] * 12, [r.status for r in responses])
+            self.assertEqual(3, server.max_active)
+            self.assertEqual(3, client.connections_created)
+
+    def test_retry(self):
+        """测试 503 时重试，重试次数用完后返回最后一次的响应"""
+        with LocalHttpServer() as server, HttpClient(retries=3, backoff=0.01) as client:
+            self.assertEqual(b'ok', client.get(f'{server.url}/flaky?key=a&fail=2').body)
+            self.assertEqual(3, server.attempts['a'])
+
+            self.assertEqual(503, client.get(f'{server.url}/flaky?key=b&fail=10').status)
+            self.assertEqual(4, server.attempts['b'])
+
+            # 非幂等的方法不重试
+            self.assertEqual(501, client.request('POST', f'{server.url}/flaky?key=c').status)
+
+            # 按照 Retry-After 等待
+            begin = time.perf_counter()
+            self.assertEqual(200, client.get(f'{server.url}/flaky?key=d&retry_after=1').status)
+            self.assertGreaterEqual(time.perf_counter() - begin, 1.0)
+
+        # 连接被拒绝时重试，最后抛出异常
+        with self.assertRaises(ConnectionRefusedError):
+            HttpClient(retries=2, backoff=0.01).get(server.url)
+
+    def test_cache(self):
+        """测试 ETag 和 Last-Modified 条件请求，服务端返回 304 时使用缓存的响应"""
+        with LocalHttpServer() as server, HttpClient(cache_size=1) as client:
+            first = client.get(f'{server.url}/data?size=5')
+            second = client.get(f'{server.url}/data?size=5')
+            self.assertEqual((200, b'xxxxx', False), (first.status, first.body, first.from_cache))
+            self.assertEqual((200, b'xxxxx', True), (second.status, second.body, second.from_cache))
+            self.assertEqual(2, server.requests)
+
+            self.assertFalse(client.get(f'{server.url}/dated').from_cache)
+            self.assertTrue(client.get(f'{server.url}/dated').from_cache)
+            # 缓存只能放下一个 URL，前一个已经被淘汰
+            self.assertFalse(client.get(f'{server.url}/data?size=5').from_cache)
+
+            # 条件请求期间缓存的响应被其他线程淘汰，收到 304 时仍然返回它，并重新放入缓存
+            pool = next(iter(client._pools.values()))
+            request = pool.request
+            pool.request = lambda *args: (client._cache.clear(), request(*args))[1]
+            self.assertTrue(client.get(f'{server.url}/data?size=5').from_cache)
+            self.assertEqual([f'{server.url}/data?size=5'], list(client._cache))
+
+
+@benchmark
+class HttpBenchmarks(unittest.TestCase):
+
+    def test_bench_keep_alive(self):
+        """比较连接池 keep-alive 和每个请求新建连接在 1、8 个线程下的每秒请求数"""
+        n = 5000
+        with LocalHttpServer() as server:
+            url = f'{server.url}/data?size=1024'
+            for threads in (1, 8):
+                with HttpClient(max_per_host=threads, cache_size=0) as client:
+                    for name, fetch in (('new connection', _fetch_new_connection), ('keep-alive pool', client.get)):
+                        with ThreadPoolExecutor(threads) as executor:
+                            begin = time.perf_counter()
+                            list(executor.map(fetch, [url] * n))
+                            elapsed = time.perf_counter() - begin
+                        print(f'{name:<16} threads {threads}  {n / elapsed:8.0f} req/s')
+
+            with HttpClient() as client:
+                client.get(url)
+                begin = time.perf_counter()
+                for _ in range(n):
+                    client.get(url)
+                print(f'{"etag cache (304)":<16} threads 1  {n / (time.perf_counter() - begin):8.0f} req/s')
 
 
 if __name__ == '__main__':
@@ -1,6 +1,30 @@
+import collections
+import datetime
+import io
 import json
+import math
+import mmap
+import os
+import re
+import tempfile
+import time
+import tracemalloc
 import unittest
 import pathlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from support import benchmark, generate_events
+
+
+_WHITESPACE = re.compile(r'\s*')
+_BYTES_WHITESPACE = re.compile(rb'\s*')
+# 结构扫描只关心字符串（整体跳过，其中的括号和逗号不算数）、括号和逗号。
+# 字符串可能被区间的终点截断，此时第 1 组匹配空串，或者区间恰好以字符串中的一个反斜杠结束
+_JSON_STRUCTURE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*("|\\?\Z)|([\[{])|([\]}])|(,)', re.DOTALL)
+# 结构扫描时只保留引号和括号，其余的字节都删掉
+_JSON_NON_STRUCTURAL = bytes(sorted(set(range(256)) - set(b'"[]{}')))
+# 区间的起点位于字符串中时，先跳过字符串剩余的部分
+_JSON_STRING_REST = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
 
 
 def _ensure_file(name: str):
@@ -10,6 +34,367 @@ def _ensure_file(name: str):
         path.touch()
 
 
+def iter_json_lines(f, chunk_size=1 << 20, decoder=None):
+    """从 JSON Lines（NDJSON）格式的文件中逐条惰性读取记录，内存占用与文件大小无关
+
+    按 chunk_size 分块读取到一个滚动的缓冲区里，然后复用同一个 JSONDecoder 的 raw_decode 方法从缓冲区中逐条解码，
+    只有缓冲区末尾不完整的那一行会被保留到下一轮。
+    """
+    decode = (decoder or json.JSONDecoder()).raw_decode
+    skip = _WHITESPACE.match
+    buffer = ''
+    while True:
+        chunk = f.read(chunk_size)
+        buffer += chunk
+        # 只解码到最后一个换行符为止，避免把被截断的数字（如 12|3）当成完整的记录
+        limit = buffer.rfind('\n') + 1 if chunk else len(buffer)
+        pos = skip(buffer, 0).end()
+        while pos < limit:
+            try:
+                obj, pos = decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # 错误位置在最后一个换行符之后，说明是跨行的记录还没有读完整，继续读取下一块；
+                # 否则是中间某一行本身不合法，读再多也没用
+                if chunk and e.pos >= limit:
+                    break
+                raise
+            yield obj
+            pos = skip(buffer, pos).end()
+        buffer = buffer[pos:]
+        if not chunk:
+            return
+
+
+class JsonLinesWriter:
+    """JSON Lines（NDJSON）格式的批量写入器
+
+    每条记录序列化后先放入内存中的批次，每 batch_size 条合并为一次 write 调用写入文件。
+    """
+
+    def __init__(self, f, batch_size=1000, **kwargs):
+        self.f = f
+        self.batch_size = batch_size
+        # 默认使用紧凑的分隔符，参数含义同 json.dumps
+        kwargs.setdefault('separators', (',', ':'))
+        self._encode = json.JSONEncoder(**kwargs).encode
+        self._batch = []
+
+    def write(self, obj):
+        self._batch.append(self._encode(obj))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, objs):
+        for obj in objs:
+            self.write(obj)
+
+    def flush(self):
+        if self._batch:
+            self._batch.append('')
+            self.f.write('\n'.join(self._batch))
+            self._batch.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+
+_COMPACT_SEPARATORS = (',', ':')
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=_COMPACT_SEPARATORS, ensure_ascii=False)
+
+
+def _has_non_finite(obj):
+    """检查对象中是否含有 NaN 或 Infinity，它们只能来自 float"""
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, float):
+            if not math.isfinite(obj):
+                return True
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return False
+
+
+def _load_json_backend(name):
+    """导入指定的 JSON 库，返回 (dumps, loads)，其中 dumps 输出紧凑格式的 str；不支持序列化的库 dumps 为 None"""
+    if name == 'orjson':
+        import orjson
+        # orjson 原生支持 datetime 和 dataclass，标准库不支持，让它们引发 TypeError；
+        # 不使用 OPT_NON_STR_KEYS，非 str 类型的 key 同样引发 TypeError，交给标准库按它的规则转换
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+        def dumps(obj):
+            s = orjson.dumps(obj, option=option)
+            # orjson 把 NaN 和 Infinity 输出为 null，而标准库输出 NaN 和 Infinity，需要在输入中检查它们。
+            # 输出中没有 null 时不可能含有 NaN 和 Infinity，可以省去遍历输入
+            if b'null' in s and _has_non_finite(obj):
+                raise ValueError('orjson cannot serialize NaN or Infinity')
+            return s.decode()
+
+        return dumps, orjson.loads
+    if name == 'ujson':
+        import ujson
+        return lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False), ujson.loads
+    if name == 'simdjson':
+        # pysimdjson 只加速解析
+        import simdjson
+        return None, simdjson.loads
+    if name == 'json':
+        return _json_dumps, json.loads
+    raise ValueError(f'unknown JSON backend: {name!r}')
+
+
+def available_json_backends():
+    """返回当前环境中已安装的 JSON 库名称，按速度从快到慢排列"""
+    backends = []
+    for name in ('orjson', 'simdjson', 'ujson', 'json'):
+        try:
+            _load_json_backend(name)
+        except ImportError:
+            continue
+        backends.append(name)
+    return backends
+
+
+class JsonCodec:
+    """对多种 JSON 库的一层薄封装，提供和标准库类似的 dumps/loads/dump/load 接口
+
+    未指定 backend 时，序列化和解析分别选择已安装的最快的库，都没有安装时使用标准库。
+    各个库之间的行为差异会被抹平：
+    separators: 快速的库只能输出紧凑格式，所以默认值是 (',', ':')，而不是标准库的 (', ', ': ')；
+    传入其他的 separators 时总是使用标准库序列化。
+    退回到标准库: 快速的库不支持或者和标准库的行为不同的输入，会交给标准库处理，结果和标准库一致：
+    如 range、datetime、超过 64 位的整数、非 str 类型的 key，以及 orjson 会输出为 null 的 NaN 和 Infinity。
+    所以无法序列化时总是引发 TypeError，无法解析时总是引发 json.JSONDecodeError（ValueError 的子类）。
+    NOTE: 所有库都以 UTF-8 原样输出非 ASCII 字符，相当于标准库的 ensure_ascii=False；
+    orjson 可以序列化 uuid.UUID 和 enum.Enum，对于这两种类型，它不会像标准库一样引发 TypeError。
+    """
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backends = available_json_backends()
+            self.dumps_backend = next(name for name in backends if _load_json_backend(name)[0] is not None)
+            self.loads_backend = backends[0]
+        else:
+            self.dumps_backend = self.loads_backend = backend
+        self._dumps = _load_json_backend(self.dumps_backend)[0] or _json_dumps
+        self._loads = _load_json_backend(self.loads_backend)[1]
+
+    def __repr__(self):
+        return f'JsonCodec(dumps={self.dumps_backend!r}, loads={self.loads_backend!r})'
+
+    def dumps(self, obj, separators=None):
+        separators = tuple(separators or _COMPACT_SEPARATORS)
+        if separators == _COMPACT_SEPARATORS:
+            try:
+                return self._dumps(obj)
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return json.dumps(obj, separators=separators, ensure_ascii=False)
+
+    def loads(self, s):
+        try:
+            return self._loads(s)
+        except ValueError:
+            return json.loads(s)
+
+    def dump(self, obj, f, separators=None):
+        f.write(self.dumps(obj, separators))
+
+    def load(self, f):
+        return self.loads(f.read())
+
+
+codec = JsonCodec()
+
+
+def _json_array_content(data):
+    """返回顶层数组的内容（去掉方括号和两端的空白）在 data 中的区间 [begin, end)"""
+    begin = _BYTES_WHITESPACE.match(data, 0).end()
+    end = len(data)
+    while end > begin and data[end - 1:end].isspace():
+        end -= 1
+    if data[begin:begin + 1] != b'[':
+        raise ValueError('top-level JSON value is not an array')
+    if data[end - 1:end] != b']' or end - begin < 2:
+        raise ValueError('unterminated JSON array')
+    begin = _BYTES_WHITESPACE.match(data, begin + 1).end()
+    end -= 1
+    while end > begin and data[end - 1:end].isspace():
+        end -= 1
+    return begin, end
+
+
+def _is_escaped(data, pos):
+    """假设 pos 位于字符串之中，返回 pos 处的字节是否是被转义的字符，也就是它前面有奇数个连续的反斜杠"""
+    escapes = 0
+    while data[pos - escapes - 1] == 0x5c:
+        escapes += 1
+    return escapes % 2 == 1
+
+
+def _skip_json_string(data, start, end):
+    """假设 start 位于字符串之中，返回字符串结束之后的位置；字符串在 end 之前没有结束时返回 None"""
+    m = _JSON_STRING_REST.match(data, start + _is_escaped(data, start), end)
+    return m and m.end()
+
+
+def _scan_json_chunk(data, start, end):
+    """对数组内容中的 [start, end) 区间做结构扫描，不需要知道前面区间的内容
+
+    区间的起点可能位于字符串之外或者字符串之中，返回这两种假设下的结果 (终点是否位于字符串中, 括号深度的变化)。
+    先把转义的反斜杠和引号替换掉，剩下的引号就都是字符串的边界；再删掉引号和括号以外的所有字节，
+    以及相邻的两个引号（空字符串，或者两个字符串之间没有括号），它们不影响结果。按剩下的引号切分后，
+    两种假设下字符串之外的部分分别是偶数和奇数位置上的片段。这些都由 bytes 的方法在 C 代码中完成，不需要在 Python 层逐个处理字符串。
+    """
+    def split(chunk):
+        chunk = chunk.replace(b'\\\\', b'').replace(b'\\"', b'').translate(None, _JSON_NON_STRUCTURAL)
+        return chunk.replace(b'""', b'').split(b'"')
+
+    def depth(pieces):
+        s = b''.join(pieces)
+        return s.count(b'[') + s.count(b'{') - s.count(b']') - s.count(b'}')
+
+    chunk = data[start:end]
+    pieces = split(chunk)
+    outside = len(pieces) % 2 == 0, depth(pieces[0::2])
+    if _is_escaped(data, start):
+        pieces = split(chunk[1:])
+    inside = len(pieces) % 2 == 1, depth(pieces[1::2])
+    return [outside, inside]
+
+
+def _scan_json_file_chunk(path, start, end):
+    """在工作进程中对文件的 [start, end) 区间做结构扫描，见 _scan_json_chunk"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _scan_json_chunk(mm, start, end)
+
+
+def _find_json_separator(data, start, end, in_string, depth):
+    """从状态已知的 start 开始向后查找第一个顶层元素分隔符（深度为 0 的逗号），在 end 之前没有找到时返回 None"""
+    if in_string:
+        start = _skip_json_string(data, start, end)
+        if start is None:
+            return None
+    for m in _JSON_STRUCTURE.finditer(data, start, end):
+        kind = m.lastindex
+        if kind == 2:
+            depth += 1
+        elif kind == 3:
+            depth -= 1
+        elif kind == 4 and depth == 0:
+            return m.start()
+    return None
+
+
+def _json_array_ranges(data, begin, end, chunks, scans):
+    """依次拼接各个区间的扫描结果，返回以顶层元素分隔符切分出来的 [start, end) 区间
+
+    第一个区间的起点位于字符串之外，深度为 0；每个区间终点的状态由它起点的状态和扫描结果确定，也就是下一个区间起点的状态。
+    知道了区间起点的状态，就可以从起点开始找到第一个顶层元素分隔符，通常只需要扫描到当前元素结束为止。
+    除第一个区间外，每个区间最多取一个切分点，所以切分出来的区间和扫描的区间大小相当。
+    """
+    in_string, depth = False, 0
+    for i, ((start, stop), scan) in enumerate(zip(chunks, scans)):
+        if i > 0:
+            pos = _find_json_separator(data, start, stop, in_string, depth)
+            if pos is not None:
+                yield begin, pos
+                begin = pos + 1
+        ends_in_string, delta = scan[in_string]
+        in_string, depth = ends_in_string, depth + delta
+    yield begin, end
+
+
+def _json_chunks(begin, end, chunk_size):
+    return [(start, min(start + chunk_size, end)) for start in range(begin, end, chunk_size)]
+
+
+def split_json_array(data, chunk_size=16 << 20):
+    """把一个顶层为数组的 JSON 文档（bytes 或 mmap）的内容切分为若干个大小约为 chunk_size 的 [start, end) 字节区间
+
+    切分点都是顶层的元素分隔符，每个区间加上方括号后都是一个合法的 JSON 数组。
+    扫描时跟踪字符串（包括其中的转义字符）和括号的嵌套深度，字符串中和嵌套结构中的逗号不会被当作切分点。
+    这里在当前进程中依次扫描，iter_json_array 则把各个区间交给工作进程并行扫描，再同样用 _json_array_ranges 拼接。
+    """
+    begin, end = _json_array_content(data)
+    if begin == end:
+        return []
+    chunks = _json_chunks(begin, end, chunk_size)
+    scans = (_scan_json_chunk(data, start, stop) for start, stop in chunks)
+    return list(_json_array_ranges(data, begin, end, chunks, scans))
+
+
+def _load_json_slice(path, start, end):
+    """解析数组的一个区间，返回其中的元素列表"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # 空的区间说明有连续的逗号，或者数组以逗号开头、结尾，加上方括号后却是合法的空数组
+    if not data.strip():
+        raise json.JSONDecodeError('Expecting value', data.decode(), 0)
+    return codec.loads(b'[' + data + b']')
+
+
+def _map_bounded(executor, fn, iterable, window):
+    """同 executor.map(fn, *zip(*iterable))，但最多只有 window 个任务已经提交而结果还没有被取走
+
+    executor.map 会立即提交所有任务，调用方消费得慢时，已经完成的结果会在内存中堆积。
+    """
+    pending = collections.deque()
+    try:
+        for args in iterable:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fn, *args))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # 调用方提前停止迭代时，取消还没有开始执行的任务
+        for future in pending:
+            future.cancel()
+
+
+def iter_json_array(path, workers=None, chunk_size=16 << 20):
+    """使用进程池并行解析一个顶层为数组的大 JSON 文件，按原有顺序逐个返回数组元素
+
+    分两步进行：先把文件按 chunk_size 切分，交给工作进程并行地做结构扫描（见 _scan_json_chunk），
+    由当前进程按顺序拼接出每个区间起点的状态，找到顶层元素分隔符的位置；每确定一个区间，就提交给工作进程解析。
+    每个工作进程最多领先调用方两个区间，因此内存中最多同时存在大约 2 * workers * chunk_size 字节的已解析元素，
+    而不是整个数组。
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError('empty JSON file')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            begin, end = _json_array_content(mm)
+            if begin == end:
+                return
+
+            workers = workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # 扫描的结果只有几个整数，可以一次性提交所有区间
+                chunks = _json_chunks(begin, end, chunk_size)
+                scans = executor.map(_scan_json_file_chunk, [path] * len(chunks), *zip(*chunks))
+                ranges = ((path, start, stop) for start, stop in _json_array_ranges(mm, begin, end, chunks, scans))
+                # 按提交的顺序返回结果，因此元素的顺序和文件中一致
+                for items in _map_bounded(executor, _load_json_slice, ranges, 2 * workers):
+                    yield from items
+
+
+def load_json_array(path, workers=None, chunk_size=16 << 20):
+    """同 iter_json_array，但一次性返回包含所有元素的 list"""
+    return list(iter_json_array(path, workers, chunk_size))
+
+
 class JsonTests(unittest.TestCase):
     """JSON 相关测试案例"""
 
@@ -58,6 +443,230 @@ class JsonTests(unittest.TestCase):
         self.assertIsNotNone(obj)
         self.assertIs(dict, type(obj))
 
+    def test_json_codec(self):
+        """测试 JsonCodec 在每一种已安装的 JSON 库上都和 test_json_dumps_and_loads 中标准库的行为一致"""
+        for backend in available_json_backends():
+            with self.subTest(backend=backend):
+                c = JsonCodec(backend)
+                d1 = dict(one=1, two=2, three=3)
+                # 默认输出紧凑格式，指定 separators 时使用标准库
+                self.assertEqual('{"one":1,"two":2,"three":3}', c.dumps(d1))
+                self.assertEqual('{"one": 1, "two": 2, "three": 3}', c.dumps(d1, separators=(', ', ': ')))
+                self.assertEqual(d1, c.loads(c.dumps(d1)))
+                self.assertEqual('[1,2,3]', c.dumps((1, 2, 3,), separators=(',', ':')))
+
+                # 不支持对 range、datetime 对象的序列化，无论使用哪个库都引发 TypeError
+                with self.assertRaises(TypeError):
+                    c.dumps(range(10))
+                with self.assertRaises(TypeError):
+                    c.dumps({'created': datetime.datetime(2022, 1, 1)})
+                # NaN 和 Infinity 和标准库一样输出为 NaN、Infinity，而不是 null
+                self.assertEqual('[NaN,Infinity,null]', c.dumps([float('nan'), float('inf'), None]))
+                self.assertEqual('{"Infinity":1}', c.dumps({float('inf'): 1}))
+                self.assertEqual('{"a":[1.5,null],"b":"null"}', c.dumps({'a': [1.5, None], 'b': 'null'}))
+                self.assertEqual('{"a":[{"b":-Infinity}]}', c.dumps({'a': [{'b': float('-inf')}]}))
+                # 解析失败都引发 json.JSONDecodeError
+                with self.assertRaises(json.JSONDecodeError):
+                    c.loads('{"one": ')
+
+                # 非 str 类型的 key 会被转换为字符串，和标准库一致
+                self.assertEqual('{"1":"你好"}', c.dumps({1: '你好'}))
+
+                f = io.StringIO()
+                c.dump(d1, f)
+                f.seek(0)
+                self.assertEqual(d1, c.load(f))
+
+        # 未指定时自动选择最快的库，至少可以退回到标准库
+        self.assertIn(codec.loads_backend, available_json_backends())
+        self.assertIn('json', available_json_backends())
+
+    def test_split_json_array(self):
+        """测试把顶层数组在顶层的元素分隔符处切分为多个区间"""
+        data = b' [{"a": 1}, {"b": [1, 2]}, {"c": "}, {\\"]"}, "\\\\", 3 ] '
+        # chunk_size 为 1 时每个字节都是一个扫描区间，区间的起点可能在字符串、转义字符和嵌套结构中，
+        # 字符串和嵌套结构中的逗号都不是切分点
+        ranges = split_json_array(data, chunk_size=1)
+        self.assertEqual([b'{"a": 1}', b' {"b": [1, 2]}', b' {"c": "}, {\\"]"}', b' "\\\\"', b' 3'],
+                         [data[start:end] for start, end in ranges])
+        for chunk_size in range(1, len(data)):
+            ranges = split_json_array(data, chunk_size)
+            items = [json.loads(b'[' + data[start:end] + b']') for start, end in ranges]
+            self.assertEqual(json.loads(data), [item for chunk in items for item in chunk])
+        # chunk_size 足够大时，整个数组是一个区间
+        self.assertEqual([(2, len(data) - 3)], split_json_array(data))
+
+        self.assertEqual([], split_json_array(b'[ ]'))
+        with self.assertRaises(ValueError):
+            split_json_array(b'{"one": 1}')
+        with self.assertRaises(ValueError):
+            split_json_array(b'[1, 2')
+
+    def test_load_json_array(self):
+        """测试使用进程池并行解析一个顶层为数组的 JSON 文件"""
+        events = list(generate_events(1000))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, '1.json')
+            with open(path, 'w') as f:
+                json.dump(events, f)
+            # 切成很多小区间，结果和 json.load 一致，并且保持原有顺序
+            self.assertEqual(events, load_json_array(path, workers=2, chunk_size=1000))
+            self.assertEqual(events[:3], list(iter_json_array(path, workers=2))[:3])
+
+            # 字符串和嵌套的对象中也含有 }, {，它们都不会被当作切分点
+            items = [{'text': '}, {', 'children': [{'id': i}, {'id': -i}]} for i in range(100)]
+            with open(path, 'w') as f:
+                json.dump(items, f)
+            for chunk_size in (1, 10, 100):
+                self.assertEqual(items, load_json_array(path, workers=2, chunk_size=chunk_size))
+
+            # 格式错误的文件会引发 JSONDecodeError
+            with open(path, 'w') as f:
+                f.write('[{"one": 1}, {"two": }, {"three": 3}]')
+            with self.assertRaises(json.JSONDecodeError):
+                load_json_array(path, workers=2, chunk_size=1)
+            # 多余的逗号加上方括号后是合法的空数组，同样需要报错
+            for text in ('[1, , 2]', '[1, 2, ]', '[, 1]'):
+                with open(path, 'w') as f:
+                    f.write(text)
+                with self.assertRaises(json.JSONDecodeError):
+                    load_json_array(path, workers=2, chunk_size=1)
+
+    def test_map_bounded(self):
+        """测试调用方消费得慢时，最多只有 window 个任务领先于调用方"""
+        submitted = []
+
+        def square(x):
+            submitted.append(x)
+            return x * x
+
+        with ThreadPoolExecutor(2) as executor:
+            results = _map_bounded(executor, square, ((i,) for i in range(100)), 4)
+            self.assertEqual(0, next(results))
+            time.sleep(0.05)
+            self.assertEqual(4, len(submitted))
+            self.assertEqual([x * x for x in range(1, 100)], list(results))
+
+            # 提前停止迭代时，不会再提交新的任务
+            submitted.clear()
+            results = _map_bounded(executor, square, ((i,) for i in range(100)), 4)
+            next(results)
+            results.close()
+        self.assertLessEqual(len(submitted), 4)
+
+    def test_json_lines(self):
+        """测试 JSON Lines 格式的批量写入和流式读取"""
+        f = io.StringIO()
+        with JsonLinesWriter(f, batch_size=2) as writer:
+            writer.write(dict(one=1))
+            # 还没有达到一个批次，不会写入文件
+            self.assertEqual('', f.getvalue())
+            writer.writerows([[1, 2, 3], 'hello', 123])
+        # 每行一条记录，使用紧凑的分隔符
+        self.assertEqual('{"one":1}\n[1,2,3]\n"hello"\n123\n', f.getvalue())
+
+        f.seek(0)
+        self.assertEqual([dict(one=1), [1, 2, 3], 'hello', 123], list(iter_json_lines(f)))
+
+        # iter_json_lines 返回的是生成器，记录是惰性读取的
+        self.assertIs(type(generate_events(0)), type(iter_json_lines(f)))
+
+    def test_iter_json_lines_with_small_chunks(self):
+        """测试记录跨越多个读取块、空行以及最后一行没有换行符的情况"""
+        f = io.StringIO('{"one": 1}\n\n12345\n[1,\n 2]\n{"two": 2}')
+        self.assertEqual([dict(one=1), 12345, [1, 2], dict(two=2)], list(iter_json_lines(f, chunk_size=3)))
+
+        # 格式错误的记录会引发 JSONDecodeError
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_json_lines(io.StringIO('{"one": 1}\n{"two": \n')))
+
+        # 中间一行不合法时立即报错，而不是把之后的内容全部读入缓冲区
+        f = io.StringIO('{"one": 1}\nbad\n' + '{"two": 2}\n' * 1000)
+        records = iter_json_lines(f, chunk_size=8)
+        self.assertEqual(dict(one=1), next(records))
+        with self.assertRaises(json.JSONDecodeError):
+            next(records)
+        self.assertLess(f.tell(), 100)
+
+
+@benchmark
+class JsonBenchmarks(unittest.TestCase):
+
+    def test_bench_json_lines(self):
+        """比较 json.load 一次性读取整个列表和 iter_json_lines 流式读取的速度和峰值内存"""
+        n = 1_000_000
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path, jsonl_path = os.path.join(tmp, '1.json'), os.path.join(tmp, '1.jsonl')
+            with open(json_path, 'w') as f:
+                json.dump(list(generate_events(n)), f)
+            with open(jsonl_path, 'w') as f, JsonLinesWriter(f) as writer:
+                begin = time.perf_counter()
+                writer.writerows(generate_events(n))
+                print(f'JsonLinesWriter  {n / (time.perf_counter() - begin):10.0f} records/s')
+
+            def load_all():
+                with open(json_path) as f:
+                    return sum(1 for _ in json.load(f))
+
+            def load_lines():
+                with open(jsonl_path) as f:
+                    return sum(1 for _ in iter_json_lines(f))
+
+            for name, load in (('json.load', load_all), ('iter_json_lines', load_lines)):
+                tracemalloc.start()
+                begin = time.perf_counter()
+                self.assertEqual(n, load())
+                elapsed = time.perf_counter() - begin
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f'{name:<16} {n / elapsed:10.0f} records/s  peak {peak / (1 << 20):8.1f} MB')
+
+    def test_bench_json_codec(self):
+        """比较各个 JSON 库在小字典、大嵌套文档和宽数组上的 ops/s 和 bytes/s"""
+        documents = {
+            'small dict': dict(one=1, two=2, three=3, name='gukt', tags=['a', 'b']),
+            'nested doc': {'events': list(generate_events(10_000)), 'meta': {'page': {'size': 10_000, 'next': None}}},
+            'wide array': list(range(100_000)) + [i / 3 for i in range(100_000)],
+        }
+        for title, document in documents.items():
+            size = len(codec.dumps(document).encode())
+            # 大文档迭代次数少一些，保证每一项的耗时大致相当
+            number = max(1, 20_000_000 // size)
+            for backend in available_json_backends():
+                c = JsonCodec(backend)
+                text = c.dumps(document)
+                for op, func, arg in (('dumps', c.dumps, document), ('loads', c.loads, text)):
+                    begin = time.perf_counter()
+                    for _ in range(number):
+                        func(arg)
+                    elapsed = time.perf_counter() - begin
+                    print(f'{title:<10}  {backend:<8}  {op}  {number / elapsed:12.0f} ops/s  '
+                          f'{size * number / elapsed / (1 << 20):8.1f} MB/s')
+
+    def test_bench_load_json_array(self):
+        """比较单进程 json.load 和 1、4、16 个工作进程下 load_json_array 解析 1 GB 数组的耗时"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, '1.json')
+            with open(path, 'w') as f:
+                f.write('[')
+                events = generate_events(1 << 62)
+                f.write(json.dumps(next(events)))
+                size = 0
+                while size < 1 << 30:
+                    batch = [json.dumps(event) for _, event in zip(range(10_000), events)]
+                    size += f.write(',' + ','.join(batch))
+                f.write(']')
+
+            begin = time.perf_counter()
+            with open(path) as f:
+                n = len(json.load(f))
+            print(f'json.load            {time.perf_counter() - begin:8.2f}s  {n} items')
+
+            for workers in (1, 4, 16):
+                begin = time.perf_counter()
+                self.assertEqual(n, len(load_json_array(path, workers)))
+                print(f'load_json_array x{workers:<3} {time.perf_counter() - begin:8.2f}s')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,9 +3,15 @@
 # Press ⌃R to execute it or replace it with your code.
 # Press Double ⇧ to search everywhere for classes, files, tool windows, actions, and settings.
 import typing
+from array import array
 from datetime import date
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class Person:
     """this is the person class"""
     name = 'gukt'
@@ -17,6 +23,9 @@ class Person:
         self.r = realpart
         self.i = imagpart
 
+    def __complex__(self):
+        return complex(self.r, self.i)
+
     def m1(self):
         """this is the doc"""
         print('I am a method1')
@@ -32,6 +41,194 @@ class Student(Person):
         Person.m1(self)
 
 
+class SlottedPerson:
+    """Person 的 __slots__ 版本，实例没有 __dict__，适合在内存中保存大量实例
+
+    NOTE: 使用了 __slots__ 之后，类属性不能再和实例属性同名，所以去掉了类属性 r 和 i，它们总是在 __init__ 中赋值。
+    """
+    __slots__ = ('data', 'r', 'i')
+    name = 'gukt'
+
+    def __init__(self, realpart=3.0, imagpart=-4.5):
+        self.data = []
+        self.r = realpart
+        self.i = imagpart
+
+    def __complex__(self):
+        return complex(self.r, self.i)
+
+    def m1(self):
+        """this is the doc"""
+        print('I am a method1')
+        self.m2()
+
+    def m2(self):
+        print('m2')
+
+
+class SlottedStudent(SlottedPerson):
+    """Student 的 __slots__ 版本，子类也要声明 __slots__（可以为空），否则又会拥有 __dict__"""
+    __slots__ = ()
+
+    def m3(self):
+        SlottedPerson.m1(self)
+
+
+class PersonRow:
+    """PersonColumns 中某一行的代理对象，读写 r 和 i 时直接访问列存储中的数组，按需创建，不保存数据本身"""
+    __slots__ = ('_columns', '_index')
+    name = 'gukt'
+
+    def __init__(self, columns, index):
+        self._columns = columns
+        self._index = index
+
+    @property
+    def r(self):
+        return self._columns.r[self._index]
+
+    @r.setter
+    def r(self, value):
+        self._columns.r[self._index] = value
+
+    @property
+    def i(self):
+        return self._columns.i[self._index]
+
+    @i.setter
+    def i(self, value):
+        self._columns.i[self._index] = value
+
+    @property
+    def data(self):
+        # 绝大多数实例的 data 都是空的，只在第一次访问时才创建
+        return self._columns.data.setdefault(self._index, [])
+
+    def __repr__(self):
+        return f'{type(self).__name__}(r={self.r}, i={self.i})'
+
+    def __complex__(self):
+        return complex(self.r, self.i)
+
+    def m1(self):
+        """this is the doc"""
+        print('I am a method1')
+        self.m2()
+
+    def m2(self):
+        print('m2')
+
+
+class StudentRow(PersonRow):
+    __slots__ = ()
+
+    def m3(self):
+        PersonRow.m1(self)
+
+
+class PersonColumns:
+    """按列存储大量 Person 的容器
+
+    所有实例的 r、i 分别连续地保存在两个 array('d') 中，每个只占 8 个字节；
+    data 只为访问过的行保存在一个稀疏的 dict 中。通过下标或迭代访问时，才为对应的行创建一个轻量的代理对象（row_class）。
+    """
+
+    def __init__(self, pairs=(), row_class=PersonRow):
+        self.r = array('d')
+        self.i = array('d')
+        self.data = {}
+        self.row_class = row_class
+        self.extend(pairs)
+
+    @classmethod
+    def from_persons(cls, persons, row_class=PersonRow):
+        """从 Person（或任何有 r、i 属性的对象）的序列中构建"""
+        return cls(((p.r, p.i) for p in persons), row_class)
+
+    def append(self, realpart=3.0, imagpart=-4.5):
+        self.r.append(realpart)
+        self.i.append(imagpart)
+
+    def extend(self, pairs):
+        for realpart, imagpart in pairs:
+            self.r.append(realpart)
+            self.i.append(imagpart)
+
+    def __len__(self):
+        return len(self.r)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('PersonColumns index out of range')
+        return self.row_class(self, index)
+
+    def __iter__(self):
+        row_class = self.row_class
+        for index in range(len(self)):
+            yield row_class(self, index)
+
+    def as_numpy(self):
+        """返回 (r, i) 两个共享内存的 NumPy 数组视图，不拷贝数据；需要安装 numpy
+
+        NOTE: 视图存在期间，底层的 array 不能改变大小，此时调用 append 会引发 BufferError。
+        """
+        if numpy is None:
+            raise ImportError('as_numpy() requires numpy')
+        return numpy.frombuffer(self.r, dtype=numpy.float64), numpy.frombuffer(self.i, dtype=numpy.float64)
+
+
+def to_complex_array(items):
+    """把一组复数对象转换为 NumPy 的 complex128 数组；需要安装 numpy
+
+    items 可以是 PersonColumns（直接使用列存储，不经过 Python 层的循环），
+    也可以是任何实现了 __complex__ 的对象（如 Person、misc_tests.Foo）的序列。
+    """
+    if numpy is None:
+        raise ImportError('to_complex_array() requires numpy')
+    if isinstance(items, PersonColumns):
+        values = numpy.empty(len(items), dtype=numpy.complex128)
+        values.real, values.imag = items.as_numpy()
+        return values
+    count = len(items) if hasattr(items, '__len__') else -1
+    return numpy.fromiter(map(complex, items), dtype=numpy.complex128, count=count)
+
+
+class ComplexBatch:
+    """对一批复数做向量化运算，代替对每个对象调用 complex(obj) 的 Python 循环；需要安装 numpy"""
+
+    def __init__(self, items):
+        if numpy is not None and isinstance(items, numpy.ndarray):
+            self.values = items.astype(numpy.complex128, copy=False)
+        else:
+            self.values = to_complex_array(items)
+
+    def __len__(self):
+        return len(self.values)
+
+    def magnitude(self):
+        """每个复数的模，相当于 abs(complex(obj))"""
+        return numpy.abs(self.values)
+
+    def phase(self):
+        """每个复数的辐角（弧度），相当于 cmath.phase(complex(obj))"""
+        return numpy.angle(self.values)
+
+    def sum(self):
+        return complex(self.values.sum())
+
+    def __mul__(self, other):
+        """逐个元素相乘，other 可以是另一个 ComplexBatch、复数对象的序列或一个复数"""
+        if isinstance(other, ComplexBatch):
+            other = other.values
+        elif not isinstance(other, (int, float, complex)):
+            other = to_complex_array(other)
+        return ComplexBatch(self.values * other)
+
+    __rmul__ = __mul__
+
+
 def class_test():
 
     s1 = Student()
@@ -0,0 +1,149 @@
+import cmath
+import gc
+import time
+import tracemalloc
+import unittest
+
+from main import (Person, Student, SlottedPerson, SlottedStudent, PersonColumns, PersonRow, StudentRow,
+                  ComplexBatch, to_complex_array, numpy)
+from misc_tests import Foo
+from support import benchmark
+
+
+class PersonTests(unittest.TestCase):
+
+    def test_slotted_person(self):
+        """测试 __slots__ 版本的 Person 和 Student"""
+        p1 = SlottedPerson(1.0, 20.0)
+        self.assertEqual((1.0, 20.0, [], 'gukt'), (p1.r, p1.i, p1.data, p1.name))
+
+        # 没有 __dict__，因此不能添加 __slots__ 之外的属性
+        self.assertFalse(hasattr(p1, '__dict__'))
+        with self.assertRaises(AttributeError):
+            p1.age = 18
+
+        # 子类声明了空的 __slots__，同样没有 __dict__
+        s1 = SlottedStudent()
+        self.assertEqual((3.0, -4.5), (s1.r, s1.i))
+        self.assertFalse(hasattr(s1, '__dict__'))
+        s1.m3()
+
+        # 普通的 Person 每个实例都有一个 __dict__
+        self.assertEqual({'data': [], 'r': 3.0, 'i': -4.5}, vars(Person()))
+
+    def test_person_columns(self):
+        """测试按列存储的 PersonColumns 容器和它的行代理对象"""
+        columns = PersonColumns.from_persons([Person(1.0, 2.0), Student(3.0, 4.0)])
+        columns.append(5.0, 6.0)
+        self.assertEqual(3, len(columns))
+
+        p1 = columns[0]
+        self.assertIs(PersonRow, type(p1))
+        self.assertEqual((1.0, 2.0, 'gukt'), (p1.r, p1.i, p1.name))
+        self.assertEqual((5.0, 6.0), (columns[-1].r, columns[-1].i))
+        with self.assertRaises(IndexError):
+            columns[3]
+
+        # 代理对象的读写直接作用于列存储
+        p1.r = 10.0
+        self.assertEqual(10.0, columns.r[0])
+        self.assertEqual([10.0, 3.0, 5.0], [p.r for p in columns])
+
+        # data 只在访问时才创建
+        self.assertEqual({}, columns.data)
+        columns[1].data.append('hello')
+        self.assertEqual(['hello'], columns[1].data)
+        self.assertEqual([], columns[2].data)
+
+        # 可以指定行代理的类型，以使用 Student 的方法
+        students = PersonColumns([(1.0, 2.0)], row_class=StudentRow)
+        students[0].m3()
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_person_columns_as_numpy(self):
+        """测试以 NumPy 数组的形式访问列存储，两者共享同一块内存"""
+        columns = PersonColumns([(1.0, 2.0), (3.0, 4.0)])
+        r, i = columns.as_numpy()
+        self.assertEqual(4.0, r.sum())
+        r[0] = 10.0
+        self.assertEqual(10.0, columns[0].r)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_complex_batch(self):
+        """测试把一组复数对象转换为 complex128 数组后做向量化运算"""
+        persons = [Person(3.0, 4.0), Person(0.0, 1.0), Foo()]
+        # Person 和 Foo 都实现了 __complex__
+        self.assertEqual(3 + 4j, complex(persons[0]))
+        self.assertEqual([3 + 4j, 1j, 3 + 4j], to_complex_array(persons).tolist())
+        # PersonColumns 直接从列存储转换，结果相同
+        columns = PersonColumns.from_persons(persons[:2])
+        self.assertEqual([3 + 4j, 1j], to_complex_array(columns).tolist())
+        # 也可以是生成器
+        self.assertEqual([3 + 4j], to_complex_array(p for p in persons[:1]).tolist())
+
+        batch = ComplexBatch(persons)
+        self.assertEqual([5.0, 1.0, 5.0], batch.magnitude().tolist())
+        self.assertEqual([cmath.phase(complex(p)) for p in persons], batch.phase().tolist())
+        self.assertEqual(6 + 9j, batch.sum())
+        self.assertEqual([(3 + 4j) ** 2, -1, (3 + 4j) ** 2], (batch * batch).values.tolist())
+        self.assertEqual([6 + 8j, 2j, 6 + 8j], (2 * batch).values.tolist())
+        self.assertEqual([3 + 4j, -1, 3 + 4j], (batch * [1, 1j, 1]).values.tolist())
+
+
+def _measure(build):
+    """返回 build() 创建的对象占用的内存（字节）和对其中每个元素读取 r、i 属性的耗时（秒）"""
+    gc.collect()
+    tracemalloc.start()
+    persons = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    begin = time.perf_counter()
+    total = 0.0
+    for p in persons:
+        total += p.r + p.i
+    return size, time.perf_counter() - begin
+
+
+@benchmark
+class PersonBenchmarks(unittest.TestCase):
+
+    def test_bench_person_memory(self):
+        """比较 100 万、1000 万个实例时 Person、SlottedPerson 和 PersonColumns 的内存占用和属性访问速度"""
+        for n in (1_000_000, 10_000_000):
+            for name, build in (
+                    ('Person', lambda: [Person(float(k), -float(k)) for k in range(n)]),
+                    ('SlottedPerson', lambda: [SlottedPerson(float(k), -float(k)) for k in range(n)]),
+                    ('PersonColumns', lambda: PersonColumns((float(k), -float(k)) for k in range(n)))):
+                size, elapsed = _measure(build)
+                print(f'{n:>10} {name:<14} {size / (1 << 20):10.1f} MB  {size / n:6.1f} B/instance  '
+                      f'attribute access {elapsed:6.2f}s')
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_bench_complex_batch(self):
+        """比较 100 万个元素时逐个 complex(obj) 的 Python 循环和 ComplexBatch 向量化运算的耗时"""
+        n = 1_000_000
+        persons = [Person(float(k), -float(k)) for k in range(n)]
+        columns = PersonColumns.from_persons(persons)
+
+        begin = time.perf_counter()
+        values = [complex(p) for p in persons]
+        magnitude = [abs(v) for v in values]
+        phase = [cmath.phase(v) for v in values]
+        total = sum(values)
+        product = [v * v for v in values]
+        loop = time.perf_counter() - begin
+        print(f'python loop              {loop:8.3f}s')
+
+        for name, items in (('ComplexBatch(persons)', persons), ('ComplexBatch(columns)', columns)):
+            begin = time.perf_counter()
+            batch = ComplexBatch(items)
+            converted = time.perf_counter()
+            batch.magnitude(), batch.phase(), batch.sum(), batch * batch
+            end = time.perf_counter()
+            print(f'{name:<24} {end - begin:8.3f}s  (conversion {converted - begin:.3f}s, '
+                  f'operations {end - converted:.3f}s)  speedup x{loop / (end - begin):.1f}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+import collections
+import itertools
+import os
+import time
+import unittest
+
+from pymongo import InsertOne, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from support import benchmark, generate_events
+
+# 默认使用进程内的 mongomock，设置 MONGO_URL（如 mongodb://localhost:27017）后连接真实的 mongod
+MONGO_URL = os.environ.get('MONGO_URL')
+
+BulkResult = collections.namedtuple('BulkResult', ['inserted', 'matched', 'modified', 'upserted', 'errors'])
+
+
+def _client():
+    """返回测试使用的 MongoClient，设置了 MONGO_URL 时连接 mongod，否则使用 mongomock"""
+    if MONGO_URL:
+        return MongoClient(MONGO_URL)
+    if mongomock is None:
+        raise unittest.SkipTest('设置环境变量 MONGO_URL 或安装 mongomock 以运行 Mongo 测试')
+    return mongomock.MongoClient()
+
+
+def write_batches(collection, requests, batch_size=1000):
+    """把写操作（InsertOne、UpdateOne 等，可以是生成器）按 batch_size 分批，每批一次无序的 bulk_write，返回 BulkResult
+
+    ordered=False 时服务端可以并行执行一批中的操作，某个操作失败（如主键重复）也不会中断其余的操作。
+    失败的操作不抛出异常，而是收集到 errors 中，其中的 index 是该操作在整个 requests 中的序号。
+    """
+    requests = iter(requests)
+    inserted = matched = modified = upserted = 0
+    errors = []
+    offset = 0
+    while batch := list(itertools.islice(requests, batch_size)):
+        try:
+            result = collection.bulk_write(batch, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            errors += [dict(error, index=error['index'] + offset) for error in result['writeErrors']]
+        inserted += result['nInserted']
+        matched += result['nMatched']
+        modified += result['nModified']
+        upserted += result['nUpserted']
+        offset += len(batch)
+    return BulkResult(inserted, matched, modified, upserted, errors)
+
+
+def bulk_insert(collection, documents, batch_size=1000):
+    return write_batches(collection, (InsertOne(doc) for doc in documents), batch_size)
+
+
+def _upsert_one(doc, key):
+    # key 已经在查询条件中，插入时会被写入；_id 不能修改，只在插入时设置，已有的文档保留原来的 _id
+    update = {}
+    fields = {k: v for k, v in doc.items() if k not in (key, '_id')}
+    if fields:
+        update['$set'] = fields
+    if '_id' in doc and key != '_id':
+        update['$setOnInsert'] = {'_id': doc['_id']}
+    # 更新操作不能为空，文档只有 key 时只需要确保它存在
+    return UpdateOne({key: doc[key]}, update or {'$setOnInsert': {key: doc[key]}}, upsert=True)
+
+
+def bulk_upsert(collection, documents, key='_id', batch_size=1000):
+    """按 key 字段更新文档中出现的字段，文档不存在时插入"""
+    return write_batches(collection, (_upsert_one(doc, key) for doc in documents), batch_size)
+
+
+def find_iter(collection, filter=None, fields=None, batch_size=1000, sort=None):
+    """流式读取文档，每次从服务端取 batch_size 个
+
+    fields 是需要的字段列表，服务端只返回这些字段（投影），不需要 _id 时不要把它列出来；为 None 时返回整个文档。
+    默认的第一批只有 101 个文档，之后每批最多 16 MiB，读取大量小文档时调大 batch_size 可以减少网络往返。
+    """
+    projection = None
+    if fields is not None:
+        projection = dict.fromkeys(fields, 1)
+        projection.setdefault('_id', 0)
+    cursor = collection.find(filter or {}, projection).batch_size(batch_size)
+    if sort:
+        cursor = cursor.sort(sort)
+    with cursor:
+        yield from cursor
+
+
+class MongoTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = _client()
+        self.collection = self.client['python_demos_test']['events']
+        self.collection.drop()
+
+    def tearDown(self):
+        self.collection.drop()
+        self.client.close()
+
+    def test_bulk_insert(self):
+        """测试分批无序写入，主键重复的文档被跳过并记录在 errors 中，不影响其他文档"""
+        documents = [dict(event, _id=event['id']) for event in generate_events(2500)]
+        self.assertEqual(BulkResult(2500, 0, 0, 0, []), bulk_insert(self.collection, documents, batch_size=1000))
+        self.assertEqual(2500, self.collection.count_documents({}))
+
+        result = bulk_insert(self.collection, [{'_id': 2500}, {'_id': 10}, {'_id': 2501}, {'_id': 1500}], batch_size=3)
+        self.assertEqual(2, result.inserted)
+        self.assertEqual([1, 3], [error['index'] for error in result.errors])
+        self.assertEqual({11000}, {error['code'] for error in result.errors})
+
+    def test_bulk_upsert(self):
+        bulk_insert(self.collection, [{'_id': i, 'n': i} for i in range(10)])
+        result = bulk_upsert(self.collection, ({'_id': i, 'n': i * 10} for i in range(5, 15)), batch_size=4)
+        self.assertEqual((0, 5, 5, 5, []), result)
+        self.assertEqual([0, 1, 2, 3, 4, 50, 60, 70, 80, 90, 100, 110, 120, 130, 140],
+                         [doc['n'] for doc in find_iter(self.collection, sort='_id')])
+
+        # 按其他字段更新，只修改文档中出现的字段
+        bulk_upsert(self.collection, [{'n': 0, 'name': 'zero'}], key='n')
+        self.assertEqual({'_id': 0, 'n': 0, 'name': 'zero'}, self.collection.find_one({'n': 0}))
+        # 文档中带有 _id 时，已有的文档保留原来的 _id，新插入的文档使用给出的 _id
+        result = bulk_upsert(self.collection, [{'_id': 'a', 'name': 'zero', 'n': -1}, {'_id': 'b', 'name': 'new'},
+                                               {'name': 'zero'}], key='name')
+        self.assertEqual([], result.errors)
+        self.assertEqual({'_id': 0, 'n': -1, 'name': 'zero'}, self.collection.find_one({'name': 'zero'}))
+        self.assertEqual({'_id': 'b', 'name': 'new'}, self.collection.find_one({'name': 'new'}))
+
+    def test_find_iter(self):
+        bulk_insert(self.collection, (dict(event, _id=event['id']) for event in generate_events(1000)))
+        docs = list(find_iter(self.collection, {'id': {'$lt': 3}}, fields=['id', 'user'], batch_size=2, sort='id'))
+        self.assertEqual([{'id': 0, 'user': 'user-0'}, {'id': 1, 'user': 'user-1'}, {'id': 2, 'user': 'user-2'}], docs)
+
+        docs = list(find_iter(self.collection, {'id': 0}, fields=['_id', 'type']))
+        self.assertEqual([{'_id': 0, 'type': 'click'}], docs)
+        self.assertEqual(1000, sum(1 for _ in find_iter(self.collection, batch_size=100)))
+
+
+@benchmark
+class MongoBenchmarks(unittest.TestCase):
+
+    def test_bench_write_and_read(self):
+        """比较逐个 insert_one 和 bulk_write 的每秒写入文档数，以及不同 batch_size、有无投影时的读取速度
+
+        mongomock 没有网络往返，batch_size 对它没有影响，需要设置 MONGO_URL 连接真实的 mongod 才有意义。
+        """
+        client = _client()
+        collection = client['python_demos_bench']['events']
+        collection.drop()
+        try:
+            # mongomock 的写入和读取都很慢（读取的时间随文档数平方增长），不连接 mongod 时减少文档数
+            n = 10_000 if MONGO_URL else 2000
+            begin = time.perf_counter()
+            for event in generate_events(n):
+                collection.insert_one(event)
+            print(f'insert_one            {n / (time.perf_counter() - begin):10.0f} docs/s')
+            collection.drop()
+
+            n = 200_000 if MONGO_URL else 20_000
+            for batch_size in (100, 1000, 10_000):
+                begin = time.perf_counter()
+                bulk_insert(collection, generate_events(n), batch_size)
+                print(f'bulk_write batch {batch_size:>5} {n / (time.perf_counter() - begin):10.0f} docs/s')
+                collection.drop()
+
+            bulk_insert(collection, generate_events(n), 10_000)
+            for batch_size in (101, 1000, 10_000):
+                for fields in (None, ['id', 'user']):
+                    begin = time.perf_counter()
+                    count = sum(1 for _ in find_iter(collection, fields=fields, batch_size=batch_size))
+                    print(f'find batch {batch_size:>5} fields {fields}  '
+                          f'{count / (time.perf_counter() - begin):10.0f} docs/s')
+        finally:
+            collection.drop()
+            client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
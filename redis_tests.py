@@ -1,5 +1,683 @@
+import asyncio
+import bisect
+import collections
+import csv
+import fnmatch
+import io
+import itertools
+import json
+import os
+import tempfile
+import socketserver
+import threading
+import time
 import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
 from redis import Redis, ConnectionPool
+from redis import asyncio as aioredis
+
+from json_tests import JsonLinesWriter, iter_json_lines
+from support import benchmark
+
+# 默认连接一个进程内的模拟服务器，设置 REDIS_URL（如 redis://localhost:6379/0）后连接真实的 redis-server
+REDIS_URL = os.environ.get('REDIS_URL')
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """一个进程内的、极简的 Redis 模拟服务器，只实现了演示和基准测试用到的少数命令
+
+    它使用真实的 RESP 协议通信，因此 redis-py 客户端可以像连接 redis-server 一样连接它，
+    连接池、流水线等客户端行为都和真实环境一致。
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _FakeRedisHandler)
+        self.data = {}
+        self.channels = collections.defaultdict(set)
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def url(self):
+        return f'redis://{self.server_address[0]}:{self.port}/0'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-redis', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def execute(self, args):
+        command = getattr(self, f'_cmd_{args[0].decode().lower()}', None)
+        if command is None:
+            return ValueError(f"unknown command '{args[0].decode()}'")
+        with self.lock:
+            try:
+                return command(*args[1:])
+            except (TypeError, ValueError) as e:
+                return ValueError(str(e) or 'syntax error')
+
+    def _cmd_hello(self, protover=b'2', *options):
+        # redis-py 新版本默认使用 RESP3 协议，连接时会先发送 HELLO 3
+        return {'server': 'fake-redis', 'version': '7.0.0', 'proto': int(protover)}
+
+    def _cmd_ping(self, message=None):
+        return 'PONG' if message is None else message
+
+    def _cmd_set(self, key, value, *options):
+        self.data[key] = value
+        return 'OK'
+
+    def _cmd_get(self, key):
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, bytes):
+            raise ValueError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def _cmd_del(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def _cmd_exists(self, *keys):
+        return sum(key in self.data for key in keys)
+
+    def _cmd_mset(self, *pairs):
+        self.data.update(zip(pairs[::2], pairs[1::2]))
+        return 'OK'
+
+    def _cmd_mget(self, *keys):
+        # 和 Redis 一样，不是 string 类型的 key 返回 nil
+        return [value if isinstance(value, bytes) else None for value in map(self.data.get, keys)]
+
+    def _cmd_hset(self, key, *pairs):
+        mapping = self.data.setdefault(key, {})
+        added = sum(field not in mapping for field in pairs[::2])
+        mapping.update(zip(pairs[::2], pairs[1::2]))
+        return added
+
+    def _cmd_hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def _cmd_rpush(self, key, *values):
+        items = self.data.setdefault(key, [])
+        items.extend(values)
+        return len(items)
+
+    def _cmd_type(self, key):
+        if key not in self.data:
+            return 'none'
+        return {dict: 'hash', list: 'list'}.get(type(self.data[key]), 'string')
+
+    def _cmd_scan(self, cursor, *options):
+        # 以插入顺序的下标作为游标，只支持 MATCH 和 COUNT 选项
+        options = dict(zip((option.lower() for option in options[::2]), options[1::2]))
+        pattern = options.get(b'match', b'*').decode()
+        count = int(options.get(b'count', 10))
+        keys = list(self.data)
+        start = int(cursor)
+        end = min(start + count, len(keys))
+        matched = [key for key in keys[start:end] if fnmatch.fnmatchcase(key.decode(), pattern)]
+        return [str(end if end < len(keys) else 0).encode(), matched]
+
+    def _cmd_dbsize(self):
+        return len(self.data)
+
+    def _cmd_flushdb(self, *options):
+        self.data.clear()
+        return 'OK'
+
+    def _cmd_publish(self, channel, message):
+        handlers = list(self.channels.get(channel, ()))
+        for handler in handlers:
+            handler.push(_Push([b'message', channel, message]))
+        return len(handlers)
+
+
+class _FakeRedisHandler(socketserver.BaseRequestHandler):
+    """解析 RESP 协议的请求，交给 FakeRedisServer 执行，并把结果编码后写回"""
+
+    def setup(self):
+        self.resp3 = False
+        self.subscriptions = set()
+        # PUBLISH 会在其他连接的线程中向本连接推送消息，发送需要加锁
+        self.send_lock = threading.Lock()
+
+    def handle(self):
+        buffer = bytearray()
+        while True:
+            data = self.request.recv(1 << 16)
+            if not data:
+                return
+            buffer += data
+            commands, consumed = _parse_commands(buffer)
+            del buffer[:consumed]
+            # 流水线中的多条命令可能在同一次 recv 中到达，它们的响应合并为一次发送
+            replies = []
+            for args in commands:
+                name = args[0].lower()
+                if name in (b'subscribe', b'unsubscribe'):
+                    replies.extend(_encode_reply(reply, self.resp3) for reply in self._subscribe(name, args[1:]))
+                    continue
+                reply = self.server.execute(args)
+                if name == b'hello' and isinstance(reply, dict):
+                    self.resp3 = reply['proto'] == 3
+                replies.append(_encode_reply(reply, self.resp3))
+            if replies:
+                with self.send_lock:
+                    self.request.sendall(b''.join(replies))
+
+    def finish(self):
+        self._subscribe(b'unsubscribe', [])
+
+    def push(self, message):
+        with self.send_lock:
+            self.request.sendall(_encode_reply(message, self.resp3))
+
+    def _subscribe(self, name, channels):
+        replies = []
+        with self.server.lock:
+            if name == b'unsubscribe' and not channels:
+                channels = list(self.subscriptions)
+            for channel in channels:
+                if name == b'subscribe':
+                    self.subscriptions.add(channel)
+                    self.server.channels[channel].add(self)
+                else:
+                    self.subscriptions.discard(channel)
+                    self.server.channels[channel].discard(self)
+                replies.append(_Push([name, channel, len(self.subscriptions)]))
+        return replies
+
+
+class _Push(list):
+    """服务器主动推送的消息，RESP3 中是专门的 push 类型，RESP2 中是普通数组"""
+
+
+def _parse_commands(buffer):
+    """从缓冲区中解析出所有完整的命令，返回 (命令列表, 已消费的字节数)"""
+    commands = []
+    pos = 0
+    while True:
+        end = buffer.find(b'\r\n', pos)
+        if end < 0:
+            return commands, pos
+        args = []
+        p = end + 2
+        for _ in range(int(buffer[pos + 1:end])):
+            end = buffer.find(b'\r\n', p)
+            if end < 0:
+                return commands, pos
+            length = int(buffer[p + 1:end])
+            p = end + 2
+            if p + length + 2 > len(buffer):
+                return commands, pos
+            args.append(bytes(buffer[p:p + length]))
+            p += length + 2
+        commands.append(args)
+        pos = p
+
+
+def _encode_reply(value, resp3=False):
+    if value is None:
+        return b'_\r\n' if resp3 else b'$-1\r\n'
+    if isinstance(value, Exception):
+        return f'-ERR {value}\r\n'.encode()
+    if isinstance(value, str):
+        return f'+{value}\r\n'.encode()
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if isinstance(value, dict):
+        # RESP3 有专门的 map 类型，RESP2 中则是键值交替的数组
+        if resp3:
+            return b'%%%d\r\n' % len(value) + b''.join(
+                _encode_reply(k, resp3) + _encode_reply(v, resp3) for k, v in value.items())
+        value = [item for pair in value.items() for item in pair]
+    prefix = b'>' if resp3 and isinstance(value, _Push) else b'*'
+    return prefix + b'%d\r\n' % len(value) + b''.join(_encode_reply(item, resp3) for item in value)
+
+
+class AutoPipeline:
+    """自动把命令合并到流水线（pipeline）中批量发送的 Redis 客户端包装
+
+    调用方像使用 Redis 实例一样调用命令，如 auto.set('s1', 'hello')，但立即返回一个 Future；
+    后台线程在第一条命令到达后最多等待 max_delay 秒，或者凑够 max_batch 条命令时，
+    通过一个非事务的 pipeline 一次性发送，只需一次网络往返，再逐个完成对应的 Future。
+    """
+
+    def __init__(self, redis, max_batch=100, max_delay=0.001):
+        self.redis = redis
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='redis-auto-pipeline', daemon=True)
+        self._thread.start()
+
+    def execute_command(self, name, *args, **kwargs):
+        """提交一条命令，name 为 Redis 实例上的方法名，如 'set'、'get'，返回一个 Future"""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise ValueError('auto pipeline is closed')
+            self._pending.append((name, args, kwargs, future))
+            self._cond.notify()
+        return future
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.execute_command(name, *args, **kwargs)
+
+    def close(self):
+        """发送所有已提交的命令后停止后台线程"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.max_batch and not self._closed:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+
+            pipe = self.redis.pipeline(transaction=False)
+            try:
+                for name, args, kwargs, _ in batch:
+                    getattr(pipe, name)(*args, **kwargs)
+                # raise_on_error=False 使得单条命令的错误只影响它自己的 Future
+                results = pipe.execute(raise_on_error=False)
+            except Exception as e:
+                for *_, future in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                pipe.reset()
+            for (*_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+class LatencyHistogram:
+    """按对数分桶的延迟直方图，每翻一倍划分 4 个桶，从 1 微秒到约 100 秒，内存占用固定"""
+    BOUNDS = [1e-6 * 2 ** (i / 4) for i in range(108)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, p):
+        """返回第 p（0~100）百分位所在桶的上界，单位为秒"""
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.BOUNDS[min(i, len(self.BOUNDS) - 1)]
+        return self.BOUNDS[-1]
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class PoolMetrics:
+    """连接池的运行指标：正在使用的连接数、获取连接的等待时间，以及每种命令的延迟"""
+
+    def __init__(self):
+        self.in_use = 0
+        self.max_in_use = 0
+        self.acquire = LatencyHistogram()
+        self.commands = collections.defaultdict(LatencyHistogram)
+
+    def __repr__(self):
+        return (f'PoolMetrics(in_use={self.in_use}, max_in_use={self.max_in_use}, '
+                f'acquire_p99={self.acquire.percentile(99) * 1000:.3f}ms, commands={sorted(self.commands)})')
+
+
+class MeteredConnectionPool(aioredis.BlockingConnectionPool):
+    """有上限的 asyncio 连接池，连接用完时协程会等待（而不是创建新连接或报错），并记录 PoolMetrics"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    async def get_connection(self, *args, **kwargs):
+        begin = time.perf_counter()
+        connection = await super().get_connection(*args, **kwargs)
+        self.metrics.acquire.record(time.perf_counter() - begin)
+        self.metrics.in_use += 1
+        self.metrics.max_in_use = max(self.metrics.max_in_use, self.metrics.in_use)
+        return connection
+
+    async def release(self, connection):
+        self.metrics.in_use -= 1
+        await super().release(connection)
+
+
+class MeteredRedis(aioredis.Redis):
+    """记录每条命令延迟的 asyncio Redis 客户端，延迟包含了从连接池获取连接的等待时间"""
+
+    @classmethod
+    def from_url(cls, url, max_connections=64, timeout=None, **kwargs):
+        pool = MeteredConnectionPool.from_url(url, max_connections=max_connections, timeout=timeout, **kwargs)
+        return cls(connection_pool=pool)
+
+    @property
+    def metrics(self):
+        return self.connection_pool.metrics
+
+    async def execute_command(self, *args, **options):
+        begin = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            self.connection_pool.metrics.commands[str(args[0]).upper()].record(time.perf_counter() - begin)
+
+
+async def run_redis_load(redis, concurrency, requests, keys=1000):
+    """以 concurrency 个并发协程向 redis 发送 requests 条 GET/SET 命令（各占一半），
+    返回 (每秒命令数, p50 延迟, p99 延迟)，延迟单位为秒"""
+    latencies = LatencyHistogram()
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            begin = time.perf_counter()
+            if i % 2:
+                await redis.get(f'load:{i % keys}')
+            else:
+                await redis.set(f'load:{i % keys}', i)
+            latencies.record(time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - begin
+    return requests / elapsed, latencies.percentile(50), latencies.percentile(99)
+
+
+CacheStats = collections.namedtuple('CacheStats', ['hits', 'misses', 'evictions'])
+
+
+class TwoTierCache:
+    """在 Redis 前面加一层进程内 LRU 缓存的读穿透（read-through）缓存
+
+    get 先查本地缓存，未命中或已过期时才访问 Redis，并把结果（包括 key 不存在的情况）放入本地缓存。
+    本地缓存最多保存 max_size 个 key，超出时淘汰最久未被访问的；每个 key 最多缓存 ttl 秒。
+
+    防击穿：同一个 key 同时有多个线程未命中时，只有第一个线程访问 Redis，其他线程等待它的结果。
+
+    失效通知：指定 channel 后，set/delete 会在写入 Redis 之后向该频道发布被修改的 key，
+    调用 listen() 的实例会订阅这个频道，收到消息时删除本地缓存中的 key，这样多个进程的本地缓存可以保持一致。
+    其他地方直接写入 Redis 的程序也需要发布同样的消息，否则只能等 ttl 过期。
+    """
+
+    def __init__(self, redis, max_size=10_000, ttl=60.0, channel=None):
+        self.redis = redis
+        self.max_size = max_size
+        self.ttl = ttl
+        self.channel = channel
+        self.hits = self.misses = self.evictions = 0
+        self._local = collections.OrderedDict()
+        self._inflight = {}
+        self._invalidated = set()
+        self._lock = threading.Lock()
+        self._pubsub = self._listener = None
+
+    @property
+    def stats(self):
+        return CacheStats(self.hits, self.misses, self.evictions)
+
+    def get(self, key):
+        key = _encode_key(key)
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._local.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        error = None
+        try:
+            value = self.redis.get(key)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # 无论读取的结果如何（包括 KeyboardInterrupt 等 BaseException）都要完成 future，否则等待它的线程会永远阻塞
+            with self._lock:
+                del self._inflight[key]
+                # 读取期间 key 被修改了，读到的值可能是旧的，不放入本地缓存
+                stale = key in self._invalidated
+                self._invalidated.discard(key)
+                if error is None and not stale:
+                    self._put(key, value)
+            if error is None:
+                future.set_result(value)
+            else:
+                future.set_exception(error)
+        return value
+
+    def set(self, key, value, **kwargs):
+        key = _encode_key(key)
+        result = self.redis.set(key, value, **kwargs)
+        self._publish(key)
+        return result
+
+    def delete(self, key):
+        key = _encode_key(key)
+        result = self.redis.delete(key)
+        self._publish(key)
+        return result
+
+    def invalidate(self, key):
+        """删除本地缓存中的 key"""
+        key = _encode_key(key)
+        with self._lock:
+            self._local.pop(key, None)
+            if key in self._inflight:
+                self._invalidated.add(key)
+
+    def listen(self):
+        """在后台线程中订阅失效通知频道"""
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel: lambda message: self.invalidate(message['data'])})
+        self._listener = self._pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+        return self
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener.join()
+            self._pubsub.close()
+            self._listener = self._pubsub = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _put(self, key, value):
+        self._local[key] = (time.monotonic() + self.ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+            self.evictions += 1
+
+    def _publish(self, key):
+        self.invalidate(key)
+        if self.channel is not None:
+            self.redis.publish(self.channel, key)
+
+
+def _encode_key(key):
+    # 失效通知中的 key 是 bytes，本地缓存统一使用 bytes 作为 key
+    return key.encode() if isinstance(key, str) else key
+
+
+def iter_records(path):
+    """从 JSON Lines 或 CSV 文件中逐条读取 (key, value)
+
+    JSON Lines 的每一行形如 {"key": "s1", "value": "hello"}，value 为对象时写入 hash，否则写入 string；
+    CSV 文件的表头如果只有 key 和 value 两列，写入 string，否则除 key 以外的列作为 hash 的字段。
+    """
+    if str(path).endswith('.csv'):
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames == ['key', 'value']:
+                for row in reader:
+                    yield row['key'], row['value']
+            else:
+                for row in reader:
+                    key = row.pop('key')
+                    yield key, row
+    else:
+        with open(path) as f:
+            for record in iter_json_lines(f):
+                yield record['key'], record['value']
+
+
+def _load_batch(redis, batch):
+    pipe = redis.pipeline(transaction=False)
+    strings = {}
+    for key, value in batch:
+        if isinstance(value, dict):
+            pipe.hset(key, mapping=value)
+        else:
+            strings[key] = value if isinstance(value, (str, bytes, int, float)) else json.dumps(value)
+    # 一批中所有的 string 合并为一条 MSET
+    if strings:
+        pipe.mset(strings)
+    pipe.execute()
+    return len(batch)
+
+
+def bulk_load(redis, records, batch_size=1000, connections=4):
+    """把 (key, value) 记录流按 batch_size 分批，通过 connections 个并行的连接以 pipeline 写入 Redis，返回写入的 key 数
+
+    同时在途的批次不超过 connections 的两倍，因此内存占用与记录总数无关。
+    """
+    records = iter(records)
+    loaded = 0
+    with ThreadPoolExecutor(connections) as executor:
+        pending = collections.deque()
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if batch:
+                pending.append(executor.submit(_load_batch, redis, batch))
+            if len(pending) >= connections * 2 or (not batch and pending):
+                loaded += pending.popleft().result()
+            if not batch and not pending:
+                return loaded
+
+
+def bulk_export(redis, match='*', batch_size=1000, skipped=None):
+    """使用 SCAN 遍历 keyspace，每批 key 用一条 MGET 读取 string 的值，逐条返回 (key, value)
+
+    hash 类型的 key 在 MGET 中返回 None，再通过一个 pipeline 读取它们的 TYPE 和 HGETALL。
+    只导出 string 和 hash，其他类型（list、set、zset、stream）的 key 不会被导出，
+    传入 skipped（一个 list）时，这些 key 以 (key, type) 的形式追加到其中；SCAN 和 MGET 之间被删除的 key 不会被记录。
+    """
+    cursor = 0
+    while True:
+        cursor, keys = redis.scan(cursor, match=match, count=batch_size)
+        if keys:
+            values = redis.mget(keys)
+            others = [key for key, value in zip(keys, values) if value is None]
+            hashes = {}
+            if others:
+                pipe = redis.pipeline(transaction=False)
+                for key in others:
+                    pipe.type(key)
+                types = [type_.decode() if isinstance(type_, bytes) else type_ for type_ in pipe.execute()]
+                hash_keys = [key for key, type_ in zip(others, types) if type_ == 'hash']
+                if skipped is not None:
+                    skipped += [(key, type_) for key, type_ in zip(others, types) if type_ not in ('hash', 'none')]
+                for key in hash_keys:
+                    pipe.hgetall(key)
+                hashes = dict(zip(hash_keys, pipe.execute()))
+            for key, value in zip(keys, values):
+                if value is not None:
+                    yield key, value
+                elif key in hashes:
+                    yield key, hashes[key]
+        if int(cursor) == 0:
+            return
+
+
+def export_json_lines(redis, f, match='*', batch_size=1000, skipped=None):
+    """把 bulk_export 的结果以 JSON Lines 格式写入文件，格式和 iter_records 读取的一致，返回导出的 key 数"""
+    exported = 0
+    with JsonLinesWriter(f, batch_size) as writer:
+        for key, value in bulk_export(redis, match, batch_size, skipped):
+            if isinstance(value, dict):
+                value = {k.decode(): v.decode() for k, v in value.items()}
+            else:
+                value = value.decode()
+            writer.write({'key': key.decode(), 'value': value})
+            exported += 1
+    return exported
+
+
+def _bench_redis():
+    """返回基准测试使用的 (Redis 实例, 模拟服务器)，设置了 REDIS_URL 时不启动模拟服务器"""
+    if REDIS_URL:
+        return Redis.from_url(REDIS_URL), None
+    server = FakeRedisServer().start()
+    return Redis.from_url(server.url), server
 
 
 class RedisTests(unittest.TestCase):
@@ -20,5 +698,287 @@ class RedisTests(unittest.TestCase):
         redis.set('s1', 'hello')
         print(redis.get('s1'))  # Output: b'hello'
 
+    def test_fake_server(self):
+        """测试进程内的模拟服务器，它可以代替本地 redis-server 用于演示"""
+        with FakeRedisServer() as server:
+            redis = Redis(port=server.port)
+            redis.set('s1', 'hello')
+            self.assertEqual(b'hello', redis.get('s1'))
+            self.assertIsNone(redis.get('s2'))
+
+    def test_auto_pipeline(self):
+        """测试自动批量提交命令，多个线程的命令会被合并到同一个 pipeline 中"""
+        with FakeRedisServer() as server:
+            redis = Redis(port=server.port)
+            with AutoPipeline(redis, max_batch=50, max_delay=0.01) as auto:
+                futures = [auto.set(f's{i}', i) for i in range(100)]
+                self.assertEqual([True] * 100, [future.result() for future in futures])
+                self.assertEqual(b'42', auto.get('s42').result())
+
+                # 多线程并发提交
+                with ThreadPoolExecutor(8) as executor:
+                    results = list(executor.map(lambda i: auto.get(f's{i}').result(), range(100)))
+                self.assertEqual([str(i).encode() for i in range(100)], results)
+
+                # 单条命令的错误只会体现在它自己的 Future 上，这里通过 pipeline 的 execute_command 发送一条不存在的命令
+                self.assertIsInstance(auto.execute_command('execute_command', 'NOSUCHCOMMAND').exception(), Exception)
+                self.assertEqual(b'1', auto.get('s1').result())
+
+            # 关闭后不能再提交命令
+            with self.assertRaises(ValueError):
+                auto.get('s1')
+
+    def test_latency_histogram(self):
+        """测试对数分桶的延迟直方图"""
+        histogram = LatencyHistogram()
+        self.assertEqual(0.0, histogram.percentile(99))
+        for ms in range(1, 101):
+            histogram.record(ms / 1000)
+        self.assertEqual(100, histogram.count)
+        # 百分位的值是所在桶的上界，误差不超过 2 ** (1 / 4) 倍，约 19%
+        self.assertTrue(0.050 <= histogram.percentile(50) <= 0.050 * 2 ** (1 / 4))
+        self.assertTrue(0.099 <= histogram.percentile(99) <= 0.099 * 2 ** (1 / 4))
+        self.assertAlmostEqual(0.0505, histogram.mean)
+
+    def test_asyncio_fan_out(self):
+        """测试通过有上限的连接池并发执行上千条 GET/SET 命令，并收集连接池指标"""
+        async def fan_out(url):
+            redis = MeteredRedis.from_url(url, max_connections=8)
+            try:
+                await asyncio.gather(*(redis.set(f's{i}', i) for i in range(1000)))
+                values = await asyncio.gather(*(redis.get(f's{i}') for i in range(1000)))
+            finally:
+                await redis.aclose()
+            return values, redis.metrics
+
+        with FakeRedisServer() as server:
+            values, metrics = asyncio.run(fan_out(server.url))
+        self.assertEqual([str(i).encode() for i in range(1000)], values)
+        # 同时在用的连接数不会超过连接池的上限，用完后全部归还
+        self.assertEqual(8, metrics.max_in_use)
+        self.assertEqual(0, metrics.in_use)
+        self.assertEqual(1000, metrics.commands['SET'].count)
+        self.assertEqual(1000, metrics.commands['GET'].count)
+        self.assertEqual(2000, metrics.acquire.count)
+
+    def test_two_tier_cache(self):
+        """测试本地 LRU 缓存的命中、淘汰和过期"""
+        with FakeRedisServer() as server:
+            redis = Redis(port=server.port)
+            redis.mset({'s1': 'hello', 's2': 'world', 's3': '!'})
+            cache = TwoTierCache(redis, max_size=2, ttl=0.2)
+
+            # 第一次访问未命中，之后都命中本地缓存
+            self.assertEqual(b'hello', cache.get('s1'))
+            self.assertEqual(b'hello', cache.get('s1'))
+            self.assertEqual(CacheStats(hits=1, misses=1, evictions=0), cache.stats)
+            # 不存在的 key 也会被缓存
+            self.assertIsNone(cache.get('s4'))
+            self.assertIsNone(cache.get('s4'))
+            self.assertEqual(CacheStats(hits=2, misses=2, evictions=0), cache.stats)
+
+            # 超出 max_size 时淘汰最久未被访问的 s1
+            cache.get('s2')
+            self.assertEqual(CacheStats(hits=2, misses=3, evictions=1), cache.stats)
+            # 直接修改 Redis，本地缓存在 ttl 过期之前仍然返回旧值
+            redis.set('s2', 'python')
+            self.assertEqual(b'world', cache.get('s2'))
+            time.sleep(0.2)
+            self.assertEqual(b'python', cache.get('s2'))
+
+            # 通过缓存写入会同时使本地缓存失效
+            cache.set('s2', 'demos')
+            self.assertEqual(b'demos', cache.get('s2'))
+
+    def test_two_tier_cache_invalidation(self):
+        """测试通过 pub/sub 通知其他实例的本地缓存失效"""
+        with FakeRedisServer() as server:
+            redis = Redis(port=server.port)
+            redis.set('s1', 'hello')
+            with TwoTierCache(redis, channel='cache:invalidate').listen() as reader:
+                writer = TwoTierCache(redis, channel='cache:invalidate')
+                self.assertEqual(b'hello', reader.get('s1'))
+                writer.set('s1', 'world')
+                # 失效通知是异步到达的
+                for _ in range(50):
+                    if b's1' not in reader._local:
+                        break
+                    time.sleep(0.01)
+                self.assertEqual(b'world', reader.get('s1'))
+
+    def test_two_tier_cache_stampede(self):
+        """测试同一个 key 被多个线程同时访问时，只有一个线程会访问 Redis"""
+        class SlowRedis:
+            calls = 0
+
+            def get(self, key):
+                SlowRedis.calls += 1
+                time.sleep(0.1)
+                return b'hello'
+
+        cache = TwoTierCache(SlowRedis())
+        with ThreadPoolExecutor(16) as executor:
+            results = list(executor.map(lambda _: cache.get('s1'), range(16)))
+        self.assertEqual([b'hello'] * 16, results)
+        self.assertEqual(1, SlowRedis.calls)
+        self.assertEqual(16, cache.stats.misses)
+
+    def test_two_tier_cache_leader_interrupted(self):
+        """测试访问 Redis 的线程被 BaseException 中断时，等待它的线程收到同样的异常，而不是永远阻塞"""
+        class Interrupted(BaseException):
+            pass
+
+        started = threading.Event()
+
+        class InterruptedRedis:
+            def get(self, key):
+                started.set()
+                time.sleep(0.1)
+                raise Interrupted()
+
+        cache = TwoTierCache(InterruptedRedis())
+        with ThreadPoolExecutor(1) as executor:
+            leader = executor.submit(cache.get, 's1')
+            started.wait()
+            with self.assertRaises(Interrupted):
+                cache.get('s1')
+            with self.assertRaises(Interrupted):
+                leader.result()
+        # 失败的读取不会被缓存，下一次访问会重新读取 Redis
+        self.assertEqual(0, len(cache._local))
+        self.assertEqual({}, cache._inflight)
+
+    def test_bulk_load_and_export(self):
+        """测试从 JSON Lines 和 CSV 文件批量导入，再通过 SCAN + MGET 流式导出"""
+        with FakeRedisServer() as server, tempfile.TemporaryDirectory() as tmp:
+            redis = Redis(port=server.port)
+            jsonl, csv_file = os.path.join(tmp, '1.jsonl'), os.path.join(tmp, '1.csv')
+            with open(jsonl, 'w') as f, JsonLinesWriter(f) as writer:
+                writer.writerows({'key': f's{i}', 'value': f'v{i}'} for i in range(250))
+                writer.write({'key': 'h1', 'value': {'name': 'gukt'}})
+            with open(csv_file, 'w', newline='') as f:
+                f.write('key,name,age\nu1,foo,18\nu2,bar,20\n')
+
+            self.assertEqual(251, bulk_load(redis, iter_records(jsonl), batch_size=10, connections=4))
+            self.assertEqual(2, bulk_load(redis, iter_records(csv_file)))
+            self.assertEqual(b'v42', redis.get('s42'))
+            self.assertEqual({b'name': b'foo', b'age': b'18'}, redis.hgetall('u1'))
+
+            # 流式导出所有的 key，hash 类型的 key 也会被导出，其他类型的 key 被跳过
+            redis.rpush('l1', 'a', 'b')
+            skipped = []
+            exported = dict(bulk_export(redis, batch_size=7, skipped=skipped))
+            self.assertEqual(253, len(exported))
+            self.assertEqual(b'v0', exported[b's0'])
+            self.assertEqual({b'name': b'gukt'}, exported[b'h1'])
+            self.assertEqual([(b'l1', 'list')], skipped)
+            redis.delete('l1')
+            self.assertEqual(2, len(list(bulk_export(redis, match='u*'))))
+
+            # 导出为 JSON Lines 后可以再次导入
+            f = io.StringIO()
+            self.assertEqual(253, export_json_lines(redis, f))
+            f.seek(0)
+            records = list(iter_json_lines(f))
+            self.assertIn({'key': 's0', 'value': 'v0'}, records)
+            self.assertIn({'key': 'u2', 'value': {'name': 'bar', 'age': '20'}}, records)
+
+
+@benchmark
+class RedisBenchmarks(unittest.TestCase):
+
+    def test_bench_auto_pipeline(self):
+        """比较逐条调用、手动 pipeline 和 AutoPipeline 的 ops/s"""
+        redis, server = _bench_redis()
+        n = 20_000
+        try:
+            begin = time.perf_counter()
+            for i in range(n):
+                redis.set(f'bench:{i}', i)
+            print(f'naive           {n / (time.perf_counter() - begin):10.0f} ops/s')
+
+            begin = time.perf_counter()
+            pipe = redis.pipeline(transaction=False)
+            for i in range(n):
+                pipe.set(f'bench:{i}', i)
+                if len(pipe) == 100:
+                    pipe.execute()
+            pipe.execute()
+            print(f'pipeline()      {n / (time.perf_counter() - begin):10.0f} ops/s')
+
+            # AutoPipeline 面向的是多个调用方各自发出单条命令的场景，这里用 16 个线程模拟
+            with AutoPipeline(redis) as auto, ThreadPoolExecutor(16) as executor:
+                begin = time.perf_counter()
+                list(executor.map(lambda i: auto.set(f'bench:{i}', i).result(), range(n)))
+                print(f'AutoPipeline    {n / (time.perf_counter() - begin):10.0f} ops/s  (16 threads)')
+        finally:
+            if server is not None:
+                server.stop()
+
+    def test_bench_two_tier_cache(self):
+        """比较热点 key 直接访问 Redis 和经过本地缓存的读取延迟"""
+        redis, server = _bench_redis()
+        try:
+            redis.set('hot', 'hello')
+            cache = TwoTierCache(redis)
+            for name, get in (('Redis.get', redis.get), ('TwoTierCache.get', cache.get)):
+                latencies = LatencyHistogram()
+                for _ in range(20_000):
+                    begin = time.perf_counter()
+                    get('hot')
+                    latencies.record(time.perf_counter() - begin)
+                print(f'{name:<17} mean {latencies.mean * 1e6:8.2f} us  p99 {latencies.percentile(99) * 1e6:8.2f} us')
+            print(cache.stats)
+        finally:
+            if server is not None:
+                server.stop()
+
+    def test_bench_bulk_load(self):
+        """不同批次大小和连接数下批量导入的 keys/s，以及流式导出的 keys/s"""
+        redis, server = _bench_redis()
+        n = 1_000_000
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, '1.jsonl')
+                with open(path, 'w') as f, JsonLinesWriter(f) as writer:
+                    writer.writerows({'key': f'bulk:{i}', 'value': f'value-{i}'} for i in range(n))
+
+                for batch_size in (100, 1000, 10_000):
+                    for connections in (1, 4, 16):
+                        begin = time.perf_counter()
+                        bulk_load(redis, iter_records(path), batch_size, connections)
+                        print(f'load    batch {batch_size:>6}  connections {connections:>3}  '
+                              f'{n / (time.perf_counter() - begin):10.0f} keys/s')
+
+            for batch_size in (100, 1000, 10_000):
+                begin = time.perf_counter()
+                exported = sum(1 for _ in bulk_export(redis, 'bulk:*', batch_size))
+                print(f'export  batch {batch_size:>6}  {exported / (time.perf_counter() - begin):10.0f} keys/s')
+        finally:
+            if server is not None:
+                server.stop()
+
+    def test_bench_asyncio_load(self):
+        """asyncio 客户端在并发度为 1、64、1024 时的吞吐量和 p50/p99 延迟，以及获取连接的等待时间"""
+        _, server = _bench_redis()
+        url = REDIS_URL or server.url
+        try:
+            for concurrency in (1, 64, 1024):
+                async def run():
+                    redis = MeteredRedis.from_url(url, max_connections=64)
+                    try:
+                        return await run_redis_load(redis, concurrency, 20_000), redis.metrics
+                    finally:
+                        await redis.aclose()
+
+                (rate, p50, p99), metrics = asyncio.run(run())
+                print(f'concurrency {concurrency:>5}  {rate:10.0f} ops/s  p50 {p50 * 1000:8.3f} ms  '
+                      f'p99 {p99 * 1000:8.3f} ms  acquire p99 {metrics.acquire.percentile(99) * 1000:8.3f} ms  '
+                      f'max in use {metrics.max_in_use}')
+        finally:
+            if server is not None:
+                server.stop()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,226 @@
+import io
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+import time
 import unittest
 
+from json_tests import JsonLinesWriter, iter_json_lines
+from support import benchmark, generate_events
 
-class MyTestCase(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)  # add assertion here
+
+# 写入密集场景的推荐设置：
+# WAL 模式下读写互不阻塞，synchronous=NORMAL 时只在检查点 fsync，断电最多丢失最近提交的事务而不会损坏数据库；
+# cache_size 为负数时单位是 KiB；mmap_size 让读取直接访问映射的页面，减少一次复制
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 << 20,
+    'temp_store': 'MEMORY',
+}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def connect(path, pragmas=None, **kwargs):
+    """打开数据库并应用 pragmas（默认为 PRAGMAS）
+
+    isolation_level=None 关闭了 sqlite3 模块隐式开启事务的行为，事务的边界由 insert_many 等函数显式控制。
+    """
+    conn = sqlite3.connect(path, isolation_level=None, **kwargs)
+    for name, value in (PRAGMAS if pragmas is None else pragmas).items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def create_table(conn, table, columns, primary_key=None):
+    """创建表（已存在时忽略），列不声明类型，由 SQLite 按值的类型存储"""
+    definitions = [_quote(c) + (' PRIMARY KEY' if c == primary_key else '') for c in columns]
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {_quote(table)} ({", ".join(definitions)})')
+
+
+def insert_many(conn, table, columns, rows, batch_size=50_000, replace=False):
+    """把 rows（可以是生成器）按 batch_size 分批，每批在一个事务中用一次 executemany 插入，返回插入的行数
+
+    所有批次使用同一条 SQL，语句只编译一次，之后从连接的语句缓存中复用。某一批失败时只回滚这一批，之前的批次已经提交。
+    """
+    verb = 'INSERT OR REPLACE' if replace else 'INSERT'
+    sql = (f'{verb} INTO {_quote(table)} ({", ".join(map(_quote, columns))}) '
+           f'VALUES ({", ".join("?" * len(columns))})')
+    rows = iter(rows)
+    total = 0
+    while batch := list(itertools.islice(rows, batch_size)):
+        conn.execute('BEGIN')
+        try:
+            conn.executemany(sql, batch)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        total += len(batch)
+    return total
+
+
+def _column_value(value):
+    # SQLite 不能直接存储列表和对象，把它们编码为 JSON 文本，读取时可以用 json_extract() 查询
+    return json.dumps(value, separators=(',', ':')) if isinstance(value, (dict, list)) else value
+
+
+def ingest_json_lines(conn, f, table, columns=None, batch_size=50_000):
+    """把 JSON Lines 文件中的记录写入 table，返回写入的行数
+
+    columns 为 None 时使用第一条记录的字段，表不存在时自动创建。记录中缺少的字段为 NULL，多余的字段被忽略。
+    """
+    records = iter_json_lines(f)
+    if columns is None:
+        first = next(records, None)
+        if first is None:
+            return 0
+        columns = list(first)
+        records = itertools.chain([first], records)
+    create_table(conn, table, columns)
+    rows = (tuple(_column_value(record.get(c)) for c in columns) for record in records)
+    return insert_many(conn, table, columns, rows, batch_size)
+
+
+def ingest_redis_export(conn, f, table='kv', batch_size=50_000):
+    """把 redis_tests.export_json_lines 导出的 {"key": ..., "value": ...} 记录写入 key/value 表，返回写入的行数
+
+    hash 类型的值以 JSON 文本保存。key 为主键，重复导入时覆盖旧值。
+    """
+    create_table(conn, table, ['key', 'value'], primary_key='key')
+    rows = ((record['key'], _column_value(record['value'])) for record in iter_json_lines(f))
+    return insert_many(conn, table, ['key', 'value'], rows, batch_size, replace=True)
+
+
+def iter_rows(conn, sql, params=(), arraysize=1000):
+    """执行查询并逐行返回结果，每次用 fetchmany 取 arraysize 行，内存占用与结果集大小无关"""
+    cursor = conn.execute(sql, params)
+    cursor.arraysize = arraysize
+    try:
+        while rows := cursor.fetchmany():
+            yield from rows
+    finally:
+        cursor.close()
+
+
+class SqliteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.conn = connect(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def test_pragmas(self):
+        self.assertEqual('wal', self.conn.execute('PRAGMA journal_mode').fetchone()[0])
+        # synchronous: 0=OFF, 1=NORMAL, 2=FULL
+        self.assertEqual(1, self.conn.execute('PRAGMA synchronous').fetchone()[0])
+        self.assertEqual(-64 * 1024, self.conn.execute('PRAGMA cache_size').fetchone()[0])
+
+        # 内存数据库不支持 WAL，也可以传入自己的 pragmas
+        conn = connect(':memory:', {'synchronous': 'OFF'})
+        self.assertEqual(0, conn.execute('PRAGMA synchronous').fetchone()[0])
+        conn.close()
+
+    def test_insert_many(self):
+        """测试分批插入，以及某一批失败时只回滚这一批"""
+        create_table(self.conn, 'numbers', ['n', 'square'], primary_key='n')
+        rows = ((i, i * i) for i in range(10_000))
+        self.assertEqual(10_000, insert_many(self.conn, 'numbers', ['n', 'square'], rows, batch_size=3000))
+        self.assertEqual((10_000, 333283335000), self.conn.execute('SELECT COUNT(*), SUM(square) FROM numbers').fetchone())
+
+        # 第二批中有重复的主键
+        rows = [(i, 0) for i in range(10_000, 10_005)] + [(10_005, 0), (0, 0)]
+        with self.assertRaises(sqlite3.IntegrityError):
+            insert_many(self.conn, 'numbers', ['n', 'square'], rows, batch_size=5)
+        self.assertEqual(10_005, self.conn.execute('SELECT COUNT(*) FROM numbers').fetchone()[0])
+        self.assertFalse(self.conn.in_transaction)
+
+        # replace=True 时覆盖已有的行
+        insert_many(self.conn, 'numbers', ['n', 'square'], [(0, -1)], replace=True)
+        self.assertEqual(-1, self.conn.execute('SELECT square FROM numbers WHERE n = 0').fetchone()[0])
+
+    def test_ingest_json_lines(self):
+        buffer = io.StringIO()
+        with JsonLinesWriter(buffer) as writer:
+            writer.writerows(generate_events(1000))
+        buffer.seek(0)
+        self.assertEqual(1000, ingest_json_lines(self.conn, buffer, 'events', batch_size=300))
+
+        rows = list(iter_rows(self.conn, 'SELECT id, user, tags FROM events WHERE id < ? ORDER BY id', (3,)))
+        self.assertEqual([(0, 'user-0', '["a","b"]'), (1, 'user-1', '["a","b"]'), (2, 'user-2', '["a","b"]')], rows)
+        # 列表以 JSON 文本保存，可以用 SQLite 的 JSON 函数查询
+        self.assertEqual(1000, self.conn.execute(
+            "SELECT COUNT(*) FROM events WHERE json_extract(tags, '$[1]') = 'b'").fetchone()[0])
+
+        # 指定列时只写入这些列
+        buffer.seek(0)
+        self.assertEqual(1000, ingest_json_lines(self.conn, buffer, 'users', columns=['user', 'missing']))
+        self.assertEqual(('user-0', None), self.conn.execute('SELECT * FROM users').fetchone())
+        self.assertEqual(0, ingest_json_lines(self.conn, io.StringIO(''), 'empty'))
+
+    def test_ingest_redis_export(self):
+        lines = [{'key': 's1', 'value': 'hello'}, {'key': 'h1', 'value': {'name': 'Tom', 'age': '20'}},
+                 {'key': 's1', 'value': 'world'}]
+        buffer = io.StringIO(''.join(json.dumps(line) + '\n' for line in lines))
+        self.assertEqual(3, ingest_redis_export(self.conn, buffer))
+        self.assertEqual([('h1', '{"name":"Tom","age":"20"}'), ('s1', 'world')],
+                         list(iter_rows(self.conn, 'SELECT key, value FROM kv ORDER BY key', arraysize=1)))
+
+    def test_iter_rows(self):
+        create_table(self.conn, 't', ['n'])
+        insert_many(self.conn, 't', ['n'], ((i,) for i in range(2500)))
+        rows = iter_rows(self.conn, 'SELECT n FROM t ORDER BY n', arraysize=1000)
+        self.assertEqual([(0,), (1,)], list(itertools.islice(rows, 2)))
+        rows.close()
+        self.assertEqual(list(range(2500)), [n for n, in iter_rows(self.conn, 'SELECT n FROM t ORDER BY n')])
+
+
+@benchmark
+class SqliteBenchmarks(unittest.TestCase):
+
+    def test_bench_ingest(self):
+        """比较每行一个事务（autocommit）和分批事务在不同 pragma 设置下的每秒写入行数，以及不同 arraysize 的读取速度"""
+        variants = {
+            'default (DELETE, FULL)': {},
+            'WAL, FULL': {'journal_mode': 'WAL', 'synchronous': 'FULL'},
+            'WAL, NORMAL (PRAGMAS)': PRAGMAS,
+            'WAL, OFF': dict(PRAGMAS, synchronous='OFF'),
+        }
+        columns = ['id', 'type', 'user', 'ts', 'tags']
+        rows = [tuple(_column_value(e[c]) for c in columns) for e in generate_events(500_000)]
+        with tempfile.TemporaryDirectory() as tmp:
+            for i, (name, pragmas) in enumerate(variants.items()):
+                conn = connect(os.path.join(tmp, f'{i}.db'), pragmas)
+                create_table(conn, 'events', columns)
+                sql = 'INSERT INTO events VALUES (?, ?, ?, ?, ?)'
+
+                n = 2000
+                begin = time.perf_counter()
+                for row in rows[:n]:
+                    conn.execute(sql, row)
+                autocommit = n / (time.perf_counter() - begin)
+
+                begin = time.perf_counter()
+                insert_many(conn, 'events', columns, rows)
+                batched = len(rows) / (time.perf_counter() - begin)
+                print(f'{name:<24} autocommit {autocommit:10.0f} rows/s  batched {batched:10.0f} rows/s')
+                conn.close()
+
+            conn = connect(os.path.join(tmp, f'{len(variants) - 1}.db'))
+            for arraysize in (1, 100, 1000, 10_000):
+                begin = time.perf_counter()
+                count = sum(1 for _ in iter_rows(conn, 'SELECT * FROM events', arraysize=arraysize))
+                print(f'read arraysize {arraysize:>6}  {count / (time.perf_counter() - begin):10.0f} rows/s')
+            conn.close()
 
 
 if __name__ == '__main__':
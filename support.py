@@ -0,0 +1,59 @@
+"""各个 *_tests 模块共用的基准测试工具和测试数据生成函数"""
+import multiprocessing
+import os
+import sys
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # Windows 上没有 resource 模块
+    resource = None
+
+# 基准测试默认跳过，设置环境变量 BENCHMARK=1 后运行，如：BENCHMARK=1 python -m unittest file_tests
+BENCHMARK = bool(os.environ.get('BENCHMARK'))
+
+# 用于基准测试类的装饰器
+benchmark = unittest.skipUnless(BENCHMARK, '设置环境变量 BENCHMARK=1 以运行基准测试')
+
+
+def peak_rss():
+    """返回当前进程的峰值 RSS 字节数"""
+    if resource is None:
+        raise ImportError('peak_rss() requires the resource module')
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss 的单位在 macOS 上是字节，在 Linux 上是 KB
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _measure(fn, args):
+    begin = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - begin, peak_rss()
+
+
+def run_isolated(fn, *args):
+    """在一个新的 spawn 子进程中执行 fn(*args)，返回 (结果, 耗时, 峰值 RSS 字节数)
+
+    每次调用都使用独立的进程，ru_maxrss 不会受到父进程和其他测量的影响。fn 必须是模块级的函数。
+    子进程因为内存不足等原因被杀死时抛出 concurrent.futures.process.BrokenProcessPool。
+    """
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_measure, fn, args).result()
+
+
+def generate_lines_file(path, size, line=b'2021-11-24 17:41:24.700623 INFO hello world from python-demos\n'):
+    """生成一个大约 size 字节的文本文件，用于基准测试"""
+    block = line * ((4 << 20) // len(line))
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            written += f.write(block)
+
+
+def generate_events(n):
+    """生成 n 个事件记录（dict），用于测试和基准测试"""
+    for i in range(n):
+        yield {'id': i, 'type': 'click', 'user': f'user-{i % 1000}', 'ts': 1637746884.700623 + i, 'tags': ['a', 'b']}
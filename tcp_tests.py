@@ -1,9 +1,411 @@
+import array
+import asyncio
+import collections
+import itertools
+import os
 import unittest
+from time import perf_counter
 
+from support import benchmark
 
-class MyTestCase(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)  # add assertion here
+
+# 帧格式：4 字节大端序的长度 + 负载
+HEADER_SIZE = 4
+MAX_FRAME_SIZE = 16 << 20
+
+LoadStats = collections.namedtuple('LoadStats', ['messages', 'elapsed', 'rate', 'p50', 'p99'])
+
+
+def encode_frame(payload):
+    return len(payload).to_bytes(HEADER_SIZE, 'big') + payload
+
+
+class _FrameProtocol(asyncio.BufferedProtocol):
+    """按长度前缀拆分帧的协议基类
+
+    数据直接由事件循环 recv_into 到预先分配的 bytearray 中，完整的帧以 memoryview 的形式交给 frame_received()，
+    接收时不会为每条消息复制数据。memoryview 只在 frame_received() 调用期间有效，需要保留时由子类自行复制。
+    缓冲区中剩余的半帧在空间不足时移动到开头；一帧大于整个缓冲区时，缓冲区按需扩大。
+    """
+
+    def __init__(self, buffer_size=256 << 10, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.max_frame_size = max_frame_size
+        self.start = self.end = 0
+        self.transport = None
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        if self.end == len(self.buffer):
+            self._compact()
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+        view, start, end = self.view, self.start, self.end
+        while end - start >= HEADER_SIZE:
+            length = int.from_bytes(view[start:start + HEADER_SIZE], 'big')
+            if length > self.max_frame_size:
+                self.transport.close()
+                return
+            frame_end = start + HEADER_SIZE + length
+            if frame_end > end:
+                # 半帧：如果缓冲区装不下这一帧，提前扩大，这样 get_buffer() 总能返回可写的空间
+                if HEADER_SIZE + length > len(self.buffer):
+                    self.start = start
+                    self._grow(HEADER_SIZE + length)
+                    return
+                break
+            self.frame_received(view[start + HEADER_SIZE:frame_end])
+            start = frame_end
+        if start == end:
+            self.start = self.end = 0
+        else:
+            self.start = start
+
+    def _compact(self):
+        remaining = self.end - self.start
+        self.buffer[:remaining] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, remaining
+
+    def _grow(self, size):
+        # 事件循环可能还持有 get_buffer() 返回的切片，旧的 bytearray 不能改变大小，只能换成新的
+        remaining = self.end - self.start
+        buffer = bytearray(size)
+        buffer[:remaining] = self.view[self.start:self.end]
+        self.buffer, self.view = buffer, memoryview(buffer)
+        self.start, self.end = 0, remaining
+
+    def frame_received(self, payload):
+        """收到一帧时被调用，由子类实现；默认丢弃"""
+
+    def send_frame(self, payload):
+        # 不能交给 transport 一个 memoryview：Python 3.12 起 transport 会直接保存来不及发出的 memoryview 而不复制，
+        # 而 payload 可能是接收缓冲区上的切片，缓冲区之后会被新的数据覆盖。这里拼接为新的 bytes，只复制一次
+        self.transport.write(len(payload).to_bytes(HEADER_SIZE, 'big') + payload)
+
+    def pause_writing(self):
+        self._writable.clear()
+
+    def resume_writing(self):
+        self._writable.set()
+
+    async def drain(self):
+        await self._writable.wait()
+
+
+class FrameServerProtocol(_FrameProtocol):
+    """服务端协议：对收到的每一帧调用 handler，并按收到的顺序写回响应，默认原样返回（echo）"""
+
+    def __init__(self, handler=None, **kwargs):
+        super().__init__(**kwargs)
+        self.handler = handler
+
+    def frame_received(self, payload):
+        self.send_frame(payload if self.handler is None else self.handler(payload))
+
+    # 客户端只发送不读取时，响应会在 transport 的发送缓冲区中无限堆积。
+    # 发送缓冲区超过上限时暂停读取新的请求，排空后再恢复，让 TCP 的流量控制把压力传回客户端
+    def pause_writing(self):
+        super().pause_writing()
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        super().resume_writing()
+        self.transport.resume_reading()
+
+
+async def start_server(host='127.0.0.1', port=0, handler=None, **kwargs):
+    """启动帧协议服务器，handler(memoryview) 返回响应的字节，为 None 时原样返回请求"""
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(lambda: FrameServerProtocol(handler, **kwargs), host, port)
+
+
+class FrameClientProtocol(_FrameProtocol):
+    """客户端协议：请求直接写出而不等待前一个响应（流水线），服务端按顺序响应，因此用一个 FIFO 队列匹配 Future"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.waiters = collections.deque()
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def frame_received(self, payload):
+        if not self.waiters:
+            # 没有对应请求的帧，之后的响应都无法再和请求对应起来，只能关闭连接
+            self.transport.close()
+            return
+        waiter = self.waiters.popleft()
+        if not waiter.done():
+            waiter.set_result(bytes(payload))
+
+    def connection_lost(self, exc):
+        error = exc or ConnectionResetError('connection closed')
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(error)
+        self._writable.set()
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    async def request(self, payload):
+        if self.transport.is_closing():
+            raise ConnectionResetError('connection closed')
+        await self.drain()
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.send_frame(payload)
+        return await waiter
+
+    async def close(self):
+        self.transport.close()
+        await self.closed
+
+
+async def connect(host, port, **kwargs):
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_connection(lambda: FrameClientProtocol(**kwargs), host, port)
+    return protocol
+
+
+class FramePool:
+    """固定大小的连接池，请求轮流分配到各个连接上，每个连接上的请求以流水线方式发送，连接在第一次使用时建立"""
+
+    def __init__(self, host, port, size=4, **kwargs):
+        self.host = host
+        self.port = port
+        self.kwargs = kwargs
+        self.connections = [None] * size
+        self._next = itertools.cycle(range(size))
+        self._lock = asyncio.Lock()
+
+    async def _connection(self, i):
+        conn = self.connections[i]
+        if conn is None or conn.transport.is_closing():
+            async with self._lock:
+                conn = self.connections[i]
+                if conn is None or conn.transport.is_closing():
+                    conn = self.connections[i] = await connect(self.host, self.port, **self.kwargs)
+        return conn
+
+    async def request(self, payload):
+        conn = await self._connection(next(self._next))
+        return await conn.request(payload)
+
+    async def close(self):
+        await asyncio.gather(*(conn.close() for conn in self.connections if conn is not None))
+        self.connections = [None] * len(self.connections)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+async def run_load(host, port, payload_size, messages, concurrency=64, connections=4):
+    """以 concurrency 个协程通过有 connections 个连接的连接池发送 messages 条请求，返回 LoadStats，延迟单位为秒"""
+    payload = os.urandom(payload_size)
+    latencies = array.array('d')
+    counter = iter(range(messages))
+
+    async def worker(pool):
+        for _ in counter:
+            begin = perf_counter()
+            await pool.request(payload)
+            latencies.append(perf_counter() - begin)
+
+    async with FramePool(host, port, connections) as pool:
+        # 预先建立所有连接，不把握手时间计入结果
+        await asyncio.gather(*(pool.request(b'') for _ in range(connections)))
+        begin = perf_counter()
+        await asyncio.gather(*(worker(pool) for _ in range(concurrency)))
+        elapsed = perf_counter() - begin
+    latencies = sorted(latencies)
+    return LoadStats(messages, elapsed, messages / elapsed,
+                     latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)])
+
+
+class TcpTests(unittest.TestCase):
+
+    def test_echo(self):
+        """测试各种大小的负载，包括空帧和比接收缓冲区大的帧"""
+        async def main():
+            server = await start_server(buffer_size=1024)
+            port = server.sockets[0].getsockname()[1]
+            client = await connect('127.0.0.1', port, buffer_size=1024)
+            try:
+                for size in (0, 1, 64, 1023, 1024, 64 << 10, 1 << 20):
+                    payload = os.urandom(size)
+                    self.assertEqual(payload, await client.request(payload))
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(main())
+
+    def test_echo_to_slow_reader(self):
+        """测试客户端先发出所有请求、过一段时间才读取响应时，echo 的数据不会被之后收到的数据覆盖
+
+        服务端来不及发出的响应留在 transport 的缓冲区里，同时服务端继续把新的请求读到接收缓冲区中，
+        直到发送缓冲区超过上限，服务端暂停读取，剩下的请求积压在客户端。
+        """
+        async def main():
+            server = await start_server()
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            try:
+                payloads = [bytes([i]) * (1 << 20) for i in range(64)]
+                # 不能等待 drain：服务端暂停读取之后，客户端不读取响应，发送缓冲区就不会排空
+                for payload in payloads:
+                    writer.write(encode_frame(payload))
+                await asyncio.sleep(0.2)
+                # 超出内核缓冲区的请求没有被服务端读走，仍然留在客户端
+                self.assertGreater(writer.transport.get_write_buffer_size(), 0)
+                for payload in payloads:
+                    length = int.from_bytes(await reader.readexactly(HEADER_SIZE), 'big')
+                    self.assertEqual(payload, await reader.readexactly(length))
+            finally:
+                writer.close()
+                await writer.wait_closed()
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(main())
+
+    def test_server_pauses_reading(self):
+        """测试服务端的发送缓冲区超过上限时暂停读取请求，排空后恢复读取"""
+        class Transport:
+            reading = True
+
+            def pause_reading(self):
+                self.reading = False
+
+            def resume_reading(self):
+                self.reading = True
+
+        protocol = FrameServerProtocol()
+        protocol.connection_made(Transport())
+        protocol.pause_writing()
+        self.assertFalse(protocol.transport.reading)
+        protocol.resume_writing()
+        self.assertTrue(protocol.transport.reading)
+
+    def test_unsolicited_frame(self):
+        """测试服务端发来没有对应请求的帧时，客户端关闭连接，而不是在空的队列上出错"""
+        async def main():
+            async def handle(reader, writer):
+                writer.write(encode_frame(b'unsolicited'))
+                await reader.read()
+                writer.close()
+
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            client = await connect('127.0.0.1', port)
+            try:
+                await asyncio.wait_for(client.closed, 5)
+                with self.assertRaises(ConnectionResetError):
+                    await client.request(b'hello')
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(main())
+
+    def test_pipelining(self):
+        """测试在同一个连接上同时发出上千个请求，响应和请求一一对应"""
+        async def main():
+            server = await start_server(handler=lambda payload: bytes(payload).upper())
+            port = server.sockets[0].getsockname()[1]
+            client = await connect('127.0.0.1', port, buffer_size=4096)
+            try:
+                payloads = [f'message {i}'.encode() * (i % 50) for i in range(2000)]
+                responses = await asyncio.gather(*(client.request(p) for p in payloads))
+                self.assertEqual([p.upper() for p in payloads], responses)
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(main())
+
+    def test_pool(self):
+        """测试连接池把请求分配到多个连接上，并在连接断开后重新连接"""
+        async def main():
+            server = await start_server()
+            port = server.sockets[0].getsockname()[1]
+            async with FramePool('127.0.0.1', port, size=3) as pool:
+                payloads = [str(i).encode() for i in range(300)]
+                self.assertEqual(payloads, await asyncio.gather(*(pool.request(p) for p in payloads)))
+                self.assertTrue(all(conn is not None for conn in pool.connections))
+
+                await pool.connections[0].close()
+                self.assertEqual([b'a', b'b', b'c'], [await pool.request(p) for p in (b'a', b'b', b'c')])
+            server.close()
+            await server.wait_closed()
+
+        asyncio.run(main())
+
+    def test_oversized_frame(self):
+        """测试服务端收到超过上限的帧时关闭连接，等待中的请求以异常结束"""
+        async def main():
+            server = await start_server(max_frame_size=1024)
+            port = server.sockets[0].getsockname()[1]
+            client = await connect('127.0.0.1', port)
+            try:
+                self.assertEqual(b'x' * 1024, await client.request(b'x' * 1024))
+                with self.assertRaises(ConnectionError):
+                    await client.request(b'x' * 1025)
+                with self.assertRaises(ConnectionError):
+                    await client.request(b'x')
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(main())
+
+    def test_run_load(self):
+        async def main():
+            server = await start_server()
+            port = server.sockets[0].getsockname()[1]
+            try:
+                return await run_load('127.0.0.1', port, 64, 1000, concurrency=8, connections=2)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        stats = asyncio.run(main())
+        self.assertEqual(1000, stats.messages)
+        self.assertTrue(0 < stats.p50 <= stats.p99)
+
+
+@benchmark
+class TcpBenchmarks(unittest.TestCase):
+
+    def test_bench_loopback(self):
+        """回环地址上 64 B 和 64 KiB 负载的每秒消息数和 p50/p99 延迟"""
+        async def main(payload_size, messages, concurrency, connections):
+            server = await start_server()
+            port = server.sockets[0].getsockname()[1]
+            try:
+                return await run_load('127.0.0.1', port, payload_size, messages, concurrency, connections)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        for payload_size, messages in ((64, 200_000), (64 << 10, 20_000)):
+            for concurrency, connections in ((1, 1), (64, 1), (64, 4)):
+                stats = asyncio.run(main(payload_size, messages, concurrency, connections))
+                print(f'payload {payload_size:>6} B  concurrency {concurrency:>3}  connections {connections}  '
+                      f'{stats.rate:10.0f} msg/s  p50 {stats.p50 * 1e6:8.1f} us  p99 {stats.p99 * 1e6:8.1f} us')
 
 
 if __name__ == '__main__':
@@ -1,9 +1,218 @@
+import asyncio
+import collections
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter, thread_time
 
+from support import benchmark, generate_lines_file
 
-class MyTestCase(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)  # add assertion here
+
+MODELS = ('thread', 'process', 'asyncio')
+
+RunResult = collections.namedtuple('RunResult', ['model', 'workload', 'workers', 'tasks', 'elapsed', 'cpu', 'wall'])
+
+
+def hash_blocks(rounds, size=64):
+    """CPU 密集型任务：对 rounds 个小数据块计算 sha256
+
+    NOTE: hashlib 在数据超过 2047 字节时会释放 GIL，这里故意使用很小的块，使得任务的大部分时间都持有 GIL。
+    """
+    digest = hashlib.sha256()
+    block = bytes(size)
+    for i in range(rounds):
+        digest.update(block + i.to_bytes(8, 'little'))
+    return digest.hexdigest()
+
+
+def read_file(path, chunk_size=1 << 20):
+    """IO 密集型任务：按块读取整个文件，返回读取的字节数"""
+    total = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            total += len(chunk)
+    return total
+
+
+def read_and_hash(path, chunk_size=64 << 10):
+    """混合任务：读取文件的同时计算 sha256，hashlib 对大块数据会释放 GIL"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def _read_file_async(path):
+    # asyncio 没有真正的异步文件 IO，文件读取只能交给线程池
+    return await asyncio.to_thread(read_file, path)
+
+
+async def _read_and_hash_async(path, chunk_size=64 << 10):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := await asyncio.to_thread(f.read, chunk_size):
+            # 计算哈希在事件循环所在的线程中进行
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def _hash_blocks_async(rounds):
+    # CPU 密集型任务会阻塞事件循环，asyncio 下只能一个接一个地执行
+    return hash_blocks(rounds)
+
+
+# 工作负载名称 -> (同步版本, asyncio 版本)
+WORKLOADS = {
+    'cpu': (hash_blocks, _hash_blocks_async),
+    'io': (read_file, _read_file_async),
+    'mixed': (read_and_hash, _read_and_hash_async),
+}
+
+
+def _timed(func, arg):
+    """执行任务，返回 (结果, 墙上时间, 当前线程的 CPU 时间)"""
+    wall, cpu = perf_counter(), thread_time()
+    result = func(arg)
+    return result, perf_counter() - wall, thread_time() - cpu
+
+
+async def _timed_async(func, arg, semaphore):
+    async with semaphore:
+        wall, cpu = perf_counter(), thread_time()
+        result = await func(arg)
+        return result, perf_counter() - wall, thread_time() - cpu
+
+
+def run_workload(model, workload, args, workers):
+    """用指定的并发模型（thread、process 或 asyncio）和 workers 个工作者执行任务，返回 (结果列表, RunResult)
+
+    RunResult 中的 cpu 和 wall 分别是所有任务的 CPU 时间和墙上时间之和。对于 thread 模型下的 CPU 密集型任务，
+    一个任务在等待 GIL 时墙上时间在增长而 CPU 时间没有，因此 1 - cpu / wall 可以粗略地反映 GIL 的争用程度。
+    asyncio 模型下所有协程共用事件循环线程，一个协程在 await 期间，其他协程消耗的 CPU 时间也会计入它的 cpu，
+    这两个值没有意义。
+    """
+    sync, async_ = WORKLOADS[workload]
+    begin = perf_counter()
+    if model == 'thread':
+        with ThreadPoolExecutor(workers) as executor:
+            timed = list(executor.map(_timed, [sync] * len(args), args))
+    elif model == 'process':
+        with ProcessPoolExecutor(workers) as executor:
+            timed = list(executor.map(_timed, [sync] * len(args), args))
+    elif model == 'asyncio':
+        async def main():
+            # workers 限制同时在执行的协程数；默认线程池的大小也要足够，否则 to_thread 会成为瓶颈
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(workers))
+            semaphore = asyncio.Semaphore(workers)
+            return await asyncio.gather(*(_timed_async(async_, arg, semaphore) for arg in args))
+        timed = asyncio.run(main())
+    else:
+        raise ValueError(f'unknown concurrency model: {model!r}')
+    elapsed = perf_counter() - begin
+    results = [result for result, _, _ in timed]
+    return results, RunResult(model, workload, workers, len(args), elapsed,
+                              sum(cpu for _, _, cpu in timed), sum(wall for _, wall, _ in timed))
+
+
+def gil_enabled():
+    """当前解释器是否启用了 GIL；3.13 之前的版本总是启用的"""
+    return getattr(sys, '_is_gil_enabled', lambda: True)()
+
+
+def find_free_threaded_python():
+    """查找本机安装的自由线程（free-threaded，没有 GIL）版本的 Python 解释器，找不到时返回 None"""
+    if not gil_enabled():
+        return sys.executable
+    for name in ('python3.14t', 'python3.13t'):
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def format_result(r):
+    # 工作者数超过 CPU 核数时，操作系统的调度等待也会计入 wait，只有 thread 模型下超出的部分才来自 GIL；
+    # asyncio 模型下 cpu 和 wall 没有意义（见 run_workload），不显示 wait
+    if r.model == 'asyncio' or not r.wall:
+        wait = f'{"n/a":>6}'
+    else:
+        wait = f'{1 - r.cpu / r.wall:6.1%}'
+    return (f'{r.model:<8} {r.workload:<6} workers {r.workers:>3}  {r.tasks / r.elapsed:10.1f} tasks/s  '
+            f'elapsed {r.elapsed:7.3f}s  wait {wait}')
+
+
+def run_benchmark(max_workers=None, models=MODELS, workloads=tuple(WORKLOADS)):
+    """对每种并发模型和工作负载，从 1 个工作者增加到 max_workers 个，打印吞吐量和扩展性"""
+    max_workers = max_workers or os.cpu_count()
+    print(f'Python {sys.version.split()[0]}  GIL {"enabled" if gil_enabled() else "disabled"}  '
+          f'{os.cpu_count()} CPUs')
+    with tempfile.TemporaryDirectory() as tmp:
+        # IO 任务使用和 file_tests 中相同的测试文件，每个 8 MB
+        paths = [os.path.join(tmp, f'{i}.log') for i in range(max_workers * 4)]
+        for path in paths:
+            generate_lines_file(path, 8 << 20)
+        args = {'cpu': [200_000] * (max_workers * 4), 'io': paths, 'mixed': paths}
+
+        for workload in workloads:
+            for model in models:
+                workers = 1
+                while True:
+                    _, result = run_workload(model, workload, args[workload], workers)
+                    print(format_result(result))
+                    if workers >= max_workers:
+                        break
+                    workers = min(workers * 2, max_workers)
+
+
+class ThreadTests(unittest.TestCase):
+
+    def test_workloads(self):
+        """测试三种工作负载在每种并发模型下的结果都相同"""
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, f'{i}.log') for i in range(4)]
+            for path in paths:
+                generate_lines_file(path, 1 << 20)
+            args = {'cpu': [1000] * 4, 'io': paths, 'mixed': paths}
+
+            for workload, (sync, _) in WORKLOADS.items():
+                expected = [sync(arg) for arg in args[workload]]
+                for model in MODELS:
+                    with self.subTest(workload=workload, model=model):
+                        results, run = run_workload(model, workload, args[workload], workers=2)
+                        self.assertEqual(expected, results)
+                        self.assertEqual((model, workload, 2, 4), run[:4])
+                        # CPU 时间不会超过墙上时间（留出计时精度的余量）
+                        self.assertLessEqual(run.cpu, run.wall + 0.01)
+
+        with self.assertRaises(ValueError):
+            run_workload('greenlet', 'cpu', [1], 1)
+
+    def test_gil_enabled(self):
+        """普通的 CPython 构建都启用了 GIL，3.13 开始可以构建没有 GIL 的自由线程版本"""
+        if sys.version_info < (3, 13):
+            self.assertTrue(gil_enabled())
+        if not gil_enabled():
+            self.assertEqual(sys.executable, find_free_threaded_python())
+
+
+@benchmark
+class ThreadBenchmarks(unittest.TestCase):
+
+    def test_bench_concurrency_models(self):
+        """比较 thread、process、asyncio 在 CPU 密集、IO 密集和混合任务下的吞吐量与扩展性"""
+        run_benchmark()
+
+        # 如果安装了自由线程版本的 Python，用它再运行一次线程模型，和有 GIL 时对比
+        python = find_free_threaded_python()
+        if python is not None and python != sys.executable:
+            subprocess.run([python, '-c', 'import thread_tests; thread_tests.run_benchmark(models=("thread",))'],
+                           cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
 
 
 if __name__ == '__main__':
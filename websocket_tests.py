@@ -1,9 +1,539 @@
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import os
+import resource
+import tracemalloc
 import unittest
+from time import perf_counter
 
+from support import benchmark
 
-class MyTestCase(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)  # add assertion here
+
+# RFC 6455 握手时拼接在 Sec-WebSocket-Key 后面的固定 GUID
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+MAX_MESSAGE_SIZE = 1 << 20
+
+HubStats = collections.namedtuple('HubStats', ['clients', 'messages', 'sent', 'dropped', 'disconnected'])
+
+
+class WebSocketError(Exception):
+    pass
+
+
+class ConnectionClosed(WebSocketError):
+    def __init__(self, code=1005, reason=''):
+        super().__init__(f'connection closed: {code} {reason}'.rstrip())
+        self.code = code
+        self.reason = reason
+
+
+def accept_key(key):
+    """根据客户端的 Sec-WebSocket-Key 计算服务端应答的 Sec-WebSocket-Accept"""
+    return base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+
+
+def _mask(payload, key):
+    # 把整个负载当成一个大整数和重复的掩码做一次异或，比逐字节异或快得多
+    n = len(payload)
+    if not n:
+        return b''
+    key = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')).to_bytes(n, 'little')
+
+
+def encode_frame(payload, opcode=OP_TEXT, mask=False):
+    """编码一个完整（FIN=1）的帧，客户端发出的帧必须加掩码，服务端发出的帧不能加掩码"""
+    n = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if n < 126:
+        head = bytes((0x80 | opcode, mask_bit | n))
+    elif n < 1 << 16:
+        head = bytes((0x80 | opcode, mask_bit | 126)) + n.to_bytes(2, 'big')
+    else:
+        head = bytes((0x80 | opcode, mask_bit | 127)) + n.to_bytes(8, 'big')
+    if mask:
+        key = os.urandom(4)
+        return head + key + _mask(payload, key)
+    return head + payload
+
+
+def encode_close(code=1000, reason=''):
+    return code.to_bytes(2, 'big') + reason.encode()
+
+
+async def read_frame(reader, max_size=MAX_MESSAGE_SIZE, require_mask=False):
+    """读取一个帧，返回 (fin, opcode, payload)；require_mask 为 True 时（服务端）拒绝没有掩码的帧"""
+    b0, b1 = await reader.readexactly(2)
+    fin, opcode = bool(b0 & 0x80), b0 & 0x0F
+    n = b1 & 0x7F
+    # 控制帧不能分片，负载不能超过 125 字节（RFC 6455 §5.5）
+    if opcode >= OP_CLOSE and (not fin or n > 125):
+        raise WebSocketError(f'invalid control frame: opcode {opcode}, fin {fin}, length {n}')
+    if require_mask and not b1 & 0x80:
+        raise WebSocketError('client frame is not masked')
+    if n == 126:
+        n = int.from_bytes(await reader.readexactly(2), 'big')
+    elif n == 127:
+        n = int.from_bytes(await reader.readexactly(8), 'big')
+    if n > max_size:
+        raise WebSocketError(f'frame too large: {n} bytes')
+    key = await reader.readexactly(4) if b1 & 0x80 else None
+    payload = await reader.readexactly(n)
+    return fin, opcode, _mask(payload, key) if key else payload
+
+
+async def read_message(reader, max_size=MAX_MESSAGE_SIZE, require_mask=False, on_control=None):
+    """读取一条消息，返回 (opcode, payload)，把分片的数据帧拼接起来，控制帧原样返回
+
+    控制帧可以插在分片消息的各帧之间（RFC 6455 §5.4）：其中的 ping 和 pong 交给 on_control(opcode, payload) 处理
+    （为 None 时忽略）后继续拼接消息；close 则直接返回，未完成的消息被丢弃。
+    """
+    fin, opcode, payload = await read_frame(reader, max_size, require_mask)
+    if fin or opcode >= OP_CLOSE:
+        return opcode, payload
+    chunks = [payload]
+    size = len(payload)
+    while True:
+        fin, op, payload = await read_frame(reader, max_size, require_mask)
+        if op == OP_CLOSE:
+            return op, payload
+        if op > OP_CLOSE:
+            if on_control is not None:
+                on_control(op, payload)
+            continue
+        if op != OP_CONTINUATION:
+            raise WebSocketError(f'unexpected opcode {op} in fragmented message')
+        size += len(payload)
+        if size > max_size:
+            raise WebSocketError(f'message too large: {size} bytes')
+        chunks.append(payload)
+        if fin:
+            return opcode, b''.join(chunks)
+
+
+def _parse_head(data):
+    """解析 HTTP 请求或响应的起始行和头部，头部名称统一为小写"""
+    lines = data.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+
+class _Connection:
+    __slots__ = ('reader', 'writer', 'queue', 'ready', 'task')
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.queue = collections.deque()
+        self.ready = asyncio.Event()
+        self.task = None
+
+
+class BroadcastHub:
+    """向所有已连接的 WebSocket 客户端广播消息的服务端
+
+    每条消息只编码一次，同一个帧的 bytes 对象被放入所有客户端的发送队列中。每个客户端有一个发送协程，
+    每次把队列中已有的帧（最多 max_batch 个）合并成一次写入，再等待 drain()。
+    慢客户端的队列达到 max_queue 时，按 policy 处理：'drop' 丢弃队列中最旧的帧，'disconnect' 以 1008 关闭连接。
+    """
+
+    def __init__(self, max_queue=256, policy='drop', max_batch=64, on_message=None):
+        if policy not in ('drop', 'disconnect'):
+            raise ValueError(f'unknown policy: {policy!r}')
+        self.max_queue = max_queue
+        self.policy = policy
+        self.max_batch = max_batch
+        self.on_message = on_message
+        self.clients = set()
+        self.server = None
+        self._messages = self._sent = self._dropped = self._disconnected = 0
+
+    @property
+    def stats(self):
+        return HubStats(len(self.clients), self._messages, self._sent, self._dropped, self._disconnected)
+
+    async def start(self, host='127.0.0.1', port=0, backlog=1024):
+        self.server = await asyncio.start_server(self._handle, host, port, backlog=backlog)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        self.server.close()
+        for conn in list(self.clients):
+            self._disconnect(conn, 1001)
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @staticmethod
+    async def _handshake(reader, writer):
+        request, headers = _parse_head(await reader.readuntil(b'\r\n\r\n'))
+        key = headers.get('sec-websocket-key')
+        if not request.startswith('GET ') or headers.get('upgrade', '').lower() != 'websocket' or not key:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            raise WebSocketError('not a websocket handshake')
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Accept: ' + accept_key(key).encode() + b'\r\n\r\n')
+
+    async def _handle(self, reader, writer):
+        try:
+            await self._handshake(reader, writer)
+        except (WebSocketError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        conn = _Connection(reader, writer)
+        conn.task = asyncio.create_task(self._sender(conn))
+        self.clients.add(conn)
+
+        def on_control(opcode, payload):
+            if opcode == OP_PING:
+                writer.write(encode_frame(payload, OP_PONG))
+
+        try:
+            while conn in self.clients:
+                # 客户端发出的帧必须加掩码
+                opcode, payload = await read_message(reader, require_mask=True, on_control=on_control)
+                if opcode == OP_CLOSE:
+                    writer.write(encode_frame(payload[:2], OP_CLOSE))
+                    break
+                elif opcode in (OP_TEXT, OP_BINARY) and self.on_message is not None:
+                    self.on_message(self, payload.decode() if opcode == OP_TEXT else payload)
+                else:
+                    on_control(opcode, payload)
+        except WebSocketError:
+            # 违反协议的客户端以 1002 关闭连接
+            writer.write(encode_frame(encode_close(1002), OP_CLOSE))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._remove(conn)
+
+    async def _sender(self, conn):
+        queue, writer = conn.queue, conn.writer
+        try:
+            while True:
+                if not queue:
+                    conn.ready.clear()
+                    await conn.ready.wait()
+                batch = [queue.popleft() for _ in range(min(len(queue), self.max_batch))]
+                writer.writelines(batch)
+                self._sent += len(batch)
+                await writer.drain()
+        except ConnectionError:
+            self._remove(conn)
+
+    def _remove(self, conn):
+        if conn in self.clients:
+            self.clients.discard(conn)
+            conn.task.cancel()
+            conn.writer.close()
+
+    def _disconnect(self, conn, code):
+        conn.queue.clear()
+        conn.writer.write(encode_frame(encode_close(code), OP_CLOSE))
+        self._remove(conn)
+        self._disconnected += 1
+
+    def broadcast(self, message):
+        """把消息（str 作为文本帧，bytes 作为二进制帧）放入所有客户端的发送队列，不等待发送完成"""
+        if isinstance(message, str):
+            frame = encode_frame(message.encode(), OP_TEXT)
+        else:
+            frame = encode_frame(message, OP_BINARY)
+        self._messages += 1
+        for conn in list(self.clients):
+            queue = conn.queue
+            if len(queue) >= self.max_queue:
+                if self.policy == 'disconnect':
+                    self._disconnect(conn, 1008)
+                    continue
+                queue.popleft()
+                self._dropped += 1
+            queue.append(frame)
+            conn.ready.set()
+
+
+class WebSocketClient:
+    """极简的 WebSocket 客户端，用于测试和基准测试"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port, path='/'):
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n'.encode())
+        try:
+            status, headers = _parse_head(await reader.readuntil(b'\r\n\r\n'))
+        except asyncio.IncompleteReadError:
+            writer.close()
+            raise WebSocketError('connection closed during handshake')
+        if status.split()[1:2] != ['101'] or headers.get('sec-websocket-accept') != accept_key(key):
+            writer.close()
+            raise WebSocketError(f'handshake failed: {status}')
+        return cls(reader, writer)
+
+    async def recv(self):
+        """接收一条消息，文本消息返回 str，二进制消息返回 bytes，服务端关闭连接时抛出 ConnectionClosed"""
+        while True:
+            try:
+                opcode, payload = await read_message(self.reader, on_control=self._on_control)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.writer.close()
+                raise ConnectionClosed(1006)
+            if opcode == OP_TEXT:
+                return payload.decode()
+            elif opcode == OP_BINARY:
+                return payload
+            elif opcode == OP_CLOSE:
+                self.writer.close()
+                code = int.from_bytes(payload[:2], 'big') if len(payload) >= 2 else 1005
+                raise ConnectionClosed(code, payload[2:].decode())
+            else:
+                self._on_control(opcode, payload)
+
+    def _on_control(self, opcode, payload):
+        if opcode == OP_PING:
+            self.writer.write(encode_frame(payload, OP_PONG, mask=True))
+
+    async def send(self, message):
+        if isinstance(message, str):
+            self.writer.write(encode_frame(message.encode(), OP_TEXT, mask=True))
+        else:
+            self.writer.write(encode_frame(message, OP_BINARY, mask=True))
+        await self.writer.drain()
+
+    async def close(self, code=1000):
+        if not self.writer.is_closing():
+            self.writer.write(encode_frame(encode_close(code), OP_CLOSE, mask=True))
+            self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def _connect_many(host, port, n, batch=500):
+    clients = []
+    for i in range(0, n, batch):
+        clients += await asyncio.gather(*(WebSocketClient.connect(host, port) for _ in range(min(batch, n - i))))
+    return clients
+
+
+def _raise_fd_limit():
+    """把可打开文件数的软限制提高到硬限制，返回新的软限制"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ValueError, OSError):
+        return soft
+
+
+class WebSocketTests(unittest.TestCase):
+
+    def test_codec(self):
+        """测试帧的编解码，包括三种长度格式、掩码和分片消息"""
+        async def main():
+            for size in (0, 125, 126, 65535, 65536):
+                payload = os.urandom(size)
+                for mask in (False, True):
+                    reader = asyncio.StreamReader()
+                    reader.feed_data(encode_frame(payload, OP_BINARY, mask))
+                    self.assertEqual((True, OP_BINARY, payload), await read_frame(reader))
+
+            # 分片消息：第一帧 FIN=0，分片之间插入 ping 和 pong，它们交给 on_control，消息继续拼接
+            reader = asyncio.StreamReader()
+            reader.feed_data(bytes((OP_TEXT, 3)) + b'abc' + encode_frame(b'p', OP_PING))
+            reader.feed_data(bytes((OP_CONTINUATION, 2)) + b'de' + encode_frame(b'q', OP_PONG))
+            reader.feed_data(bytes((0x80 | OP_CONTINUATION, 1)) + b'f')
+            controls = []
+            self.assertEqual((OP_TEXT, b'abcdef'),
+                             await read_message(reader, on_control=lambda *frame: controls.append(frame)))
+            self.assertEqual([(OP_PING, b'p'), (OP_PONG, b'q')], controls)
+            # 分片之间的 close 直接返回，未完成的消息被丢弃
+            reader = asyncio.StreamReader()
+            reader.feed_data(bytes((OP_TEXT, 3)) + b'abc' + encode_frame(encode_close(1001), OP_CLOSE))
+            self.assertEqual((OP_CLOSE, encode_close(1001)), await read_message(reader))
+
+            reader = asyncio.StreamReader()
+            reader.feed_data(encode_frame(b'x' * 11, OP_BINARY))
+            with self.assertRaises(WebSocketError):
+                await read_frame(reader, max_size=10)
+            # 控制帧的负载不能超过 125 字节，也不能分片
+            for frame in (encode_frame(b'x' * 126, OP_PING), bytes((OP_PING, 1)) + b'x'):
+                reader = asyncio.StreamReader()
+                reader.feed_data(frame)
+                with self.assertRaises(WebSocketError):
+                    await read_frame(reader)
+            # require_mask 为 True 时拒绝没有掩码的帧
+            reader = asyncio.StreamReader()
+            reader.feed_data(encode_frame(b'abc'))
+            with self.assertRaises(WebSocketError):
+                await read_frame(reader, require_mask=True)
+
+        asyncio.run(main())
+        # RFC 6455 中的示例
+        self.assertEqual('s3pPLMBiTxaQ9kYGzzhZRbK+xOo=', accept_key('dGhlIHNhbXBsZSBub25jZQ=='))
+
+    def test_broadcast(self):
+        """测试广播给所有客户端，以及客户端发来的消息和 ping"""
+        async def main():
+            received = []
+            async with BroadcastHub(on_message=lambda hub, message: received.append(message)) as hub:
+                host, port = hub.server.sockets[0].getsockname()[:2]
+                clients = await _connect_many(host, port, 20)
+                await clients[0].send('hello')
+                await clients[0].send(b'\x00\x01')
+                # 分片发送的消息，分片之间插入一个 ping
+                first = encode_frame(b'wor', OP_TEXT, mask=True)
+                clients[0].writer.write(bytes((first[0] & 0x7F,)) + first[1:])
+                clients[0].writer.write(encode_frame(b'p', OP_PING, mask=True))
+                clients[0].writer.write(encode_frame(b'ld', OP_CONTINUATION, mask=True))
+                await asyncio.sleep(0.05)
+
+                hub.broadcast('text')
+                hub.broadcast(b'binary')
+                for client in clients:
+                    # 第一个客户端会先收到 pong，recv() 不返回控制帧，这里直接读取帧来确认
+                    if client is clients[0]:
+                        self.assertEqual((True, OP_PONG, b'p'), await read_frame(client.reader))
+                    self.assertEqual('text', await client.recv())
+                    self.assertEqual(b'binary', await client.recv())
+
+                self.assertEqual(['hello', b'\x00\x01', 'world'], received)
+                self.assertEqual(HubStats(20, 2, 40, 0, 0), hub.stats)
+
+                await clients[1].close()
+                await asyncio.sleep(0.05)
+                self.assertEqual(19, hub.stats.clients)
+
+            # 服务器关闭时以 1001 关闭所有连接
+            with self.assertRaises(ConnectionClosed) as cm:
+                await clients[2].recv()
+            self.assertEqual(1001, cm.exception.code)
+            await asyncio.gather(*(client.close() for client in clients))
+
+        asyncio.run(main())
+
+    def test_protocol_errors(self):
+        """测试服务端以 1002 关闭违反协议的连接：没有掩码的帧、超过 125 字节的控制帧"""
+        async def main():
+            async with BroadcastHub() as hub:
+                host, port = hub.server.sockets[0].getsockname()[:2]
+                for frame in (encode_frame(b'hello'), encode_frame(b'x' * 126, OP_PING, mask=True)):
+                    client = await WebSocketClient.connect(host, port)
+                    client.writer.write(frame)
+                    with self.assertRaises(ConnectionClosed) as cm:
+                        await client.recv()
+                    self.assertEqual(1002, cm.exception.code)
+                    await client.close()
+                await asyncio.sleep(0.05)
+                self.assertEqual(0, hub.stats.clients)
+
+        asyncio.run(main())
+
+    def test_slow_client_policies(self):
+        """测试发送队列满时的两种策略：丢弃最旧的消息，或者断开连接"""
+        async def main(policy):
+            async with BroadcastHub(max_queue=10, policy=policy) as hub:
+                host, port = hub.server.sockets[0].getsockname()[:2]
+                client = await WebSocketClient.connect(host, port)
+                await asyncio.sleep(0.05)
+                # 连续广播而不让出事件循环，发送协程来不及运行，队列必然溢出
+                for i in range(100):
+                    hub.broadcast(str(i))
+                stats = hub.stats
+                if policy == 'drop':
+                    self.assertEqual([str(i) for i in range(90, 100)], [await client.recv() for _ in range(10)])
+                    self.assertEqual(HubStats(1, 100, 0, 90, 0), stats)
+                else:
+                    with self.assertRaises(ConnectionClosed) as cm:
+                        await client.recv()
+                    self.assertEqual(1008, cm.exception.code)
+                    self.assertEqual(HubStats(0, 100, 0, 0, 1), stats)
+                await client.close()
+
+        asyncio.run(main('drop'))
+        asyncio.run(main('disconnect'))
+        with self.assertRaises(ValueError):
+            BroadcastHub(policy='block')
+
+    def test_bad_handshake(self):
+        async def main():
+            async with BroadcastHub() as hub:
+                host, port = hub.server.sockets[0].getsockname()[:2]
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+                self.assertTrue((await reader.read()).startswith(b'HTTP/1.1 400'))
+                writer.close()
+                self.assertEqual(0, hub.stats.clients)
+
+        asyncio.run(main())
+
+
+@benchmark
+class WebSocketBenchmarks(unittest.TestCase):
+
+    def test_bench_fan_out(self):
+        """向最多 10000 个客户端广播，测量每个连接的内存占用，以及从广播到最后一个客户端收到消息的延迟
+
+        客户端和服务端在同一个进程中，每个连接占用两个文件描述符，客户端数受文件描述符上限的限制；
+        内存占用也同时包含了连接的两端。
+        """
+        n = min(10000, (_raise_fd_limit() - 100) // 2)
+
+        async def main():
+            async with BroadcastHub(max_queue=1024) as hub:
+                host, port = hub.server.sockets[0].getsockname()[:2]
+                tracemalloc.start()
+                clients = await _connect_many(host, port, n)
+                await asyncio.sleep(0.1)
+                memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                print(f'{n} clients  {memory / n / 1024:.1f} KiB per connection (client + server)')
+
+                async def receive(client, count):
+                    latencies = []
+                    for _ in range(count):
+                        sent = json.loads(await client.recv())['ts']
+                        latencies.append(perf_counter() - sent)
+                    return latencies
+
+                for size in (16, 1024):
+                    count = 20
+                    tasks = [asyncio.create_task(receive(client, count)) for client in clients]
+                    begin = perf_counter()
+                    for _ in range(count):
+                        hub.broadcast(json.dumps({'ts': perf_counter(), 'data': 'x' * size}))
+                        await asyncio.sleep(0)
+                    latencies = sorted(sum(await asyncio.gather(*tasks), []))
+                    elapsed = perf_counter() - begin
+                    print(f'payload {size:>5} B  {count * n / elapsed:10.0f} deliveries/s  '
+                          f'p50 {latencies[len(latencies) // 2] * 1000:8.2f} ms  '
+                          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:8.2f} ms  '
+                          f'max {latencies[-1] * 1000:8.2f} ms')
+
+                await asyncio.gather(*(client.close() for client in clients))
+
+        asyncio.run(main())
 
 
 if __name__ == '__main__':